@@ -1,14 +1,48 @@
 import dash
-from dash import dcc, html, Input, Output, State, callback_context, dash_table, ALL
+import diskcache
+from dash import dcc, html, Input, Output, State, callback_context, dash_table, ALL, ClientsideFunction
 import dash_bootstrap_components as dbc
-import pandas as pd
-from sqlalchemy import create_engine, text
-import plotly.express as px
-import plotly.graph_objects as go
+from flask import Response, request, send_file, abort, g
+from sqlalchemy import create_engine, text, event, bindparam
+from sqlalchemy.pool import QueuePool
+import plotly.graph_objects as go  # já carregado pelo próprio dash
+from plotly.io.json import to_json_plotly
 import os
+import sys
+import importlib
+import contextvars
+import functools
+import threading
+import time
+import contextlib
+import csv
+import io
+import json
+import hashlib
+import base64
+import itertools
+import tempfile
+from urllib.parse import urlencode
+from cachetools import TTLCache, LRUCache
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from datetime import date, datetime
-from dateutil.relativedelta import relativedelta
+from decimal import Decimal
+
+# --- IMPORTS TARDIOS ---
+# pandas/numpy/plotly.express custam ~0,4s de import e só são usados dentro de loaders e callbacks:
+# cada worker sobe sem eles e os carrega no primeiro acesso a um atributo.
+class _ModuloTardio:
+    def __init__(self, nome): self._nome = nome
+    def __getattr__(self, attr):
+        modulo = importlib.import_module(self._nome)
+        self.__dict__.update(modulo.__dict__)  # próximos acessos não passam mais pelo __getattr__
+        return getattr(modulo, attr)
+
+pd = _ModuloTardio("pandas")
+np = _ModuloTardio("numpy")
+px = _ModuloTardio("plotly.express")
+pl = _ModuloTardio("polars")
 
 # --- 1. CONFIGURAÇÃO E SEGURANÇA ---
 # Carrega variáveis de ambiente do arquivo .env
@@ -23,216 +57,632 @@ if not db_url:
 elif db_url.startswith("postgres://"):
     db_url = db_url.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(db_url)
-
-# --- 2. INICIALIZAÇÃO DO BANCO (COM HISTÓRICO) ---
-def init_db():
-    try:
-        with engine.connect() as conn:
-            conn.execute(text("CREATE TABLE IF NOT EXISTS projetos (id SERIAL PRIMARY KEY, nome VARCHAR(255));"))
-            
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS cronograma_etapas (
-                    id SERIAL PRIMARY KEY, projeto_id INTEGER REFERENCES projetos(id),
-                    etapa VARCHAR(100), data_inicio DATE, data_fim DATE,
-                    valor_estimado NUMERIC(15,2) DEFAULT 0, status VARCHAR(50) DEFAULT 'A Fazer'
-                );
-            """))
-            # Garante coluna percentual (caso banco antigo)
-            try: conn.execute(text("ALTER TABLE cronograma_etapas ADD COLUMN IF NOT EXISTS percentual INTEGER DEFAULT 0;"))
-            except: pass
-
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS despesas (
-                    id SERIAL PRIMARY KEY, projeto_id INTEGER REFERENCES projetos(id),
-                    categoria VARCHAR(100), descricao VARCHAR(255),
-                    valor NUMERIC(15,2), data_pagamento DATE, status VARCHAR(50) DEFAULT 'Pago'
-                );
-            """))
-            
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS permutas (
-                    id SERIAL PRIMARY KEY, projeto_id INTEGER REFERENCES projetos(id),
-                    descricao VARCHAR(255), data_permuta DATE, valor NUMERIC(15,2) DEFAULT 0
-                );
-            """))
-
-            # --- NOVA TABELA: HISTÓRICO FÍSICO ---
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS historico_fisico (
-                    id SERIAL PRIMARY KEY,
-                    etapa_id INTEGER REFERENCES cronograma_etapas(id) ON DELETE CASCADE,
-                    data_registro DATE DEFAULT CURRENT_DATE,
-                    percentual_novo INTEGER
-                );
-            """))
-            
-            conn.commit()
-    except Exception as e:
-        print(f"Erro DB Init: {e}")
-
-init_db()
-
-def update_db_schema():
-    try:
-        with engine.connect() as conn:
-            conn.execute(text("ALTER TABLE projetos ADD COLUMN IF NOT EXISTS empresa VARCHAR(100) DEFAULT 'Própria';"))
-            conn.commit()
-    except: pass
-
-update_db_schema()
+# --- POOL DE CONEXÕES ---
+# Dimensionamento configurável por ambiente (gunicorn com vários workers divide o limite de conexões do Postgres)
+pool_stats = {'checkouts': 0, 'espera_total_s': 0.0, 'espera_max_s': 0.0, 'timeouts': 0}
+
+class QueuePoolMedido(QueuePool):
+    # QueuePool que mede quanto tempo cada checkout esperou por uma conexão livre
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try: return super()._do_get()
+        except Exception:
+            pool_stats['timeouts'] += 1
+            raise
+        finally:
+            espera = time.perf_counter() - inicio
+            pool_stats['checkouts'] += 1
+            pool_stats['espera_total_s'] += espera
+            pool_stats['espera_max_s'] = max(pool_stats['espera_max_s'], espera)
+
+def _opcoes_pool():
+    if ":memory:" in db_url: return {}
+    return {
+        "poolclass": QueuePoolMedido,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
+
+engine = create_engine(db_url, **_opcoes_pool())
+# Processos filhos (callbacks em segundo plano) não podem reaproveitar as conexões herdadas do pai
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+# --- 2. ESQUEMA DO BANCO (MIGRAÇÕES) ---
+# O esquema é versionado com alembic (migrations/); cada deploy registra sua versão em alembic_version.
+# Nada de DDL no import: aplicar uma vez por deploy com "python app.py migrar" (ou "alembic upgrade head").
+def migrar(revisao="head"):
+    from alembic import command
+    from alembic.config import Config
+    cfg = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+    with engine.connect() as conn:
+        cfg.attributes["connection"] = conn
+        command.upgrade(cfg, revisao)
+        conn.commit()
+
+# --- MÉTRICAS (TEMPO, LINHAS, PAYLOAD E ERROS) ---
+# Histogramas em processo, expostos no formato texto do Prometheus em GET /metrics (sem coletor nem dependência extra).
+# Cobrem cada callback do Dash (hooks do Flask; os de segundo plano medem no processo do job), cada loader get_*
+# e cada statement SQL (eventos do engine). Cada worker expõe os próprios números; o Prometheus soma por instância.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_LINHAS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BUCKETS_BYTES = (1024, 10240, 102400, 524288, 1048576, 5242880, 20971520)
+_PID_WORKER = os.getpid()  # jobs dos callbacks em segundo plano rodam em processos filhos
+
+def _rotulos(chave, le=None):
+    # {k="v",...} com as aspas/barras escapadas; le= é o limite do bucket nos histogramas
+    pares = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')) for k, v in chave]
+    if le is not None: pares.append(('le', le))
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}" if pares else ""
+
+class Contador:
+    def __init__(self, nome, ajuda):
+        self.nome, self.ajuda, self.series, self.lock = nome, ajuda, {}, threading.Lock()
+    def incrementar(self, valor=1, **rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self.lock: self.series[chave] = self.series.get(chave, 0) + valor
+    def exportar(self):
+        with self.lock: series = dict(self.series)
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"] + [f"{self.nome}{_rotulos(k)} {v}" for k, v in sorted(series.items())]
+
+class Histograma:
+    def __init__(self, nome, ajuda, buckets):
+        self.nome, self.ajuda, self.buckets, self.series, self.lock = nome, ajuda, buckets, {}, threading.Lock()
+    def observar(self, valor, **rotulos):
+        # series[rótulos] = [contagem acumulada por bucket..., soma, total]
+        chave = tuple(sorted(rotulos.items()))
+        with self.lock:
+            serie = self.series.setdefault(chave, [0] * len(self.buckets) + [0.0, 0])
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite: serie[i] += 1
+            serie[-2] += valor; serie[-1] += 1
+    def exportar(self):
+        with self.lock: series = {k: list(v) for k, v in self.series.items()}
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for chave, serie in sorted(series.items()):
+            linhas += [f"{self.nome}_bucket{_rotulos(chave, limite)} {n}" for limite, n in zip(self.buckets, serie)]
+            linhas += [f"{self.nome}_bucket{_rotulos(chave, '+Inf')} {serie[-1]}", f"{self.nome}_sum{_rotulos(chave)} {serie[-2]}", f"{self.nome}_count{_rotulos(chave)} {serie[-1]}"]
+        return linhas
+
+metrica_callback_segundos = Histograma("dash_callback_duracao_segundos", "Tempo de execução dos callbacks do Dash.", BUCKETS_SEGUNDOS)
+metrica_callback_bytes = Histograma("dash_callback_payload_bytes", "Tamanho da resposta JSON dos callbacks.", BUCKETS_BYTES)
+metrica_callback_erros = Contador("dash_callback_erros_total", "Callbacks que terminaram em exceção (HTTP 500).")
+metrica_loader_segundos = Histograma("loader_duracao_segundos", "Tempo dos loaders get_* (cache incluído).", BUCKETS_SEGUNDOS)
+metrica_loader_linhas = Histograma("loader_linhas", "Linhas devolvidas pelos loaders get_*.", BUCKETS_LINHAS)
+metrica_loader_erros = Contador("loader_erros_total", "Chamadas de loader com erro de SQL (mesmo quando o loader devolve vazio).")
+metrica_sql_segundos = Histograma("sql_duracao_segundos", "Tempo de cada statement SQL por operação e origem (loader ou callback).", BUCKETS_SEGUNDOS)
+metrica_sql_linhas = Histograma("sql_linhas", "Linhas afetadas/devolvidas informadas pelo driver (rowcount).", BUCKETS_LINHAS)
+metrica_sql_erros = Contador("sql_erros_total", "Statements SQL que falharam.")
+metrica_sql_lentas = Contador("sql_lentas_total", "Statements acima de SLOW_QUERY_MS.")
+METRICAS = [metrica_callback_segundos, metrica_callback_bytes, metrica_callback_erros, metrica_loader_segundos, metrica_loader_linhas, metrica_loader_erros,
+            metrica_sql_segundos, metrica_sql_linhas, metrica_sql_erros, metrica_sql_lentas]
+
+# Quem está emitindo o SQL (nome do loader ou do callback) e os erros de SQL do loader em curso
+_origem_sql = contextvars.ContextVar("origem_sql", default="-")
+_erros_loader = contextvars.ContextVar("erros_loader", default=None)
+
+def _operacao_sql(statement):
+    op = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+    return "SELECT" if op == "WITH" else op
+
+@event.listens_for(engine, "before_cursor_execute")
+def _inicio_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_query', []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _fim_query(conn, cursor, statement, parameters, context, executemany):
+    duracao = time.perf_counter() - conn.info['inicio_query'].pop()
+    op, origem = _operacao_sql(statement), _origem_sql.get()
+    metrica_sql_segundos.observar(duracao, operacao=op, origem=origem)
+    if cursor.rowcount is not None and cursor.rowcount >= 0: metrica_sql_linhas.observar(cursor.rowcount, operacao=op, origem=origem)
+    if duracao * 1000 >= SLOW_QUERY_MS:
+        metrica_sql_lentas.incrementar(origem=origem)
+        print(f"[query lenta] {duracao * 1000:.0f} ms ({origem}): {' '.join(statement.split())[:500]}")
+
+@event.listens_for(engine, "handle_error")
+def _erro_query(ctx):
+    pilha = ctx.connection.info.get('inicio_query') if ctx.connection is not None else None
+    if pilha: pilha.pop()
+    origem = _origem_sql.get()
+    metrica_sql_erros.incrementar(operacao=_operacao_sql(ctx.statement or ""), origem=origem)
+    erros = _erros_loader.get()
+    if erros is not None: erros[0] += 1
+    # Os loaders engolem a exceção e devolvem vazio: o log é o único rastro do motivo
+    print(f"[erro sql] {origem}: {type(ctx.original_exception).__name__}: {str(ctx.original_exception).splitlines()[0] if str(ctx.original_exception) else ''}")
+
+def _contar_linhas(resultado):
+    if resultado is None: return 0
+    if isinstance(resultado, tuple) and resultado and isinstance(resultado[0], list): return len(resultado[0])  # get_pagina
+    return len(resultado) if hasattr(resultado, '__len__') and not isinstance(resultado, dict) else 1
+
+def instrumentado(func):
+    # Tempo, linhas e erros de SQL do loader; o SQL emitido dentro dele leva o nome do loader como origem
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        erros = [0]
+        tokens = _origem_sql.set(func.__name__), _erros_loader.set(erros)
+        inicio = time.perf_counter()
+        try:
+            resultado = func(*args, **kwargs)
+            metrica_loader_linhas.observar(_contar_linhas(resultado), loader=func.__name__)
+            return resultado
+        except Exception:
+            erros[0] += 1
+            raise
+        finally:
+            _origem_sql.reset(tokens[0]); _erros_loader.reset(tokens[1])
+            metrica_loader_segundos.observar(time.perf_counter() - inicio, loader=func.__name__)
+            if erros[0]: metrica_loader_erros.incrementar(loader=func.__name__)
+    return wrapper
+
+def _registrar_callback_background(nome, duracao, erro, queries=0, cache_delta=None):
+    # Processo do job: entrega a medição, as queries do snapshot e os acertos/misses do cache das tabelas
+    # na fila do diskcache do DiskcacheManager; o worker os incorpora (o estado do processo filho morre com ele)
+    try: background_manager.handle.push((nome, duracao, erro, queries, cache_delta or {}), prefix="metricas", expire=3600)
+    except Exception as e: print(f"Erro métricas background: {e}")
+
+def _coletar_metricas_background():
+    while True:
+        _, item = background_manager.handle.pull(prefix="metricas")
+        if item is None: return
+        nome, duracao, erro, queries, cache_delta = item
+        metrica_callback_segundos.observar(duracao, callback=nome)
+        if erro: metrica_callback_erros.incrementar(callback=nome)
+        _contar_queries_callback(nome, queries)
+        for k, v in cache_delta.items(): cache_stats[k] += v
 
 # --- 3. MODEL E DADOS ---
 
+# --- SNAPSHOT POR CALLBACK ---
+# Dentro de um callback marcado com @com_snapshot cada loader é executado uma única vez
+# e o mesmo resultado é entregue a todos os KPIs, tabelas e gráficos daquela invocação.
+_snapshot_atual = contextvars.ContextVar("snapshot_atual", default=None)
+queries_por_callback = {}  # nome do callback -> {'chamadas', 'queries', 'ultima'}
+
+class Snapshot:
+    def __init__(self, nome):
+        self.nome = nome
+        self.dados = {}
+        self.queries = 0
+        self.conn = None  # conexão/transação de leitura compartilhada pelos loaders do callback
+        self.thread = threading.get_ident()
+        self.lock = threading.Lock()
+
+@contextlib.contextmanager
+def conexao_leitura():
+    # Dentro de um snapshot todos os loaders get_* usam a mesma conexão (um único checkout e uma transação de leitura por callback)
+    snap = _snapshot_atual.get()
+    if snap is None or snap.thread != threading.get_ident():
+        with engine.connect() as conn: yield conn
+        return
+    if snap.conn is None:
+        snap.conn = engine.connect()
+        snap.conn.begin()
+    try: yield snap.conn
+    except Exception:
+        # Transação abortada não serve aos próximos loaders; o próximo abre outra
+        snap.conn.close(); snap.conn = None
+        raise
+
+@event.listens_for(engine, "before_cursor_execute")
+def _contar_query(conn, cursor, statement, parameters, context, executemany):
+    snap = _snapshot_atual.get()
+    if snap is not None:
+        with snap.lock: snap.queries += 1
+
+def usa_snapshot(func):
+    # Memoriza o loader no snapshot ativo; devolve cópia para que os consumidores possam alterar colunas à vontade
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        snap = _snapshot_atual.get()
+        if snap is None: return func(*args, **kwargs)
+        chave = (func.__name__, args, tuple(sorted(kwargs.items())))
+        if chave not in snap.dados: snap.dados[chave] = func(*args, **kwargs)
+        return snap.dados[chave].copy()
+    return wrapper
+
+def _contar_queries_callback(nome, queries):
+    stats = queries_por_callback.setdefault(nome, {'chamadas': 0, 'queries': 0, 'ultima': 0})
+    stats['chamadas'] += 1; stats['queries'] += queries; stats['ultima'] = queries
+
+def com_snapshot(func):
+    # Abre um snapshot para a invocação do callback e contabiliza as queries emitidas
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _snapshot_atual.get() is not None: return func(*args, **kwargs)
+        snap = Snapshot(func.__name__)
+        token = _snapshot_atual.set(snap)
+        origem = _origem_sql.set(func.__name__)
+        inicio, erro, em_job = time.perf_counter(), False, os.getpid() != _PID_WORKER
+        cache_inicio = dict(cache_stats)
+        try: return func(*args, **kwargs)
+        except dash.exceptions.PreventUpdate: raise
+        except Exception:
+            erro = True
+            raise
+        finally:
+            _snapshot_atual.reset(token); _origem_sql.reset(origem)
+            if em_job: _registrar_callback_background(snap.nome, time.perf_counter() - inicio, erro, snap.queries, {k: cache_stats[k] - cache_inicio[k] for k in cache_stats})
+            if snap.conn is not None: snap.conn.close()
+            _contar_queries_callback(snap.nome, snap.queries)
+            if os.getenv("LOG_QUERIES_CALLBACK"): print(f"[queries] {snap.nome}: {snap.queries}")
+    return wrapper
+
+# --- CARGA PARALELA DOS LOADERS ---
+# Loaders independentes passam a maior parte do tempo esperando a rede; rodando em paralelo a página
+# custa a query mais lenta, não a soma. A concorrência é limitada para não esgotar o pool de conexões.
+LOADERS_PARALELOS = int(os.getenv("LOADERS_PARALELOS", "4"))
+_executor_loaders = None
+
+def _resetar_executor_loaders():
+    # Threads não sobrevivem ao fork: o processo filho cria o próprio executor
+    global _executor_loaders
+    _executor_loaders = None
+
+os.register_at_fork(after_in_child=_resetar_executor_loaders)
+
+def carregar_em_paralelo(*chamadas):
+    # chamadas: tuplas (loader, *args). Dentro de um snapshot os resultados ficam memorizados para o restante
+    # do callback; cada thread usa a própria conexão (a conexão do snapshot pertence à thread do callback).
+    global _executor_loaders
+    if len(chamadas) < 2 or _snapshot_atual.get() is None: return
+    if _executor_loaders is None: _executor_loaders = ThreadPoolExecutor(max_workers=LOADERS_PARALELOS, thread_name_prefix="loader")
+    futuros = [_executor_loaders.submit(contextvars.copy_context().run, loader, *args) for loader, *args in chamadas]
+    for f in futuros: f.result()
+
+# --- CACHE DAS TABELAS BASE ---
+# Cache em processo por loader, com TTL e tamanho limitado. Cada entrada guarda a versão das tabelas
+# de que depende (versao_dados); uma escrita em qualquer worker incrementa a versão e torna a entrada obsoleta.
+_cache_tabelas = TTLCache(maxsize=int(os.getenv("CACHE_MAX_ENTRADAS", "64")), ttl=int(os.getenv("CACHE_TTL_SEGUNDOS", "300")))
+_cache_lock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0, 'invalidacoes': 0}
+
+@usa_snapshot
+@instrumentado
+def get_versoes_dados():
+    # Uma única leitura das versões por callback (memorizada no snapshot)
+    try:
+        with conexao_leitura() as conn: return dict(conn.execute(text("SELECT tabela, versao FROM versao_dados")).all())
+    except: return {}
+
+def cache_tabelas(*tabelas):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            em_job = os.getpid() != _PID_WORKER
+            if not em_job: _coletar_tabelas_background()
+            versoes = get_versoes_dados()
+            versao = tuple(versoes.get(t, 0) for t in tabelas)
+            chave = (func.__name__,) + args
+            with _cache_lock: item = _cache_tabelas.get(chave)
+            if item is not None and item[1] == versao:
+                cache_stats['hits'] += 1
+                return item[2].copy()
+            cache_stats['misses'] += 1
+            df = func(*args)
+            with _cache_lock: _cache_tabelas[chave] = (tabelas, versao, df)
+            if em_job:
+                # Job em segundo plano: a entrada só sobrevive se for entregue ao worker
+                try: background_manager.handle.push((chave, tabelas, versao, df), prefix="tabelas", expire=3600)
+                except Exception as e: print(f"Erro cache background: {e}")
+            return df.copy()
+        return wrapper
+    return decorator
+
+def _coletar_tabelas_background():
+    # Worker: incorpora as tabelas que os jobs carregaram (a versão gravada com a entrada decide se ainda vale)
+    while True:
+        _, item = background_manager.handle.pull(prefix="tabelas")
+        if item is None: return
+        chave, tabelas, versao, df = item
+        with _cache_lock:
+            atual = _cache_tabelas.get(chave)
+            if atual is None or atual[1] <= versao: _cache_tabelas[chave] = (tabelas, versao, df)
+
+def invalidar_cache(*tabelas):
+    # Descarta localmente as entradas que dependem das tabelas alteradas
+    with _cache_lock:
+        for chave in [k for k, item in _cache_tabelas.items() if set(item[0]) & set(tabelas)]:
+            _cache_tabelas.pop(chave, None)
+            cache_stats['invalidacoes'] += 1
+    snap = _snapshot_atual.get()
+    if snap is not None: snap.dados.clear()
+
+def registrar_escrita(conn, *tabelas):
+    # Chamar dentro da transação de INSERT/UPDATE/DELETE: incrementa a versão no banco (visível aos outros workers) e limpa o cache local
+    for t in tabelas:
+        conn.execute(text("INSERT INTO versao_dados (tabela, versao) VALUES (:t, 1) ON CONFLICT (tabela) DO UPDATE SET versao = versao_dados.versao + 1"), {"t": t})
+    invalidar_cache(*tabelas)
+
+# --- TIPOS DAS TABELAS BASE ---
+# O driver devolve NUMERIC como Decimal e DATE como date, em colunas object: toda soma/groupby roda em objetos Python.
+# Os loaders entregam dinheiro em float64, datas em datetime64 e nomes repetidos (obra, categoria, status) como category.
+# groupby em coluna category deve usar observed=True (senão aparecem combinações sem linhas).
+def _tipar(df, dinheiro=(), datas=(), categorias=()):
+    for col in dinheiro: df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    for col in datas: df[col] = pd.to_datetime(df[col], errors='coerce')
+    for col in categorias: df[col] = df[col].astype('category')
+    return df
+
+@usa_snapshot
+@cache_tabelas('projetos')
+@instrumentado
 def get_projetos():
-    try: return pd.read_sql("SELECT id, nome, empresa FROM projetos ORDER BY id DESC", engine)
+    try:
+        with conexao_leitura() as conn: return _tipar(pd.read_sql_query("SELECT id, nome, empresa FROM projetos ORDER BY id DESC", conn), categorias=['empresa'])
     except: return pd.DataFrame(columns=['id', 'nome', 'empresa'])
 
+@usa_snapshot
+@cache_tabelas('cronograma_etapas', 'projetos')
+@instrumentado
 def get_cronograma():
     try:
         sql = """SELECT p.nome as projeto, e.projeto_id, e.id as id_etapa, e.etapa, e.data_inicio, e.data_fim, e.valor_estimado, e.status, e.percentual 
                  FROM cronograma_etapas e JOIN projetos p ON e.projeto_id = p.id ORDER BY p.nome, e.data_inicio"""
-        return pd.read_sql(sql, engine)
+        with conexao_leitura() as conn: df = pd.read_sql_query(sql, conn)
+        return _tipar(df, dinheiro=['valor_estimado'], datas=['data_inicio', 'data_fim'], categorias=['projeto', 'status'])
     except: return pd.DataFrame()
 
+@instrumentado
+def get_etapa(etapa_id):
+    # Uma etapa no formato de get_cronograma (Patch do Gantt/tabela após salvar)
+    sql = """SELECT p.nome as projeto, e.projeto_id, e.id as id_etapa, e.etapa, e.data_inicio, e.data_fim, e.valor_estimado, e.status, e.percentual
+             FROM cronograma_etapas e JOIN projetos p ON e.projeto_id = p.id WHERE e.id = :id"""
+    with conexao_leitura() as conn: return pd.read_sql_query(text(sql), conn, params={"id": etapa_id})
+
+@usa_snapshot
+@cache_tabelas('despesas', 'projetos')
+@instrumentado
 def get_despesas_realizadas():
     try:
         sql = """SELECT d.id, p.nome as projeto, d.projeto_id, d.categoria, d.descricao, d.valor, d.data_pagamento, d.status 
                  FROM despesas d JOIN projetos p ON d.projeto_id = p.id ORDER BY d.data_pagamento DESC"""
-        return pd.read_sql(sql, engine)
+        with conexao_leitura() as conn: df = pd.read_sql_query(sql, conn)
+        return _tipar(df, dinheiro=['valor'], datas=['data_pagamento'], categorias=['projeto', 'categoria', 'status'])
     except: return pd.DataFrame()
 
+@usa_snapshot
+@cache_tabelas('permutas', 'projetos')
+@instrumentado
 def get_permutas():
     try:
         sql = """SELECT pm.id, p.nome as projeto, pm.projeto_id, pm.descricao, pm.valor, pm.data_permuta 
                  FROM permutas pm JOIN projetos p ON pm.projeto_id = p.id ORDER BY pm.data_permuta DESC"""
-        return pd.read_sql(sql, engine)
+        with conexao_leitura() as conn: df = pd.read_sql_query(sql, conn)
+        return _tipar(df, dinheiro=['valor'], datas=['data_permuta'], categorias=['projeto'])
     except: return pd.DataFrame()
 
+# --- PAGINAÇÃO NO SERVIDOR (tabelas de despesas / permutas) ---
+# Cada interação da DataTable traz só uma página. A ordenação é sempre (coluna, id) com NULLs no fim,
+# o que permite paginação por keyset a partir da última linha da página anterior.
+PAGINACAO = {
+    'despesas': {
+        'from': "despesas d JOIN projetos p ON d.projeto_id = p.id",
+        'select': "d.id, p.nome as projeto, d.projeto_id, d.categoria, d.descricao, d.valor, d.data_pagamento, d.status",
+        'colunas': {'projeto': 'p.nome', 'categoria': 'd.categoria', 'descricao': 'd.descricao', 'valor': 'd.valor', 'data_pagamento': 'd.data_pagamento', 'status': 'd.status'},
+        'id': 'd.id', 'ordem_padrao': ('data_pagamento', 'desc'), 'data': 'd.data_pagamento', 'projeto_id': 'd.projeto_id', 'numericas': {'valor'},
+    },
+    'permutas': {
+        'from': "permutas pm JOIN projetos p ON pm.projeto_id = p.id",
+        'select': "pm.id, p.nome as projeto, pm.projeto_id, pm.descricao, pm.valor, pm.data_permuta",
+        'colunas': {'projeto': 'p.nome', 'descricao': 'pm.descricao', 'valor': 'pm.valor', 'data_permuta': 'pm.data_permuta'},
+        'id': 'pm.id', 'ordem_padrao': ('data_permuta', 'desc'), 'data': 'pm.data_permuta', 'projeto_id': 'pm.projeto_id', 'numericas': {'valor'},
+    },
+}
+
+# (apelidos aceitos pela DataTable, operador SQL) - a ordem importa: '>=' antes de '>', '!=' antes de '='
+OPERADORES_FILTRO = [(('ge ', '>='), '>='), (('le ', '<='), '<='), (('lt ', '<'), '<'), (('gt ', '>'), '>'), (('ne ', '!='), '<>'), (('eq ', '='), '='), (('contains ',), 'contains'), (('datestartswith ',), 'datestartswith')]
+
+_OPERADOR_SQL = {apelido.strip(): sql_op for apelidos, sql_op in OPERADORES_FILTRO for apelido in apelidos}
+
+def _dividir_clausulas(filter_query):
+    # Separa as cláusulas em "&&" só fora de aspas (o valor pode conter "&&")
+    partes, atual, aspa, i = [], [], None, 0
+    while i < len(filter_query):
+        ch = filter_query[i]
+        if aspa:
+            if ch == '\\' and i + 1 < len(filter_query): atual.append(filter_query[i:i + 2]); i += 2; continue
+            if ch == aspa: aspa = None
+        elif ch in ('"', "'", '`'): aspa = ch
+        elif filter_query.startswith('&&', i): partes.append(''.join(atual)); atual = []; i += 2; continue
+        atual.append(ch); i += 1
+    partes.append(''.join(atual))
+    return [p.strip() for p in partes if p.strip()]
+
+def _ler_clausula(parte):
+    # Lê por posição: {coluna}, o operador logo depois e o resto como literal (entre aspas ou não).
+    # Caracteres de operador dentro do valor ("a=b", "<3") não são confundidos com o operador.
+    if not parte.startswith('{') or '}' not in parte: return None
+    nome, resto = parte[1:parte.index('}')], parte[parte.index('}') + 1:].lstrip()
+    token = resto.split(None, 1)[0] if resto else ''
+    # Operadores colados ao valor ("{valor} >=100"): o maior prefixo simbólico conhecido
+    if token not in _OPERADOR_SQL and token[:1] in '<>=!':
+        token = next((op for op in ('>=', '<=', '!=', '>', '<', '=') if token.startswith(op)), token)
+    # A DataTable pode prefixar s/i (sensível/insensível a maiúsculas): "scontains", "i=". No contains, "s" faz a busca
+    # sensível e sem prefixo (ou com "i") ela é insensível; nos demais operadores o prefixo não muda a comparação.
+    op = token if token in _OPERADOR_SQL else (token[1:] if token[:1] in ('s', 'i') and token[1:] in _OPERADOR_SQL else None)
+    if op is None: return None
+    sensivel = token[:1] == 's' and token != op
+    valor = resto[len(token):].strip()
+    # O valor fica como texto: só vira número na comparação com coluna numérica (ver _interpretar_filtro)
+    if len(valor) >= 2 and valor[0] == valor[-1] and valor[0] in ('"', "'", '`'): valor = valor[1:-1].replace('\\' + valor[0], valor[0])
+    return nome, _OPERADOR_SQL[op], valor, sensivel
+
+def _interpretar_filtro(filter_query, colunas, numericas=()):
+    # Traduz o filter_query da DataTable ("{valor} > 100 && {projeto} contains x") em WHERE com parâmetros ligados
+    clausulas, params = [], {}
+    for i, parte in enumerate(_dividir_clausulas(filter_query or '')):
+        lido = _ler_clausula(parte)
+        if lido is None or lido[0] not in colunas: continue
+        nome, sql_op, valor, sensivel = lido
+        col, chave = colunas[nome], f"f{i}"
+        if sql_op == 'contains' and sensivel:
+            # LIKE ignora maiúsculas no SQLite: busca literal pela posição do texto
+            funcao = "STRPOS({c}, :{k})" if engine.dialect.name == "postgresql" else "INSTR({c}, :{k})"
+            clausulas.append(funcao.format(c=f"CAST({col} AS VARCHAR(255))", k=chave) + " > 0"); params[chave] = valor
+        elif sql_op == 'contains':
+            clausulas.append(f"LOWER(CAST({col} AS VARCHAR(255))) LIKE :{chave}"); params[chave] = f"%{valor.lower()}%"
+        elif sql_op == 'datestartswith':
+            clausulas.append(f"CAST({col} AS VARCHAR(255)) LIKE :{chave}"); params[chave] = f"{valor}%"
+        elif nome in numericas:
+            try: valor = float(valor)
+            except ValueError: continue  # "{valor} > abc" não filtra nada
+            clausulas.append(f"{col} {sql_op} :{chave}"); params[chave] = valor
+        else:
+            clausulas.append(f"{col} {sql_op} :{chave}"); params[chave] = valor
+    return clausulas, params
+
+@instrumentado
+def get_pagina(tabela, pagina, tamanho, sort_by=None, filter_query='', cursor=None):
+    # Retorna (registros da página, total filtrado, chave da última linha para a próxima página)
+    cfg = PAGINACAO[tabela]
+    if sort_by and sort_by[0]['column_id'] in cfg['colunas']: nome_col, direcao = sort_by[0]['column_id'], sort_by[0]['direction']
+    else: nome_col, direcao = cfg['ordem_padrao']
+    col, col_id = cfg['colunas'][nome_col], cfg['id']
+    op, sql_dir = ('<', 'DESC') if direcao == 'desc' else ('>', 'ASC')
+
+    clausulas, params = _interpretar_filtro(filter_query, cfg['colunas'], cfg['numericas'])
+    where = " AND ".join(clausulas) or "1=1"
+    try:
+        with engine.connect() as conn:
+            total = conn.execute(text(f"SELECT COUNT(*) FROM {cfg['from']} WHERE {where}"), params).scalar()
+            params_pag = {**params, "limite": int(tamanho)}
+            if cursor:
+                # Keyset: continua logo após a última linha da página anterior (NULLs ficam no fim)
+                if cursor[0] is None: seek = f"({col} IS NULL AND {col_id} {op} :c_id)"
+                else: seek = f"({col} IS NULL OR {col} {op} :c_val OR ({col} = :c_val AND {col_id} {op} :c_id))"
+                params_pag.update({"c_val": cursor[0], "c_id": cursor[1]})
+                sql = f"SELECT {cfg['select']} FROM {cfg['from']} WHERE {where} AND {seek} ORDER BY ({col} IS NULL), {col} {sql_dir}, {col_id} {sql_dir} LIMIT :limite"
+            else:
+                params_pag["offset"] = int(pagina) * int(tamanho)
+                sql = f"SELECT {cfg['select']} FROM {cfg['from']} WHERE {where} ORDER BY ({col} IS NULL), {col} {sql_dir}, {col_id} {sql_dir} LIMIT :limite OFFSET :offset"
+            df = pd.read_sql_query(text(sql), conn, params=params_pag)
+    except Exception as e:
+        print(f"Erro paginação {tabela}: {e}")
+        return [], 0, None
+    if df.empty: return [], total, None
+    ultimo = df.iloc[-1]
+    valor = ultimo[nome_col]
+    if pd.isna(valor): valor = None
+    elif isinstance(valor, (date, datetime, pd.Timestamp)): valor = valor.isoformat()[:10]
+    elif hasattr(valor, 'item'): valor = valor.item()
+    return df.to_dict('records'), total, [valor, int(ultimo['id'])]
+
+@instrumentado
+def get_registro(tabela, registro_id):
+    # Uma linha no mesmo formato de get_pagina (para atualizar a tabela com Patch)
+    cfg = PAGINACAO[tabela]
+    with engine.connect() as conn: df = pd.read_sql_query(text(f"SELECT {cfg['select']} FROM {cfg['from']} WHERE {cfg['id']} = :id"), conn, params={"id": registro_id})
+    return df.to_dict('records')[0] if not df.empty else None
+
+def _id_filtro(filtro_id):
+    # Converte o valor do dropdown ('todos' / id) no parâmetro :fid das queries (None = todas as obras)
+    return int(filtro_id) if filtro_id and str(filtro_id) != 'todos' else None
+
+# Filtro por obra como parâmetro ligado; o CAST tipa o NULL para o Postgres
+FILTRO_OBRA_SQL = "(CAST(:fid AS INTEGER) IS NULL OR {col} = :fid)"
+
+@usa_snapshot
+@instrumentado
 def get_dados_historico_tendencia(filtro_id=None):
-    # Busca o histórico de alterações para montar a curva S realizada
+    # Curva S física realizada: avanço ponderado por valor de cada obra (tabela curva_fisica), esticado até hoje
+    _sincronizar_curva_fisica()
     try:
-        sql = """
-            SELECT h.data_registro, p.nome as projeto, e.valor_estimado, h.percentual_novo, p.id as projeto_id
-            FROM historico_fisico h
-            JOIN cronograma_etapas e ON h.etapa_id = e.id
-            JOIN projetos p ON e.projeto_id = p.id
-            ORDER BY h.data_registro ASC
+        sql = f"""
+            SELECT c.data as data_registro, p.nome as projeto, c.percentual
+            FROM curva_fisica c JOIN projetos p ON c.projeto_id = p.id
+            WHERE {FILTRO_OBRA_SQL.format(col='p.id')}
+            ORDER BY p.nome ASC, c.data ASC
         """
-        df = pd.read_sql(sql, engine)
-        
+        with conexao_leitura() as conn: df = pd.read_sql_query(text(sql), conn, params={"fid": _id_filtro(filtro_id)})
         if df.empty: return pd.DataFrame()
-
-        if filtro_id and str(filtro_id) != 'todos':
-            df = df[df['projeto_id'] == int(filtro_id)]
-            
-        # Logica Simplificada de Tendência:
-        # Agrupa por data e calcula a "Média Ponderada da Evolução" registrada naquele dia
-        # Para um sistema perfeito, precisaria recalcular o estado total da obra dia a dia.
-        # Aqui vamos mostrar os "Pontos de Evolução".
-        df['valor_realizado'] = df['valor_estimado'] * (df['percentual_novo'] / 100)
-        
-        # Agrupa por Data e Projeto para somar o que foi realizado acumulado
-        # Nota: Isso é uma aproximação baseada nos registros de UPDATE.
-        df_agrupado = df.groupby(['data_registro', 'projeto'])['percentual_novo'].mean().reset_index()
-        
-        return df_agrupado
+        df['data_registro'] = pd.to_datetime(df['data_registro'])
+        # Último patamar de cada obra repetido em hoje, para a escada chegar à data atual
+        hoje = df.groupby('projeto').tail(1)
+        hoje = hoje[hoje['data_registro'] < pd.Timestamp(date.today())].assign(data_registro=pd.Timestamp(date.today()))
+        return pd.concat([df, hoje], ignore_index=True).sort_values(['projeto', 'data_registro'], ignore_index=True)
     except: return pd.DataFrame()
 
-def get_tabela_resumo_financeiro():
-    df_crono = get_cronograma()
-    if not df_crono.empty:
-        df_orcado = df_crono.groupby(['projeto', 'projeto_id'])['valor_estimado'].sum().reset_index()
-        df_orcado.rename(columns={'valor_estimado': 'vl_contrato'}, inplace=True)
-    else:
-        df_orcado = pd.DataFrame(columns=['projeto', 'projeto_id', 'vl_contrato'])
-
-    df_desp = get_despesas_realizadas()
-    if not df_desp.empty:
-        df_pago = df_desp.groupby('projeto')['valor'].sum().reset_index()
-        df_pago.rename(columns={'valor': 'vl_pago'}, inplace=True)
-    else:
-        df_pago = pd.DataFrame(columns=['projeto', 'vl_pago'])
-
-    df_perm = get_permutas()
-    if not df_perm.empty:
-        df_perm_g = df_perm.groupby('projeto')['valor'].sum().reset_index()
-        df_perm_g.rename(columns={'valor': 'vl_permuta'}, inplace=True)
-    else:
-        df_perm_g = pd.DataFrame(columns=['projeto', 'vl_permuta'])
+@usa_snapshot
+@instrumentado
+def get_totais_projetos(filtro_id=None):
+    # Totais por obra (contratado, pago, permuta, atraso, físico executado) somados no próprio banco:
+    # ver uma obra custa as linhas daquela obra, não as da empresa inteira
+    try:
+        sql = f"""
+            SELECT p.id, p.nome, p.empresa,
+                   COALESCE(e.vl_contrato, 0) as vl_contrato, COALESCE(e.vl_fisico, 0) as vl_fisico, COALESCE(e.vl_atraso, 0) as vl_atraso,
+                   COALESCE(d.vl_pago, 0) as vl_pago, COALESCE(pm.vl_permuta, 0) as vl_permuta
+            FROM projetos p
+            LEFT JOIN (
+                SELECT projeto_id, SUM(valor_estimado) as vl_contrato,
+                       SUM(valor_estimado * percentual / 100.0) as vl_fisico,
+                       SUM(CASE WHEN data_fim <= CURRENT_DATE AND percentual < 100 THEN valor_estimado * (1 - percentual / 100.0) ELSE 0 END) as vl_atraso
+                FROM cronograma_etapas WHERE {FILTRO_OBRA_SQL.format(col='projeto_id')} GROUP BY projeto_id
+            ) e ON e.projeto_id = p.id
+            LEFT JOIN (SELECT projeto_id, SUM(valor) as vl_pago FROM despesas WHERE {FILTRO_OBRA_SQL.format(col='projeto_id')} GROUP BY projeto_id) d ON d.projeto_id = p.id
+            LEFT JOIN (SELECT projeto_id, SUM(valor) as vl_permuta FROM permutas WHERE {FILTRO_OBRA_SQL.format(col='projeto_id')} GROUP BY projeto_id) pm ON pm.projeto_id = p.id
+            WHERE {FILTRO_OBRA_SQL.format(col='p.id')}
+            ORDER BY p.id DESC
+        """
+        with conexao_leitura() as conn: df = pd.read_sql_query(text(sql), conn, params={"fid": _id_filtro(filtro_id)})
+        colunas_valor = ['vl_contrato', 'vl_fisico', 'vl_atraso', 'vl_pago', 'vl_permuta']
+        return _tipar(df, dinheiro=colunas_valor).fillna({c: 0.0 for c in colunas_valor})
+    except: return pd.DataFrame(columns=['id', 'nome', 'empresa', 'vl_contrato', 'vl_fisico', 'vl_atraso', 'vl_pago', 'vl_permuta'])
 
-    df_proj = get_projetos()
-    if 'empresa' not in df_proj.columns: df_proj['empresa'] = 'Própria' 
+def get_tabela_resumo_financeiro(filtro_id=None):
+    df_final = get_totais_projetos(filtro_id)
+    if 'empresa' not in df_final.columns: df_final['empresa'] = 'Própria'
+    if BACKEND_AGREGACAO == "polars": return _resumo_financeiro_polars(df_final)
 
-    df_final = pd.merge(df_proj, df_orcado, left_on='id', right_on='projeto_id', how='left')
-    df_final = pd.merge(df_final, df_pago, left_on='nome', right_on='projeto', how='left')
-    df_final = pd.merge(df_final, df_perm_g, left_on='nome', right_on='projeto', how='left')
-    
-    df_final['vl_contrato'] = df_final['vl_contrato'].fillna(0).astype(float)
-    df_final['vl_pago'] = df_final['vl_pago'].fillna(0).astype(float)
-    df_final['vl_permuta'] = df_final['vl_permuta'].fillna(0).astype(float)
-    
     df_final['saldo'] = df_final['vl_contrato'] - df_final['vl_pago'] - df_final['vl_permuta']
-    df_final['perc_pago'] = df_final.apply(lambda x: ((x['vl_pago'] + x['vl_permuta']) / x['vl_contrato'] * 100) if x['vl_contrato'] > 0 else 0, axis=1)
-    
+    # Vetorizado: obras sem contrato (divisor NaN) ficam com 0%
+    df_final['perc_pago'] = ((df_final['vl_pago'] + df_final['vl_permuta']) / df_final['vl_contrato'].where(df_final['vl_contrato'] > 0) * 100).fillna(0.0)
+
     df_final = df_final[(df_final['vl_contrato'] > 0) | (df_final['vl_pago'] > 0) | (df_final['vl_permuta'] > 0)]
     return df_final
 
 def get_kpis_globais(filtro_id=None):
     try:
-        df_crono = get_cronograma()
-        df_desp = get_despesas_realizadas()
-        df_permuta = get_permutas()
-
-        if filtro_id and str(filtro_id) != 'todos':
-            fid = int(filtro_id)
-            if not df_crono.empty: df_crono = df_crono[df_crono['projeto_id'] == fid]
-            if not df_desp.empty: df_desp = df_desp[df_desp['projeto_id'] == fid]
-            if not df_permuta.empty: df_permuta = df_permuta[df_permuta['projeto_id'] == fid]
-
-        total_contratado = df_crono['valor_estimado'].sum() if not df_crono.empty else 0
-        total_pago = df_desp['valor'].sum() if not df_desp.empty else 0
-        total_permuta = df_permuta['valor'].sum() if not df_permuta.empty else 0
+        df = get_totais_projetos(filtro_id)
+
+        total_contratado = df['vl_contrato'].sum()
+        total_pago = df['vl_pago'].sum()
+        total_permuta = df['vl_permuta'].sum()
         saldo = total_contratado - total_pago - total_permuta
-        atraso = 0
-        
-        if not df_crono.empty:
-            df_crono['data_fim'] = pd.to_datetime(df_crono['data_fim'])
-            mask_atraso = (df_crono['data_fim'] < pd.Timestamp.now()) & (df_crono['percentual'] < 100)
-            df_crono['valor_pendente'] = df_crono['valor_estimado'] * (1 - (df_crono['percentual'] / 100))
-            atraso = df_crono.loc[mask_atraso, 'valor_pendente'].sum()
+        atraso = df['vl_atraso'].sum()
 
         # --- FÍSICO vs FINANCEIRO ---
         perc_fisico = 0
         perc_financeiro = 0
         if total_contratado > 0:
-            valor_fisico_executado = (df_crono['valor_estimado'] * (df_crono['percentual'] / 100)).sum()
-            perc_fisico = (valor_fisico_executado / total_contratado) * 100
+            perc_fisico = (df['vl_fisico'].sum() / total_contratado) * 100
             perc_financeiro = ((total_pago + total_permuta) / total_contratado) * 100
 
         return total_contratado, total_permuta, total_pago, saldo, atraso, perc_fisico, perc_financeiro
     except: return 0, 0, 0, 0, 0, 0, 0
 
+@usa_snapshot
+@instrumentado
 def get_dados_pareto_resumo(filtro_id=None):
-    df_desp = get_despesas_realizadas()
-    df_perm = get_permutas()
-
-    if filtro_id and str(filtro_id) != 'todos':
-        fid = int(filtro_id)
-        if not df_desp.empty: df_desp = df_desp[df_desp['projeto_id'] == fid]
-        if not df_perm.empty: df_perm = df_perm[df_perm['projeto_id'] == fid]
-
-    if not df_desp.empty:
-        df_desp = df_desp[df_desp['status'] == 'Pago']
-        df_cat = df_desp.groupby('categoria')['valor'].sum().reset_index()
-    else:
-        df_cat = pd.DataFrame(columns=['categoria', 'valor'])
-
-    val_permuta = df_perm['valor'].sum() if not df_perm.empty else 0
-    if val_permuta > 0:
-        row_permuta = pd.DataFrame({'categoria': ['Permuta'], 'valor': [val_permuta]})
-        df_cat = pd.concat([df_cat, row_permuta], ignore_index=True)
+    try:
+        sql = f"""
+            SELECT categoria, SUM(valor) as valor FROM despesas
+            WHERE status = 'Pago' AND {FILTRO_OBRA_SQL.format(col='projeto_id')} GROUP BY categoria
+            UNION ALL
+            SELECT 'Permuta', SUM(valor) FROM permutas WHERE {FILTRO_OBRA_SQL.format(col='projeto_id')}
+        """
+        with conexao_leitura() as conn:
+            if BACKEND_AGREGACAO == "polars": return _pareto_polars(pl.read_database(text(sql), conn, execute_options={"parameters": {"fid": _id_filtro(filtro_id)}}))
+            df_cat = pd.read_sql_query(text(sql), conn, params={"fid": _id_filtro(filtro_id)})
+    except: return pd.DataFrame()
 
+    df_cat['valor'] = pd.to_numeric(df_cat['valor'], errors='coerce').fillna(0).astype(float)
+    # A linha de Permuta só entra quando houver valor permutado
+    df_cat = df_cat[(df_cat['categoria'] != 'Permuta') | (df_cat['valor'] > 0)]
     if df_cat.empty: return pd.DataFrame()
 
     df_cat = df_cat.sort_values(by='valor', ascending=False)
@@ -242,103 +692,457 @@ def get_dados_pareto_resumo(filtro_id=None):
         row_outros = pd.DataFrame({'categoria': ['Outros'], 'valor': [outros_val]})
         df_final = pd.concat([top_5, row_outros], ignore_index=True)
     else:
-        df_final = df_cat
+        df_final = df_cat.reset_index(drop=True)
 
     total = df_final['valor'].sum()
     df_final['perc'] = (df_final['valor'] / total) * 100
     df_final['acum'] = df_final['perc'].cumsum()
     return df_final
 
-def calcular_orcado_vs_realizado():
-    df_crono = get_cronograma()
-    lista_orcado = []
+def _espalhar_por_mes(inicio, fim, valor):
+    # Distribui cada valor igualmente entre os meses de inicio..fim (inclusive, mínimo 1 mês)
+    # em uma única passada vetorizada: devolve o índice da linha de origem, o mês (1º dia) e o valor mensal
+    mes_ini = inicio.values.astype('datetime64[M]').astype(np.int64)
+    mes_fim = fim.values.astype('datetime64[M]').astype(np.int64)
+    n_meses = np.maximum(mes_fim - mes_ini + 1, 1)
+    origem = np.repeat(np.arange(len(n_meses)), n_meses)
+    deslocamento = np.arange(n_meses.sum()) - np.repeat(np.cumsum(n_meses) - n_meses, n_meses)
+    data_ref = (mes_ini[origem] + deslocamento).astype('datetime64[M]').astype('datetime64[ns]')
+    return origem, data_ref, (np.asarray(valor, dtype=float) / n_meses)[origem]
+
+def _mes(valor):
+    # Primeiro dia do mês de uma data vinda do form ('YYYY-MM-DD') ou do banco
+    return pd.Timestamp(valor).date().replace(day=1)
+
+def _calcular_fluxo(df_crono, df_desp, df_perm, hoje=None):
+    # Série mensal por obra (orçado, realizado, projetado) a partir das linhas brutas
+    hoje = pd.Timestamp(hoje or date.today()).normalize()
+    partes = []
     if not df_crono.empty:
+        df_crono = df_crono.copy()
         df_crono['data_inicio'] = pd.to_datetime(df_crono['data_inicio'])
         df_crono['data_fim'] = pd.to_datetime(df_crono['data_fim'])
-        for _, row in df_crono.iterrows():
-            inicio, fim = row['data_inicio'].replace(day=1), row['data_fim'].replace(day=1)
-            valor_total = float(row['valor_estimado'])
-            meses = (fim.year - inicio.year) * 12 + (fim.month - inicio.month) + 1
-            if meses < 1: meses = 1
-            valor_mensal = valor_total / meses
-            curr = inicio
-            for _ in range(meses):
-                lista_orcado.append({'projeto': row['projeto'], 'data_ref': curr, 'valor_orcado': valor_mensal, 'valor_realizado': 0.0})
-                curr += relativedelta(months=1)
-    
-    lista_realizado = []
-    df_desp = get_despesas_realizadas()
-    if not df_desp.empty:
-        df_desp['data_pagamento'] = pd.to_datetime(df_desp['data_pagamento'])
-        for _, row in df_desp.iterrows():
-            lista_realizado.append({'projeto': row['projeto'], 'data_ref': row['data_pagamento'].replace(day=1), 'valor_orcado': 0.0, 'valor_realizado': float(row['valor'])})
-
-    df_perm = get_permutas()
-    if not df_perm.empty:
-        df_perm['data_permuta'] = pd.to_datetime(df_perm['data_permuta'])
-        for _, row in df_perm.iterrows():
-            lista_realizado.append({'projeto': row['projeto'], 'data_ref': row['data_permuta'].replace(day=1), 'valor_orcado': 0.0, 'valor_realizado': float(row['valor'])})
-
-    df_final = pd.concat([pd.DataFrame(lista_orcado), pd.DataFrame(lista_realizado)])
-    if df_final.empty: return pd.DataFrame()
-    return df_final.groupby(['data_ref', 'projeto'])[['valor_orcado', 'valor_realizado']].sum().reset_index().sort_values(by='data_ref')
+        df_crono['percentual'] = pd.to_numeric(df_crono['percentual'], errors='coerce').fillna(0)
+        df_crono['valor_estimado'] = df_crono['valor_estimado'].astype(float)
+        df_crono = df_crono.dropna(subset=['data_fim'])
+
+        df_orc = df_crono.dropna(subset=['data_inicio'])
+        origem, data_ref, valor_mensal = _espalhar_por_mes(df_orc['data_inicio'], df_orc['data_fim'], df_orc['valor_estimado'])
+        partes.append(pd.DataFrame({'projeto_id': df_orc['projeto_id'].values[origem], 'mes': data_ref, 'orcado': valor_mensal}))
+
+        # Projeção: saldo físico das etapas abertas distribuído de hoje até o fim da etapa
+        df_aberto = df_crono[(df_crono['status'] != 'Concluído') & (df_crono['percentual'] < 100)]
+        valor_restante = df_aberto['valor_estimado'] * (1 - (df_aberto['percentual'] / 100))
+        df_aberto, valor_restante = df_aberto[valor_restante > 0], valor_restante[valor_restante > 0]
+        start_date = df_aberto['data_inicio'].where(df_aberto['data_inicio'] > hoje, hoje)
+        # Etapas vencidas jogam todo o saldo no mês corrente
+        vencida = df_aberto['data_fim'] <= start_date
+        origem, data_ref, valor_mensal = _espalhar_por_mes(start_date.mask(vencida, hoje), df_aberto['data_fim'].mask(vencida, hoje), valor_restante)
+        partes.append(pd.DataFrame({'projeto_id': df_aberto['projeto_id'].values[origem], 'mes': data_ref, 'projetado': valor_mensal}))
+
+    # Despesas e permutas entram inteiras no mês do pagamento
+    for df, col_data in [(df_desp, 'data_pagamento'), (df_perm, 'data_permuta')]:
+        if df.empty: continue
+        data_ref = pd.to_datetime(df[col_data]).values.astype('datetime64[M]').astype('datetime64[ns]')
+        partes.append(pd.DataFrame({'projeto_id': df['projeto_id'].values, 'mes': data_ref, 'realizado': df['valor'].astype(float).values}))
+
+    colunas = ['orcado', 'realizado', 'projetado']
+    if not partes: return pd.DataFrame(columns=['projeto_id', 'mes'] + colunas)
+    df_final = pd.concat(partes).reindex(columns=['projeto_id', 'mes'] + colunas).fillna({c: 0.0 for c in colunas})
+    return df_final.groupby(['projeto_id', 'mes'])[colunas].sum().reset_index()
+
+def _gravar_fluxo(conn, df, colunas):
+    # Upsert das linhas (projeto_id, mes) tocando apenas as colunas informadas
+    if df.empty: return
+    sets = ", ".join(f"{c} = excluded.{c}" for c in colunas)
+    sql = f"INSERT INTO fluxo_mensal (projeto_id, mes, {', '.join(colunas)}) VALUES (:projeto_id, :mes, {', '.join(':' + c for c in colunas)}) ON CONFLICT (projeto_id, mes) DO UPDATE SET {sets}"
+    registros = [{**r, 'projeto_id': int(r['projeto_id']), 'mes': pd.Timestamp(r['mes']).date()} for r in df[['projeto_id', 'mes'] + colunas].to_dict('records')]
+    conn.execute(text(sql), registros)
+
+def atualizar_fluxo_mensal(conn, projeto_id, meses=None):
+    # Mantém fluxo_mensal em dia dentro da transação de escrita.
+    # Com meses (despesa/permuta): refaz só o realizado desses meses da obra.
+    # Sem meses (etapa): refaz orçado e projetado da obra inteira.
+    if not projeto_id: return
+    pid = int(projeto_id)
+    if meses is not None:
+        linhas = []
+        for mes in {_mes(m) for m in meses if m}:
+            params = {"pid": pid, "ini": mes, "fim": (pd.Timestamp(mes) + pd.DateOffset(months=1)).date()}
+            realizado = conn.execute(text("""
+                SELECT COALESCE((SELECT SUM(valor) FROM despesas WHERE projeto_id = :pid AND data_pagamento >= :ini AND data_pagamento < :fim), 0)
+                     + COALESCE((SELECT SUM(valor) FROM permutas WHERE projeto_id = :pid AND data_permuta >= :ini AND data_permuta < :fim), 0)
+            """), params).scalar()
+            linhas.append({'projeto_id': pid, 'mes': mes, 'realizado': float(realizado or 0)})
+        _gravar_fluxo(conn, pd.DataFrame(linhas, columns=['projeto_id', 'mes', 'realizado']), ['realizado'])
+    else:
+        df_crono = pd.read_sql_query(text("SELECT projeto_id, data_inicio, data_fim, valor_estimado, status, percentual FROM cronograma_etapas WHERE projeto_id = :pid"), conn, params={"pid": pid})
+        df = _calcular_fluxo(df_crono, pd.DataFrame(), pd.DataFrame())
+        df['calculado_em'] = date.today()
+        conn.execute(text("UPDATE fluxo_mensal SET orcado = 0, projetado = 0, calculado_em = :hoje WHERE projeto_id = :pid"), {"pid": pid, "hoje": date.today()})
+        _gravar_fluxo(conn, df, ['orcado', 'projetado', 'calculado_em'])
+    conn.execute(text("DELETE FROM fluxo_mensal WHERE projeto_id = :pid AND orcado = 0 AND realizado = 0 AND projetado = 0"), {"pid": pid})
+
+def reconstruir_fluxo_mensal(conn=None):
+    # Recalcula fluxo_mensal do zero a partir das tabelas base
+    if conn is None:
+        with engine.connect() as conn:
+            n = reconstruir_fluxo_mensal(conn); conn.commit()
+            return n
+    df_crono = pd.read_sql_query("SELECT projeto_id, data_inicio, data_fim, valor_estimado, status, percentual FROM cronograma_etapas", conn)
+    df_desp = pd.read_sql_query("SELECT projeto_id, valor, data_pagamento FROM despesas", conn)
+    df_perm = pd.read_sql_query("SELECT projeto_id, valor, data_permuta FROM permutas", conn)
+    df = _calcular_fluxo(df_crono, df_desp, df_perm)
+    df['calculado_em'] = date.today()
+    conn.execute(text("DELETE FROM fluxo_mensal"))
+    _gravar_fluxo(conn, df, ['orcado', 'realizado', 'projetado', 'calculado_em'])
+    return len(df)
+
+def _sincronizar_fluxo_mensal():
+    # Popula a tabela na primeira leitura e refaz a projeção das obras calculadas em um mês anterior
+    # (a projeção só depende do mês corrente)
+    try:
+        with engine.connect() as conn:
+            if not conn.execute(text("SELECT COUNT(*) FROM fluxo_mensal")).scalar():
+                reconstruir_fluxo_mensal(conn)
+            else:
+                desatualizadas = conn.execute(text("SELECT DISTINCT projeto_id FROM fluxo_mensal WHERE calculado_em < :mes"), {"mes": date.today().replace(day=1)}).scalars().all()
+                for pid in desatualizadas: atualizar_fluxo_mensal(conn, pid)
+            conn.commit()
+    except Exception as e: print(f"Erro fluxo_mensal: {e}")
 
+@usa_snapshot
+@instrumentado
+def get_fluxo_mensal():
+    _sincronizar_fluxo_mensal()
+    try:
+        sql = """SELECT f.projeto_id, p.nome as projeto, f.mes, f.orcado, f.realizado, f.projetado
+                 FROM fluxo_mensal f JOIN projetos p ON f.projeto_id = p.id ORDER BY f.mes"""
+        with conexao_leitura() as conn: df = pd.read_sql_query(sql, conn)
+        df['mes'] = pd.to_datetime(df['mes'])
+        return df
+    except: return pd.DataFrame(columns=['projeto_id', 'projeto', 'mes', 'orcado', 'realizado', 'projetado'])
+
+def calcular_orcado_vs_realizado():
+    df = get_fluxo_mensal()
+    if BACKEND_AGREGACAO == "polars": return _orcado_vs_realizado_polars(df)
+    df = df[(df['orcado'] != 0) | (df['realizado'] != 0)]
+    if df.empty: return pd.DataFrame()
+    df = df.rename(columns={'mes': 'data_ref', 'orcado': 'valor_orcado', 'realizado': 'valor_realizado'})
+    return df.groupby(['data_ref', 'projeto'])[['valor_orcado', 'valor_realizado']].sum().reset_index().sort_values(by='data_ref', kind='stable')
+
+# --- CURVA S FÍSICA (AVANÇO PONDERADO POR VALOR) ---
+# Avanço da obra no dia d = soma(valor_estimado da etapa x último percentual da etapa registrado até d) / soma(valor_estimado).
+# Cada registro do histórico vira um delta (percentual novo - anterior da mesma etapa) x peso; a soma acumulada
+# dos deltas por dia é o avanço "as-of" sem cruzar etapas x dias. Etapas sem registro contam 0%.
+def _calcular_curva_fisica(df_etapas, df_hist, df_base=None):
+    # df_etapas: id, projeto_id, valor_estimado | df_hist: id, etapa_id, data_registro, percentual_novo
+    # df_base: etapa_id, percentual_novo -> estado das etapas antes do primeiro dia de df_hist (extensão incremental)
+    vazio = pd.DataFrame(columns=['projeto_id', 'data', 'percentual'])
+    if df_etapas.empty or df_hist.empty: return vazio
+    etapas = df_etapas.set_index('id')
+    peso = etapas['valor_estimado'].astype(float).fillna(0)
+    total = peso.groupby(etapas['projeto_id']).transform('sum')
+    peso = peso.where(total > 0, 1.0)  # obra sem valores lançados: média simples das etapas
+    total = peso.groupby(etapas['projeto_id']).sum()
+
+    h = df_hist[df_hist['etapa_id'].isin(etapas.index)].dropna(subset=['percentual_novo', 'data_registro']).copy()
+    if h.empty: return vazio
+    h['data'] = pd.to_datetime(h['data_registro']).dt.normalize()
+    # Vários registros da mesma etapa no mesmo dia: vale o último
+    h = h.sort_values(['etapa_id', 'data', 'id']).drop_duplicates(['etapa_id', 'data'], keep='last')
+    base = df_base.set_index('etapa_id')['percentual_novo'].astype(float) if df_base is not None and not df_base.empty else pd.Series(dtype=float)
+    anterior = h.groupby('etapa_id')['percentual_novo'].shift().fillna(h['etapa_id'].map(base)).fillna(0)
+    h['delta'] = (h['percentual_novo'].astype(float) - anterior) * h['etapa_id'].map(peso)
+    h['projeto_id'] = h['etapa_id'].map(etapas['projeto_id'])
+
+    executado_base = (base * peso.reindex(base.index)).groupby(etapas['projeto_id'].reindex(base.index)).sum()
+    acumulado = h.groupby(['projeto_id', 'data'])['delta'].sum().groupby(level='projeto_id').cumsum()
+    pids = acumulado.index.get_level_values('projeto_id')
+    acumulado = acumulado + executado_base.reindex(pids).fillna(0).values
+    df = (acumulado / total.reindex(pids).values).rename('percentual').reset_index()
+    df['percentual'] = df['percentual'].clip(0, 100)
+    # Só os dias em que o avanço da obra mudou (registros que não mexem no percentual não viram ponto)
+    df = df[~df.groupby('projeto_id')['percentual'].diff().abs().lt(1e-9)]
+    return df[['projeto_id', 'data', 'percentual']].reset_index(drop=True)
+
+def atualizar_curva_fisica(conn, projeto_id, desde=None):
+    # Mantém curva_fisica em dia dentro da transação de escrita.
+    # Com desde (novo registro de avanço, pesos inalterados): parte do estado das etapas antes de desde e
+    # só estende/refaz a curva a partir desse dia. Sem desde (valor, etapa nova/excluída): refaz a obra inteira.
+    if not projeto_id: return
+    pid = int(projeto_id)
+    df_etapas = pd.read_sql_query(text("SELECT id, projeto_id, valor_estimado FROM cronograma_etapas WHERE projeto_id = :pid"), conn, params={"pid": pid})
+    sql_hist = "SELECT h.id, h.etapa_id, h.data_registro, h.percentual_novo FROM historico_fisico h JOIN cronograma_etapas e ON h.etapa_id = e.id WHERE e.projeto_id = :pid"
+    params, df_base = {"pid": pid}, None
+    if desde is not None:
+        params["desde"] = desde
+        sql_hist += " AND h.data_registro >= :desde"
+        df_base = pd.read_sql_query(text("""
+            SELECT etapa_id, percentual_novo FROM (
+                SELECT h.etapa_id, h.percentual_novo, ROW_NUMBER() OVER (PARTITION BY h.etapa_id ORDER BY h.data_registro DESC, h.id DESC) AS rn
+                FROM historico_fisico h JOIN cronograma_etapas e ON h.etapa_id = e.id
+                WHERE e.projeto_id = :pid AND h.data_registro < :desde AND h.percentual_novo IS NOT NULL
+            ) ultimos WHERE rn = 1
+        """), conn, params=params)
+        conn.execute(text("DELETE FROM curva_fisica WHERE projeto_id = :pid AND data >= :desde"), params)
+    else:
+        conn.execute(text("DELETE FROM curva_fisica WHERE projeto_id = :pid"), params)
+    df = _calcular_curva_fisica(df_etapas, pd.read_sql_query(text(sql_hist), conn, params=params), df_base)
+    if desde is not None and not df.empty:
+        # Emenda com o último ponto gravado antes de desde: um primeiro ponto sem mudança (ex.: avanço desfeito no mesmo dia)
+        # não existe na reconstrução completa
+        ultimo = conn.execute(text("SELECT percentual FROM curva_fisica WHERE projeto_id = :pid AND data < :desde ORDER BY data DESC LIMIT 1"), params).scalar()
+        if ultimo is not None and abs(float(df['percentual'].iloc[0]) - float(ultimo)) < 1e-9: df = df.iloc[1:]
+    _gravar_curva(conn, df)
+
+def _gravar_curva(conn, df):
+    if df.empty: return
+    registros = [{'projeto_id': int(r['projeto_id']), 'data': pd.Timestamp(r['data']).date(), 'percentual': float(r['percentual'])} for r in df.to_dict('records')]
+    conn.execute(text("INSERT INTO curva_fisica (projeto_id, data, percentual) VALUES (:projeto_id, :data, :percentual)"), registros)
+
+def reconstruir_curva_fisica(conn=None):
+    # Recalcula curva_fisica do zero a partir de historico_fisico
+    if conn is None:
+        with engine.connect() as conn:
+            n = reconstruir_curva_fisica(conn); conn.commit()
+            return n
+    df_etapas = pd.read_sql_query("SELECT id, projeto_id, valor_estimado FROM cronograma_etapas", conn)
+    df_hist = pd.read_sql_query("SELECT id, etapa_id, data_registro, percentual_novo FROM historico_fisico", conn)
+    df = _calcular_curva_fisica(df_etapas, df_hist)
+    conn.execute(text("DELETE FROM curva_fisica"))
+    _gravar_curva(conn, df)
+    return len(df)
+
+def _sincronizar_curva_fisica():
+    # Popula a tabela na primeira leitura (banco que já tinha histórico antes da curva materializada)
+    try:
+        with engine.connect() as conn:
+            if not conn.execute(text("SELECT COUNT(*) FROM curva_fisica")).scalar():
+                reconstruir_curva_fisica(conn)
+                conn.commit()
+    except Exception as e: print(f"Erro curva_fisica: {e}")
+
+# --- HISTÓRICO FÍSICO: DEDUPLICAÇÃO E COMPACTAÇÃO ---
+def registrar_avanco(conn, etapa_id, percentual, anterior=None):
+    # Histórico só guarda mudanças de avanço e no máximo um registro por etapa por dia
+    # (salvar de novo no mesmo dia sobrescreve; índice único ux_historico_etapa_dia)
+    if anterior is not None and float(anterior) == float(percentual): return False
+    conn.execute(text("""
+        INSERT INTO historico_fisico (etapa_id, data_registro, percentual_novo) VALUES (:eid, CURRENT_DATE, :p)
+        ON CONFLICT (etapa_id, data_registro) DO UPDATE SET percentual_novo = excluded.percentual_novo
+    """), {"eid": etapa_id, "p": percentual})
+    return True
+
+HISTORICO_RETENCAO_DIAS = int(os.getenv("HISTORICO_RETENCAO_DIAS", "90"))
+
+def compactar_historico(conn=None, dias=None):
+    # Remove do histórico o que não muda a curva física e reduz o histórico antigo a pontos semanais:
+    #   órfãs       -> registros de etapas que não existem mais (SQLite não aplica o ON DELETE CASCADE)
+    #   semanais    -> registros com mais de `dias` dias: fica só o último de cada etapa por semana
+    #   sem_mudanca -> registros que repetem o percentual anterior da mesma etapa
+    # Devolve o relatório de linhas recuperadas por motivo.
+    if conn is None:
+        with engine.connect() as conn:
+            relatorio = compactar_historico(conn, dias); conn.commit()
+            return relatorio
+    dias = HISTORICO_RETENCAO_DIAS if dias is None else dias
+    df = pd.read_sql_query("SELECT h.id, h.etapa_id, h.data_registro, h.percentual_novo, e.projeto_id FROM historico_fisico h LEFT JOIN cronograma_etapas e ON h.etapa_id = e.id", conn)
+    relatorio = {'linhas_antes': len(df), 'orfas': 0, 'semanais': 0, 'sem_mudanca': 0}
+    if df.empty: return {**relatorio, 'linhas_depois': 0}
+    df['data'] = pd.to_datetime(df['data_registro'])
+    df = df.sort_values(['etapa_id', 'data', 'id'])
+
+    orfas = df['projeto_id'].isna()
+    antigas = ~orfas & (df['data'] < pd.Timestamp(date.today()) - pd.Timedelta(days=dias))
+    semana = df['data'].dt.to_period('W')
+    semanais = antigas & df.assign(semana=semana).duplicated(['etapa_id', 'semana'], keep='last')
+    restantes = df[~orfas & ~semanais]
+    sem_mudanca = restantes['percentual_novo'].eq(restantes.groupby('etapa_id')['percentual_novo'].shift())
+
+    remover = pd.concat([df.loc[orfas, 'id'], df.loc[semanais, 'id'], restantes.loc[sem_mudanca, 'id']])
+    relatorio.update(orfas=int(orfas.sum()), semanais=int(semanais.sum()), sem_mudanca=int(sem_mudanca.sum()))
+    sql = text("DELETE FROM historico_fisico WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+    ids = [int(i) for i in remover]
+    for i in range(0, len(ids), 1000): conn.execute(sql, {"ids": ids[i:i + 1000]})
+
+    # Pontos semanais mudam a forma da curva antiga: refaz as obras afetadas
+    for pid in df.loc[semanais, 'projeto_id'].dropna().unique(): atualizar_curva_fisica(conn, pid)
+    if ids: registrar_escrita(conn, "historico_fisico")
+    relatorio['linhas_depois'] = relatorio['linhas_antes'] - len(ids)
+    return relatorio
+
+@usa_snapshot
+@instrumentado
 def get_detalhes_atraso():
     try:
         sql = """SELECT p.nome as projeto, e.etapa, e.data_fim, e.valor_estimado, e.percentual FROM cronograma_etapas e JOIN projetos p ON e.projeto_id = p.id WHERE e.data_fim < CURRENT_DATE AND e.percentual < 100 ORDER BY e.data_fim ASC"""
-        return pd.read_sql(sql, engine)
+        with conexao_leitura() as conn: return pd.read_sql_query(sql, conn)
     except: return pd.DataFrame()
 
 def calcular_projecao_futura():
-    df = get_cronograma()
+    df = get_fluxo_mensal()
+    if BACKEND_AGREGACAO == "polars": return _projecao_futura_polars(df)
+    df = df[df['projetado'] > 0]
     if df.empty: return pd.DataFrame()
-    df['percentual'] = pd.to_numeric(df['percentual'], errors='coerce').fillna(0)
-    df_aberto = df[(df['status'] != 'Concluído') & (df['percentual'] < 100)].copy()
-    df_aberto['data_inicio'] = pd.to_datetime(df_aberto['data_inicio'])
-    df_aberto['data_fim'] = pd.to_datetime(df_aberto['data_fim'])
-    
-    lista_projecao = []
-    today = pd.Timestamp.now().normalize()
-    for _, row in df_aberto.iterrows():
-        start_date = max(today, row['data_inicio'])
-        end_date = row['data_fim']
-        valor_restante = float(row['valor_estimado']) * (1 - (float(row['percentual']) / 100))
-        if valor_restante <= 0: continue
-
-        if end_date <= start_date:
-            lista_projecao.append({'Data': today.replace(day=1), 'Projeto': row['projeto'], 'Valor Projetado': valor_restante})
-        else:
-            meses = (end_date.year - start_date.year) * 12 + (end_date.month - start_date.month) + 1
-            if meses < 1: meses = 1
-            valor_mensal = valor_restante / meses
-            curr = start_date.replace(day=1)
-            for _ in range(meses):
-                lista_projecao.append({'Data': curr, 'Projeto': row['projeto'], 'Valor Projetado': valor_mensal})
-                curr += relativedelta(months=1)
-            
-    if not lista_projecao: return pd.DataFrame()
-    return pd.DataFrame(lista_projecao).groupby(['Data', 'Projeto'])['Valor Projetado'].sum().reset_index()
+    df = df.rename(columns={'mes': 'Data', 'projeto': 'Projeto', 'projetado': 'Valor Projetado'})
+    return df.groupby(['Data', 'Projeto'])['Valor Projetado'].sum().reset_index()
+
+# --- BACKEND POLARS DAS AGREGAÇÕES ---
+# BACKEND_AGREGACAO=polars roda as agregações dos painéis em LazyFrames (plano otimizado, group_by em várias threads).
+# Os dados chegam em Arrow (pl.read_database / pl.from_pandas) e o resultado volta como pandas para o Plotly/Dash,
+# com as mesmas colunas e a mesma ordem do caminho pandas (conferido por benchmarks/backends.py).
+BACKEND_AGREGACAO = os.getenv("BACKEND_AGREGACAO", "pandas").lower()
+
+def _resumo_financeiro_polars(df):
+    c = pl.col
+    # Schema explícito: o fallback vazio de get_totais_projetos vem com colunas object
+    valores = {v: pl.Float64 for v in ('vl_contrato', 'vl_fisico', 'vl_atraso', 'vl_pago', 'vl_permuta') if v in df.columns}
+    return (pl.from_pandas(df, schema_overrides=valores).lazy()
+            .with_columns(saldo=c('vl_contrato') - c('vl_pago') - c('vl_permuta'),
+                          perc_pago=pl.when(c('vl_contrato') > 0).then((c('vl_pago') + c('vl_permuta')) / c('vl_contrato') * 100).otherwise(0.0))
+            .filter((c('vl_contrato') > 0) | (c('vl_pago') > 0) | (c('vl_permuta') > 0))
+            .collect().to_pandas())
+
+def _pareto_polars(df_cat):
+    # Top 5 categorias + "Outros" com o restante, percentual e acumulado
+    c = pl.col
+    df = (df_cat.lazy()
+          .with_columns(valor=c('valor').cast(pl.Float64).fill_null(0.0))
+          .filter((c('categoria') != 'Permuta') | (c('valor') > 0))
+          .sort('valor', descending=True, maintain_order=True)
+          .with_row_index('pos')
+          .group_by(grupo=pl.min_horizontal(c('pos'), 5)).agg(categoria=c('categoria').first(), valor=c('valor').sum())
+          .sort('grupo')
+          .with_columns(categoria=pl.when(c('grupo') == 5).then(pl.lit('Outros')).otherwise(c('categoria')))
+          .with_columns(perc=c('valor') / c('valor').sum() * 100)
+          .with_columns(acum=c('perc').cum_sum())
+          .drop('grupo').collect())
+    return df.to_pandas() if df.height else pd.DataFrame()
+
+def _orcado_vs_realizado_polars(df):
+    if df.empty: return pd.DataFrame()
+    c = pl.col
+    out = (pl.from_pandas(df).lazy()
+           .filter((c('orcado') != 0) | (c('realizado') != 0))
+           .group_by(data_ref=c('mes'), projeto=c('projeto')).agg(valor_orcado=c('orcado').sum(), valor_realizado=c('realizado').sum())
+           .sort(['data_ref', 'projeto']).collect())
+    return out.to_pandas() if out.height else pd.DataFrame()
+
+def _projecao_futura_polars(df):
+    if df.empty: return pd.DataFrame()
+    c = pl.col
+    out = (pl.from_pandas(df).lazy()
+           .filter(c('projetado') > 0)
+           .group_by(Data=c('mes'), Projeto=c('projeto')).agg(c('projetado').sum().alias('Valor Projetado'))
+           .sort(['Data', 'Projeto']).collect())
+    return out.to_pandas() if out.height else pd.DataFrame()
+
+# --- CACHE DE FIGURAS ---
+# LRU em processo com orçamento de memória (FIGURA_CACHE_MB, medido pelo tamanho do JSON guardado).
+# Chave: (tipo da figura, argumentos posicionais = filtro, versões das tabelas de que depende, dia corrente).
+# Guarda a figura já serializada; acerto devolve o JSON sem rodar pandas nem Plotly. Miss e acerto devolvem
+# o mesmo formato (dict), para o chamador não depender de qual caminho foi seguido.
+# Jobs em segundo plano são processos filhos (fork): leem o que herdaram do worker e mandam as figuras novas
+# pela fila "figuras" do diskcache; o worker as incorpora antes de despachar o próximo job.
+FIGURA_CACHE_MB = float(os.getenv("FIGURA_CACHE_MB", "64"))
+figura_stats = {'hits': 0, 'misses': 0, 'despejos': 0}
+metrica_figuras = Contador("cache_figuras_total", "Consultas ao cache de figuras por tipo e resultado.")
+METRICAS.append(metrica_figuras)
+
+class _LRUFiguras(LRUCache):
+    def popitem(self):
+        item = super().popitem()
+        figura_stats['despejos'] += 1
+        return item
+
+_cache_figuras = _LRUFiguras(maxsize=int(FIGURA_CACHE_MB * 1024 ** 2), getsizeof=len)
+_figuras_lock = threading.Lock()
+
+def _contar_figura(tipo, resultado):
+    figura_stats[resultado] += 1
+    metrica_figuras.incrementar(tipo=tipo, resultado=resultado)
+
+def _guardar_figura(chave, corpo):
+    with _figuras_lock:
+        try: _cache_figuras[chave] = corpo
+        except ValueError: pass  # figura maior que o orçamento inteiro: não entra
+
+def _coletar_figuras_background():
+    while True:
+        _, item = background_manager.handle.pull(prefix="figuras")
+        if item is None: return
+        chave, resultado, corpo = item
+        _contar_figura(chave[0], resultado)
+        if corpo is not None: _guardar_figura(chave, corpo)
+
+def figura_em_cache(tipo, *tabelas):
+    # Argumentos nomeados (ex.: progresso=set_progress) passam para a função, mas não entram na chave
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            em_job = os.getpid() != _PID_WORKER
+            if not em_job: _coletar_figuras_background()
+            versoes = get_versoes_dados()
+            chave = (tipo, args, tuple(versoes.get(t, 0) for t in tabelas), date.today())
+            with _figuras_lock: corpo = _cache_figuras.get(chave)
+            resultado = 'hits' if corpo is not None else 'misses'
+            if corpo is None:
+                corpo = to_json_plotly(func(*args, **kwargs))
+                _guardar_figura(chave, corpo)
+            if em_job:
+                try: background_manager.handle.push((chave, resultado, corpo if resultado == 'misses' else None), prefix="figuras", expire=3600)
+                except Exception as e: print(f"Erro cache de figuras: {e}")
+            else: _contar_figura(tipo, resultado)
+            return json.loads(corpo)
+        return wrapper
+    return decorator
 
 # --- FUNÇÕES GRÁFICAS ---
 
-def gerar_figura_gantt(filtro_obra_id=None):
+# Gantt paginado: só a janela de linhas visível vai para o navegador (a figura cresce 60px por linha)
+GANTT_LINHAS_POR_PAGINA = int(os.getenv("GANTT_LINHAS_POR_PAGINA", "25"))
+
+def _resumo_gantt_obras(df_crono):
+    # Visão geral: uma barra por obra (primeiro início -> último fim), avanço ponderado pelo valor das etapas
+    df = df_crono.assign(valor_estimado=df_crono['valor_estimado'].astype(float), percentual=pd.to_numeric(df_crono['percentual'], errors='coerce').fillna(0))
+    df['executado'] = df['valor_estimado'] * df['percentual']
+    g = df.groupby(['projeto_id', 'projeto'], observed=True).agg(data_inicio=('data_inicio', 'min'), data_fim=('data_fim', 'max'), valor_estimado=('valor_estimado', 'sum'), executado=('executado', 'sum'), media=('percentual', 'mean'), etapas=('id_etapa', 'count')).reset_index()
+    g['percentual'] = (g['executado'] / g['valor_estimado'].where(g['valor_estimado'] > 0)).fillna(g['media']).round(1)
+    g['tarefa_label'] = g['projeto'].astype(str)
+    return g.sort_values(by=['data_inicio', 'projeto'])
+
+@figura_em_cache("gantt", 'cronograma_etapas', 'projetos')
+def gerar_figura_gantt(filtro_obra_id=None, pagina=1):
+    # Devolve (figura, total de páginas); a figura com barras vem como dict. Sem obra selecionada: uma barra por obra (clique abre a obra);
+    # com obra: uma barra por etapa.
     df_crono = get_cronograma()
-    if df_crono.empty: return px.bar(title="Sem cronograma cadastrado", template="plotly_white")
+    if df_crono.empty: return px.bar(title="Sem cronograma cadastrado", template="plotly_white"), 1
     
     df_crono['data_inicio'] = pd.to_datetime(df_crono['data_inicio'])
     df_crono['data_fim'] = pd.to_datetime(df_crono['data_fim'])
     df_chart = df_crono.copy()
     
-    if filtro_obra_id and str(filtro_obra_id).lower() not in ['none', 'todos', '']:
+    visao_geral = not (filtro_obra_id and str(filtro_obra_id).lower() not in ['none', 'todos', ''])
+    if not visao_geral:
         df_chart = df_chart[df_chart['projeto_id'] == int(filtro_obra_id)]
         title_text = f"Cronograma: {df_chart.iloc[0]['projeto'] if not df_chart.empty else ''}"
     else:
+        df_chart = _resumo_gantt_obras(df_chart)
         title_text = "Visão Geral: Todas as Obras"
 
-    if df_chart.empty: return px.bar(title="Nenhum dado encontrado para o filtro.", template="plotly_white")
+    if df_chart.empty: return px.bar(title="Nenhum dado encontrado para o filtro.", template="plotly_white"), 1
+
+    if not visao_geral:
+        df_chart['tarefa_label'] = df_chart['projeto'].astype(str) + " - " + df_chart['etapa']
+        df_chart = _ordenar_gantt_obra(df_chart)
 
-    df_chart['tarefa_label'] = df_chart['projeto'] + " - " + df_chart['etapa']
-    df_chart = df_chart.sort_values(by=['projeto', 'data_inicio'], ascending=[True, True])
+    total_linhas = len(df_chart)
+    total_paginas = max(1, -(-total_linhas // GANTT_LINHAS_POR_PAGINA))
+    pagina = min(max(1, pagina or 1), total_paginas)
+    inicio = (pagina - 1) * GANTT_LINHAS_POR_PAGINA
+    df_chart = df_chart.iloc[inicio:inicio + GANTT_LINHAS_POR_PAGINA].copy()
+    if total_paginas > 1: title_text += f" ({inicio + 1}-{inicio + len(df_chart)} de {total_linhas})"
     altura_calc = 300 + (len(df_chart) * 60)
 
     fig = px.timeline(df_chart, x_start="data_inicio", x_end="data_fim", y="tarefa_label", color="percentual", color_continuous_scale="RdYlGn", range_color=[0, 100], template="plotly_white", height=altura_calc)
@@ -346,10 +1150,71 @@ def gerar_figura_gantt(filtro_obra_id=None):
     df_chart['data_inicio_str'] = df_chart['data_inicio'].dt.strftime('%Y-%m-%d')
     df_chart['data_fim_str'] = df_chart['data_fim'].dt.strftime('%Y-%m-%d')
     
-    fig.update_traces(customdata=df_chart[['id_etapa', 'valor_estimado', 'percentual', 'data_inicio_str', 'data_fim_str', 'etapa', 'projeto_id']], marker=dict(line=dict(width=1, color='black'), opacity=0.9), width=0.8)
+    if visao_geral:
+        # customdata[0] == 'obra' identifica o clique de drill-down em manage_stage_crud
+        fig.update_traces(customdata=df_chart.assign(tipo='obra')[['tipo', 'projeto_id', 'etapas', 'percentual', 'data_inicio_str', 'data_fim_str']], hovertemplate="<b>%{y}</b><br>%{customdata[4]} → %{customdata[5]}<br>Avanço: %{customdata[3]}%<br>Etapas: %{customdata[2]}<br><i>Clique para abrir a obra</i><extra></extra>")
+    else:
+        fig.update_traces(customdata=df_chart[['id_etapa', 'valor_estimado', 'percentual', 'data_inicio_str', 'data_fim_str', 'etapa', 'projeto_id']])
+    fig.update_traces(marker=dict(line=dict(width=1, color='black'), opacity=0.9), width=0.8)
     fig.update_layout(title=dict(text=title_text, font=dict(size=24, color="black", family="Arial Black")), xaxis=dict(title="Linha do Tempo", side="top", tickfont=dict(size=14, family="Arial Black", color="black"), gridcolor="#e5e7eb"), yaxis=dict(title="", autorange="reversed", tickfont=dict(size=14, family="Arial Black", color="black"), dtick=1), legend=dict(orientation="h", y=1.05), margin=dict(l=10, r=10, t=120, b=50), autosize=True)
-    return fig
-
+    # O plotly serializa as cores como array binário; em lista simples cada barra pode receber Patch por posição
+    fig = fig.to_dict()
+    fig['data'][0]['marker']['color'] = df_chart['percentual'].tolist()
+    return fig, total_paginas
+
+def _ordenar_gantt_obra(df):
+    # Ordem das barras do Gantt detalhado (a mesma para a figura inteira e para decidir o Patch)
+    return df.sort_values(by=['projeto', 'data_inicio'], ascending=[True, True])
+
+def _barra_gantt(r):
+    # Valores de uma barra do Gantt detalhado (mesmos campos que o px.timeline gera), para Patch
+    inicio, fim = pd.Timestamp(r['data_inicio']), pd.Timestamp(r['data_fim'])
+    return {'base': inicio.strftime('%Y-%m-%d'), 'x': (fim - inicio) / pd.Timedelta(milliseconds=1), 'y': f"{r['projeto']} - {r['etapa']}",
+            'color': float(r['percentual'] or 0), 'customdata': [int(r['id_etapa']), float(r['valor_estimado'] or 0), r['percentual'], inicio.strftime('%Y-%m-%d'), fim.strftime('%Y-%m-%d'), r['etapa'], int(r['projeto_id'])]}
+
+def _patch_view_etapa(alteracao, obra_id, visiveis, pagina=1):
+    # Após salvar/excluir uma etapa: substitui, acrescenta ou remove só a barra e a linha da tabela tocadas.
+    # Devolve None quando o Patch não reproduz a tela certa (a etapa muda de posição na ordem, entra ou sai
+    # de outra página, ou o número de páginas muda): o chamador então redesenha a figura inteira.
+    fig, tabela = dash.Patch(), dash.Patch()
+    ids_gantt, ids_tabela, eid = list(visiveis['gantt']), list(visiveis['tabela']), alteracao['id']
+    df = get_etapa(eid) if alteracao['acao'] == 'salvar' else pd.DataFrame()
+    r = df.iloc[0].to_dict() if not df.empty and int(df.iloc[0]['projeto_id']) == int(obra_id) else None  # None: saiu desta obra
+    if r: r.update(data_inicio=pd.Timestamp(r['data_inicio']).strftime('%Y-%m-%d'), data_fim=pd.Timestamp(r['data_fim']).strftime('%Y-%m-%d'))
+
+    # Como a tela ficaria redesenhada do zero: ordem da tabela (get_cronograma) e janela da página no Gantt
+    df_obra = get_cronograma()
+    df_obra = df_obra[df_obra['projeto_id'] == int(obra_id)].assign(data_inicio=lambda d: pd.to_datetime(d['data_inicio']))
+    ordem_tabela = df_obra['id_etapa'].astype(int).tolist()
+    ordem_gantt = _ordenar_gantt_obra(df_obra)['id_etapa'].astype(int).tolist()
+    paginas = max(1, -(-len(ordem_gantt) // GANTT_LINHAS_POR_PAGINA))
+    inicio = (min(max(1, pagina or 1), paginas) - 1) * GANTT_LINHAS_POR_PAGINA
+    def _aplicado(ids): return [i for i in ids if i != eid or r] + ([eid] if r and eid not in ids else [])
+    if (paginas != visiveis.get('paginas', 1) or _aplicado(ids_gantt) != ordem_gantt[inicio:inicio + GANTT_LINHAS_POR_PAGINA]
+            or _aplicado(ids_tabela) != ordem_tabela):
+        return None
+
+    barra, trace = _barra_gantt(r) if r else None, fig['data'][0]
+    campos = [(trace['base'], 'base'), (trace['x'], 'x'), (trace['y'], 'y'), (trace['marker']['color'], 'color'), (trace['customdata'], 'customdata')]
+    if eid in ids_gantt:
+        i = ids_gantt.index(eid)
+        for alvo, campo in campos:
+            if barra: alvo[i] = barra[campo]
+            else: del alvo[i]
+        if not barra: ids_gantt.pop(i)
+    elif barra:
+        for alvo, campo in campos: alvo.append(barra[campo])
+        ids_gantt.append(eid)
+    fig['layout']['height'] = 300 + (len(ids_gantt) * 60)
+
+    if eid in ids_tabela:
+        i = ids_tabela.index(eid)
+        if r: tabela[i] = r
+        else: del tabela[i]; ids_tabela.pop(i)
+    elif r: tabela.append(r); ids_tabela.append(eid)
+    return fig, tabela, {'gantt': ids_gantt, 'tabela': ids_tabela, 'paginas': paginas}
+
+@figura_em_cache("descompasso")
 def gerar_grafico_descompasso(fisico_pct, financeiro_pct):
     cor_fin = "#ef4444" if financeiro_pct > (fisico_pct + 2) else "#10b981"
     fig = go.Figure()
@@ -362,9 +1227,371 @@ def gerar_grafico_descompasso(fisico_pct, financeiro_pct):
     return fig
 
 # --- 4. APP SETUP ---
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP], suppress_callback_exceptions=True)
+# Callbacks pesados (Curva S, projeção, ABC, painel global) rodam em processos do DiskcacheManager,
+# deixando os workers livres para os CRUDs. O resultado fica em cache por argumentos + versão dos dados.
+def _coletar_background():
+    # O que os jobs em segundo plano mandaram pelo diskcache: medições e contadores, tabelas base e figuras
+    _coletar_metricas_background(); _coletar_tabelas_background(); _coletar_figuras_background()
+
+def _versao_cache_callbacks():
+    # Chamado no worker antes de despachar cada job: incorpora o que os jobs anteriores carregaram, que o próximo processo herda
+    _coletar_background()
+    return repr(sorted(get_versoes_dados().items()))
+
+background_manager = dash.DiskcacheManager(diskcache.Cache(os.getenv("CALLBACK_CACHE_DIR", "./.cache_callbacks")), cache_by=[_versao_cache_callbacks], expire=int(os.getenv("CALLBACK_CACHE_EXPIRE", "600")))
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.BOOTSTRAP], suppress_callback_exceptions=True, background_callback_manager=background_manager)
 server = app.server
 
+# --- ENDPOINTS INTERNOS (diagnóstico) ---
+@server.route("/_interno/cache")
+def status_cache():
+    _coletar_background()
+    total = cache_stats['hits'] + cache_stats['misses']
+    total_fig = figura_stats['hits'] + figura_stats['misses']
+    figuras = {**figura_stats, 'hit_rate': (figura_stats['hits'] / total_fig) if total_fig else 0.0, 'entradas': len(_cache_figuras), 'bytes': _cache_figuras.currsize, 'max_bytes': _cache_figuras.maxsize}
+    return {**cache_stats, 'hit_rate': (cache_stats['hits'] / total) if total else 0.0, 'entradas': len(_cache_tabelas), 'max_entradas': _cache_tabelas.maxsize, 'ttl_segundos': _cache_tabelas.ttl, 'queries_por_callback': queries_por_callback, 'figuras': figuras}
+
+@server.before_request
+def _inicio_metrica_callback():
+    if not request.path.endswith("/_dash-update-component"): return
+    saida = (request.get_json(silent=True) or {}).get("output", "")
+    spec = app.callback_map.get(saida, {})
+    nome = getattr(spec.get("callback"), "__name__", "desconhecido")  # nunca o texto do cliente como rótulo
+    g.metrica_callback = {'nome': nome, 'inicio': time.perf_counter(), 'background': bool(spec.get("background"))}
+    _origem_sql.set(nome)
+
+@server.after_request
+def _fim_metrica_callback(resposta):
+    m = g.pop("metrica_callback", None)
+    if m is None: return resposta
+    _origem_sql.set("-")
+    if resposta.status_code >= 500: metrica_callback_erros.incrementar(callback=m['nome'])
+    if resposta.status_code != 200 or resposta.is_streamed: return resposta
+    corpo = resposta.get_data()
+    if m['background']:
+        # Despacho e consultas do job: só a resposta final conta como payload (o tempo vem do processo do job)
+        if b'"response"' in corpo: metrica_callback_bytes.observar(len(corpo), callback=m['nome'])
+        return resposta
+    metrica_callback_segundos.observar(time.perf_counter() - m['inicio'], callback=m['nome'])
+    metrica_callback_bytes.observar(len(corpo), callback=m['nome'])
+    return resposta
+
+@server.teardown_request
+def _erro_metrica_callback(exc):
+    # Exceção que escapou sem resposta (after_request não rodou)
+    m = g.pop("metrica_callback", None)
+    if m is None: return
+    _origem_sql.set("-")
+    metrica_callback_erros.incrementar(callback=m['nome'])
+    if not m['background']: metrica_callback_segundos.observar(time.perf_counter() - m['inicio'], callback=m['nome'])
+
+@server.route("/metrics")
+def metricas():
+    _coletar_background()
+    linhas = []
+    for m in METRICAS: linhas += m.exportar()
+    linhas += ["# HELP cache_tabelas_total Consultas ao cache das tabelas base por resultado.", "# TYPE cache_tabelas_total counter"]
+    linhas += [f'cache_tabelas_total{{resultado="{r}"}} {cache_stats[r]}' for r in ('hits', 'misses', 'invalidacoes')]
+    linhas += ["# HELP cache_figuras_bytes Tamanho do JSON guardado no cache de figuras.", "# TYPE cache_figuras_bytes gauge", f"cache_figuras_bytes {_cache_figuras.currsize}",
+               "# HELP cache_figuras_despejos_total Figuras descartadas pelo LRU para caber no orçamento.", "# TYPE cache_figuras_despejos_total counter", f"cache_figuras_despejos_total {figura_stats['despejos']}"]
+    linhas += ["# HELP pool_checkouts_total Checkouts de conexão do pool.", "# TYPE pool_checkouts_total counter", f"pool_checkouts_total {pool_stats['checkouts']}",
+               "# HELP pool_espera_segundos_total Tempo total esperando conexão livre.", "# TYPE pool_espera_segundos_total counter", f"pool_espera_segundos_total {pool_stats['espera_total_s']}",
+               "# HELP pool_timeouts_total Checkouts que estouraram DB_POOL_TIMEOUT.", "# TYPE pool_timeouts_total counter", f"pool_timeouts_total {pool_stats['timeouts']}"]
+    return Response("\n".join(linhas) + "\n", mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@server.route("/_interno/pool")
+def status_pool():
+    pool = engine.pool
+    info = {'status': pool.status(), **pool_stats, 'espera_media_ms': (pool_stats['espera_total_s'] / pool_stats['checkouts'] * 1000) if pool_stats['checkouts'] else 0.0}
+    if isinstance(pool, QueuePool): info.update({'tamanho': pool.size(), 'em_uso': pool.checkedout(), 'ociosas': pool.checkedin(), 'overflow': pool.overflow()})
+    return info
+
+# --- EXPORTAÇÃO EM STREAMING ---
+# Lê as linhas por cursor do servidor em blocos de EXPORT_CHUNK e grava direto na saída,
+# sem montar o DataFrame inteiro nem o workbook em memória.
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "5000"))
+COLUNAS_EXPORT = {
+    'despesas': ['id', 'projeto', 'projeto_id', 'categoria', 'descricao', 'valor', 'data_pagamento', 'status'],
+    'permutas': ['id', 'projeto', 'projeto_id', 'descricao', 'valor', 'data_permuta'],
+}
+
+def _blocos_exportacao(tabela, projeto_id=None, inicio=None, fim=None):
+    # Gera listas de linhas (tuplas) já filtradas por obra e período
+    cfg = PAGINACAO[tabela]
+    clausulas, params = ["1=1"], {}
+    if projeto_id: clausulas.append(f"{cfg['projeto_id']} = :pid"); params['pid'] = projeto_id
+    if inicio: clausulas.append(f"{cfg['data']} >= :ini"); params['ini'] = inicio
+    if fim: clausulas.append(f"{cfg['data']} <= :fim"); params['fim'] = fim
+    sql = f"SELECT {cfg['select']} FROM {cfg['from']} WHERE {' AND '.join(clausulas)} ORDER BY {cfg['data']} DESC, {cfg['id']} DESC"
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK).execute(text(sql), params)
+        for bloco in result.partitions(): yield bloco
+
+def _exportar_csv(blocos, colunas):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(colunas)
+    for bloco in blocos:
+        writer.writerows(bloco)
+        yield buffer.getvalue()
+        buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue()
+
+def _exportar_xlsx(blocos, colunas, destino):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Relatório")
+    ws.append(colunas)
+    for bloco in blocos:
+        for linha in bloco: ws.append([float(v) if isinstance(v, Decimal) else v for v in linha])
+    wb.save(destino)
+
+def _exportar_parquet(blocos, colunas, destino):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    tipos = {'id': pa.int64(), 'projeto_id': pa.int64(), 'valor': pa.float64(), 'data_pagamento': pa.date32(), 'data_permuta': pa.date32()}
+    schema = pa.schema([(c, tipos.get(c, pa.string())) for c in colunas])
+    with pq.ParquetWriter(destino, schema) as writer:
+        for bloco in blocos:
+            df = pd.DataFrame.from_records(bloco, columns=colunas)
+            df['valor'] = pd.to_numeric(df['valor'], errors='coerce')
+            for c in colunas:
+                if schema.field(c).type == pa.date32(): df[c] = pd.to_datetime(df[c]).dt.date
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+
+@server.route("/exportar/<tabela>.<formato>")
+def exportar(tabela, formato):
+    # /exportar/despesas.xlsx?projeto=3&inicio=2025-01-01&fim=2025-12-31
+    if tabela not in COLUNAS_EXPORT or formato not in ("xlsx", "csv", "parquet"): abort(404)
+    try:
+        projeto_id = int(request.args['projeto']) if request.args.get('projeto') else None
+        inicio = date.fromisoformat(request.args['inicio']) if request.args.get('inicio') else None
+        fim = date.fromisoformat(request.args['fim']) if request.args.get('fim') else None
+    except ValueError: abort(400)
+    colunas = COLUNAS_EXPORT[tabela]
+    blocos = _blocos_exportacao(tabela, projeto_id, inicio, fim)
+    nome = f"relatorio_{tabela}.{formato}"
+    if formato == "csv":
+        return Response(_exportar_csv(blocos, colunas), mimetype="text/csv", headers={"Content-Disposition": f"attachment; filename={nome}"})
+    # xlsx/parquet precisam do arquivo completo (zip / rodapé): grava em disco temporário, não em memória
+    destino = tempfile.TemporaryFile()
+    if formato == "xlsx": _exportar_xlsx(blocos, colunas, destino)
+    else: _exportar_parquet(blocos, colunas, destino)
+    destino.seek(0)
+    return send_file(destino, as_attachment=True, download_name=nome)
+
+# --- API JSON (SOMENTE LEITURA) ---
+# /api/v1/<recurso>?projeto=3&inicio=2025-01&fim=2025-12&formato=json|arrow
+# inicio/fim só valem para as séries mensais; kpis e resumo-financeiro são totais e respondem 400 a eles.
+# O ETag sai das versões (versao_dados) das tabelas de que o recurso depende + filtros + dia corrente
+# (atraso e projeção dependem da data). Com If-None-Match igual, responde 304 sem rodar nenhuma agregação.
+# JSON compacto: KPIs como objeto; séries/tabelas como {"colunas": [...], "linhas": [[...], ...]}.
+TABELAS_API = ('projetos', 'cronograma_etapas', 'despesas', 'permutas')
+MIME_ARROW = "application/vnd.apache.arrow.stream"
+
+def _api_kpis(projeto_id):
+    nomes = ['contratado', 'permuta', 'pago', 'saldo', 'atraso', 'perc_fisico', 'perc_financeiro']
+    return {n: round(float(v), 2) for n, v in zip(nomes, get_kpis_globais(projeto_id))}
+
+def _api_resumo_financeiro(projeto_id):
+    df = get_tabela_resumo_financeiro(projeto_id)
+    return df[['id', 'nome', 'empresa', 'vl_contrato', 'vl_pago', 'vl_permuta', 'saldo', 'perc_pago']]
+
+def _api_fluxo(projeto_id, inicio, fim, colunas, filtro):
+    # Séries mensais por projeto_id direto do fluxo_mensal (obras homônimas não se misturam)
+    df = get_fluxo_mensal()
+    mascara = filtro(df)
+    if projeto_id: mascara &= df['projeto_id'] == projeto_id
+    if inicio: mascara &= df['mes'] >= pd.Timestamp(inicio)
+    if fim: mascara &= df['mes'] <= pd.Timestamp(fim)
+    return df.loc[mascara, ['mes', 'projeto_id', 'projeto'] + colunas].sort_values(['mes', 'projeto_id'], ignore_index=True)
+
+# recurso -> (função, aceita período)
+RECURSOS_API = {
+    'kpis': (_api_kpis, False),
+    'resumo-financeiro': (_api_resumo_financeiro, False),
+    'orcado-realizado': (lambda pid, ini, fim: _api_fluxo(pid, ini, fim, ['orcado', 'realizado'], lambda df: (df['orcado'] != 0) | (df['realizado'] != 0)), True),
+    'projecao': (lambda pid, ini, fim: _api_fluxo(pid, ini, fim, ['projetado'], lambda df: df['projetado'] > 0), True),
+}
+
+def _api_mes(valor):
+    # Aceita AAAA-MM ou AAAA-MM-DD; as séries são mensais, então vale o mês da data
+    return date.fromisoformat(valor + "-01" if len(valor) == 7 else valor).replace(day=1) if valor else None
+
+def _api_corpo(dados, formato):
+    if isinstance(dados, dict): dados = pd.DataFrame([dados]) if formato == "arrow" else dados
+    else:
+        dados = dados.round(2)
+        if 'mes' in dados.columns: dados['mes'] = dados['mes'].dt.strftime('%Y-%m') if formato == "json" else dados['mes'].dt.date
+        if 'empresa' in dados.columns: dados['empresa'] = dados['empresa'].astype(str)
+    if formato == "json":
+        if not isinstance(dados, dict): dados = {'colunas': list(dados.columns), 'linhas': dados.astype(object).values.tolist()}
+        return json.dumps(dados, separators=(',', ':'), ensure_ascii=False), "application/json"
+    import pyarrow as pa
+    buffer = pa.BufferOutputStream()
+    tabela = pa.Table.from_pandas(dados, preserve_index=False)
+    with pa.ipc.new_stream(buffer, tabela.schema) as writer: writer.write_table(tabela)
+    return buffer.getvalue().to_pybytes(), MIME_ARROW
+
+@server.route("/api/v1/<recurso>")
+def api_leitura(recurso):
+    if recurso not in RECURSOS_API: abort(404)
+    try:
+        projeto_id = int(request.args['projeto']) if request.args.get('projeto') else None
+        inicio, fim = _api_mes(request.args.get('inicio')), _api_mes(request.args.get('fim'))
+    except ValueError: abort(400)
+    func, aceita_periodo = RECURSOS_API[recurso]
+    if (inicio or fim) and not aceita_periodo: abort(400, description=f"{recurso} não aceita inicio/fim (são totais da obra)")
+    formato = request.args.get('formato') or ("arrow" if request.accept_mimetypes.best == MIME_ARROW else "json")
+    if formato not in ("json", "arrow"): abort(400)
+
+    # Só a leitura de versao_dados antes do 304
+    versoes = get_versoes_dados()
+    chave = repr((recurso, [versoes.get(t, 0) for t in TABELAS_API], projeto_id, inicio, fim, formato, date.today()))
+    etag = hashlib.sha1(chave.encode()).hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+    else:
+        corpo, mimetype = _api_corpo(func(projeto_id, inicio, fim) if aceita_periodo else func(projeto_id), formato)
+        resposta = Response(corpo, mimetype=mimetype)
+    resposta.set_etag(etag)
+    resposta.headers['Cache-Control'] = 'no-cache'  # o cliente guarda, mas revalida a cada requisição
+    resposta.vary.add('Accept')
+    return resposta
+
+# --- IMPORTAÇÃO EM LOTE DE DESPESAS ---
+# Planilha (CSV/XLSX) -> validação em blocos de IMPORT_CHUNK linhas -> gravação na mesma transação
+# (COPY no Postgres, executemany nos demais). Linhas inválidas não entram e voltam no relatório com o motivo.
+# Colunas aceitas: as da exportação (projeto ou projeto_id, categoria, descricao, valor, data_pagamento, status).
+IMPORT_CHUNK = int(os.getenv("IMPORT_CHUNK", "5000"))
+IMPORT_MAX_ERROS_EXIBIDOS = 500
+CATEGORIAS_DESPESA = ["Mat/ Água", "Diesel", "Imprimação", "Emulsão", "Pedra 01", "Frete Emulsão", "Obra Baixa Tensão", "MÃO DE OBRA", "IPITHERM", "Outros"]
+COLUNAS_IMPORT = ['projeto_id', 'categoria', 'descricao', 'valor', 'data_pagamento', 'status']
+_APELIDOS_IMPORT = {'obra': 'projeto', 'descrição': 'descricao', 'data': 'data_pagamento', 'data pagamento': 'data_pagamento', 'id_projeto': 'projeto_id'}
+
+def _ler_planilha(conteudo, nome_arquivo):
+    # Gera DataFrames de texto com IMPORT_CHUNK linhas; o índice é o número da linha na planilha (cabeçalho = 1)
+    if nome_arquivo.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+        wb = load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+        linhas = wb.active.iter_rows(values_only=True)
+        cabecalho = [str(c or '').strip() for c in next(linhas, ())]
+        inicio = 2
+        while bloco := list(itertools.islice(linhas, IMPORT_CHUNK)):
+            largura = len(cabecalho)
+            df = pd.DataFrame([tuple(r[:largura]) + (None,) * (largura - len(r)) for r in bloco], columns=cabecalho, index=range(inicio, inicio + len(bloco)))
+            inicio += len(bloco)
+            yield df.map(lambda v: '' if v is None else (v.date().isoformat() if isinstance(v, datetime) else str(v)))
+        wb.close()
+    elif nome_arquivo.lower().endswith(".csv"):
+        try: texto = conteudo.decode("utf-8-sig")
+        except UnicodeDecodeError: texto = conteudo.decode("latin-1")  # Excel em português salva CSV em latin-1
+        primeira = texto.split("\n", 1)[0]
+        sep = ";" if primeira.count(";") >= primeira.count(",") else ","
+        for df in pd.read_csv(io.StringIO(texto), sep=sep, dtype=str, keep_default_na=False, chunksize=IMPORT_CHUNK):
+            df.index = df.index + 2
+            yield df
+    else: raise ValueError("Formato não suportado: envie .csv ou .xlsx")
+
+def _normalizar_colunas(df):
+    df.columns = [_APELIDOS_IMPORT.get(c.strip().lower(), c.strip().lower()) for c in df.columns]
+    df = df.loc[:, [c != '' for c in df.columns]]
+    faltando = [c for c in ('categoria', 'valor', 'data_pagamento') if c not in df.columns]
+    if 'projeto' not in df.columns and 'projeto_id' not in df.columns: faltando.insert(0, 'projeto (ou projeto_id)')
+    if faltando: raise ValueError(f"Colunas obrigatórias ausentes: {', '.join(faltando)}")
+    for c in ('projeto', 'projeto_id', 'descricao', 'status'):
+        if c not in df.columns: df[c] = ''
+    return df.apply(lambda col: col.str.strip())
+
+def _validar_bloco(df, obras_por_id, obras_por_nome):
+    # Validação vetorizada; devolve (linhas válidas no formato de COLUNAS_IMPORT, [{'linha', 'erro'}])
+    df = _normalizar_colunas(df)
+    df = df[(df != '').any(axis=1)]  # linhas em branco no fim da planilha não contam
+    erros = pd.Series('', index=df.index)
+    def marcar(mascara, msg): erros[mascara] = erros[mascara] + msg + "; "
+
+    # Obra: projeto_id tem prioridade; senão o nome (sem diferenciar maiúsculas). Nome repetido exige o id.
+    pid = pd.to_numeric(df['projeto_id'], errors='coerce')
+    por_nome = df['projeto'].str.casefold().map(obras_por_nome)
+    marcar(pid.isna() & (df['projeto_id'] != ''), "projeto_id inválido")
+    marcar(pid.notna() & ~pid.isin(list(obras_por_id)), "projeto_id não encontrado")
+    marcar((df['projeto_id'] == '') & (df['projeto'] == ''), "obra não informada")
+    marcar((df['projeto_id'] == '') & (df['projeto'] != '') & por_nome.isna(), "obra não encontrada")
+    marcar((df['projeto_id'] == '') & (por_nome == -1), "nome de obra repetido: informe projeto_id")
+    pid = pid.fillna(por_nome)
+
+    categorias = {c.casefold(): c for c in CATEGORIAS_DESPESA}
+    categoria = df['categoria'].str.casefold().map(categorias)
+    marcar(categoria.isna(), "categoria inválida")
+
+    # Valor: aceita 1234.56, 1234,56, 1.234,56 e R$ 1.234,56
+    txt = df['valor'].str.replace('R$', '', regex=False).str.replace(' ', '', regex=False)
+    txt = txt.where(~txt.str.contains(','), txt.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    valor = pd.to_numeric(txt, errors='coerce')
+    marcar(valor.isna(), "valor inválido")
+    marcar(valor <= 0, "valor deve ser positivo")
+
+    # Data: ISO (2025-01-31) ou dd/mm/aaaa
+    data = pd.to_datetime(df['data_pagamento'], format='ISO8601', errors='coerce')
+    data = data.fillna(pd.to_datetime(df['data_pagamento'], format='%d/%m/%Y', errors='coerce'))
+    marcar(data.isna(), "data inválida")
+
+    status = df['status'].replace('', 'Pago').str.capitalize()
+    marcar(~status.isin(['Pago', 'Pendente']), "status deve ser Pago ou Pendente")
+    marcar(df['descricao'].str.len() > 255, "descrição com mais de 255 caracteres")
+
+    ok = erros == ''
+    validas = list(zip(pid[ok].astype(int).tolist(), categoria[ok].tolist(), df.loc[ok, 'descricao'].tolist(), valor[ok].round(2).tolist(), data[ok].dt.date.tolist(), status[ok].tolist()))
+    return validas, [{'linha': int(i), 'erro': e.rstrip('; ')} for i, e in erros[~ok].items()]
+
+def _gravar_despesas(conn, linhas):
+    # COPY no Postgres (psycopg2: copy_expert; psycopg 3: cursor.copy); executemany nos demais bancos
+    if not linhas: return
+    if engine.dialect.name == "postgresql":
+        sql = f"COPY despesas ({', '.join(COLUNAS_IMPORT)}) FROM STDIN WITH (FORMAT csv)"
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if hasattr(cursor, "copy_expert"):
+                buffer = io.StringIO()
+                csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(linhas)  # texto entre aspas: descrição vazia vira '' e não NULL
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+            else:
+                with cursor.copy(sql) as copy:
+                    for linha in linhas: copy.write_row(linha)
+        finally: cursor.close()
+    else:
+        conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:p, :c, :d, :v, :dt, :s)"),
+                     [{"p": p, "c": c, "d": d, "v": v, "dt": dt, "s": st} for p, c, d, v, dt, st in linhas])
+
+def importar_despesas(conteudo, nome_arquivo):
+    # Tudo ou nada no banco: as linhas válidas de todos os blocos entram na mesma transação
+    inicio = time.perf_counter()
+    relatorio = {'arquivo': nome_arquivo, 'linhas': 0, 'importadas': 0, 'erros': []}
+    meses_por_obra = {}
+    with engine.connect() as conn:
+        obras = conn.execute(text("SELECT id, nome FROM projetos")).all()
+        obras_por_id = {pid for pid, _ in obras}
+        obras_por_nome = {}
+        for pid, nome in obras:
+            chave = (nome or '').strip().casefold()
+            obras_por_nome[chave] = -1 if chave in obras_por_nome else pid
+        for bloco in _ler_planilha(conteudo, nome_arquivo):
+            validas, erros = _validar_bloco(bloco, obras_por_id, obras_por_nome)
+            relatorio['linhas'] += len(validas) + len(erros)
+            relatorio['erros'] += erros
+            _gravar_despesas(conn, validas)
+            relatorio['importadas'] += len(validas)
+            for pid, _, _, _, dt, _ in validas: meses_por_obra.setdefault(pid, set()).add(_mes(dt))
+        for pid, meses in meses_por_obra.items(): atualizar_fluxo_mensal(conn, pid, sorted(meses))
+        if relatorio['importadas']: registrar_escrita(conn, "despesas")
+        conn.commit()
+    relatorio['segundos'] = time.perf_counter() - inicio
+    relatorio['linhas_por_segundo'] = relatorio['linhas'] / relatorio['segundos'] if relatorio['segundos'] else 0.0
+    print(f"[importação] {nome_arquivo}: {relatorio['importadas']}/{relatorio['linhas']} linhas em {relatorio['segundos']:.2f}s ({relatorio['linhas_por_segundo']:.0f} linhas/s), {len(relatorio['erros'])} com erro")
+    return relatorio
+
 # --- LAYOUT WRAPPERS ---
 sidebar = html.Div([
     html.Div([html.Span("EM", style={"backgroundColor": "#2563eb", "color": "white", "padding": "4px 8px", "borderRadius": "6px", "fontWeight": "bold", "marginRight": "8px"}), html.Span("EngManager", style={"fontWeight": "600", "fontSize": "1.2rem", "color": "white"})], style={"marginBottom": "2rem", "display": "flex", "alignItems": "center"}),
@@ -400,6 +1627,7 @@ def serve_resumo_global():
             dbc.Col(dcc.Dropdown(id='filtro-global-obra', options=opcoes, value='todos', clearable=False, placeholder="Filtrar por Obra", style={"borderRadius": "8px"}), width=4)
         ], className="mb-4 align-items-center"),
 
+        dbc.Progress(id='progresso-resumo', value=0, striped=True, animated=True, style={"display": "none"}, className="mb-3"),
         html.Div(id='conteudo-resumo-global'),
 
         dbc.Modal([
@@ -414,7 +1642,7 @@ def serve_projetos():
     opcoes_obras = [{'label': r['nome'], 'value': r['id']} for i, r in df_proj.iterrows()]
     opcoes_etapas = [{"label": x, "value": x} for x in ["TERRAPLANAGEM", "DRENAGEM", "REDE DE ÁGUA", "REDE DE ESGOTO", "PAVIMENTAÇÃO", "MEIO-FIO / SARJETA", "SINALIZAÇÃO", "ILUMINAÇÃO PÚBLICA", "ADMINISTRAÇÃO"]]
     return html.Div([
-        dcc.Store(id="stored-etapa-id", data=None),
+        dcc.Store(id="stored-etapa-id", data=None), dcc.Store(id="etapa-alterada", data=None), dcc.Store(id="etapas-visiveis", data=None),
         dbc.Row([dbc.Col(html.H2("Gestão de Obras", style={"color": "#111827", "fontWeight": "bold"}), width=8), dbc.Col(dbc.Button("🤝 Gerenciar Permutas", id="btn-open-permuta", color="info", className="w-100", style={"color":"white", "fontWeight": "bold"}), width=4)], className="align-items-center mb-4"),
         dbc.Row([
             dbc.Col(dbc.Card([dbc.CardHeader("🏗️ Cadastrar Nova Obra", style={"fontWeight": "bold"}), dbc.CardBody([dbc.Label("Nome"), dbc.Input(id="input-nova-obra"), dbc.Button("Criar", id="btn-criar-obra", color="primary", className="mt-3 w-100"), html.Div(id="msg-obra", className="mt-2")])], style={"height": "100%"}), width=3),
@@ -425,7 +1653,7 @@ def serve_projetos():
                     html.Div(id="msg-etapa", className="mt-2"), html.Hr(), dash_table.DataTable(id='tabela-etapas-crud', columns=[{'name': i, 'id': j} for i,j in [('Etapa','etapa'),('Início','data_inicio'),('Fim','data_fim'),('Valor','valor_estimado'),('%','percentual')]], data=[], row_selectable='single', style_table={'overflowX': 'auto'}, style_header={'backgroundColor': '#f3f4f6', 'fontWeight': 'bold'}, page_size=5)
             ])], style={"height": "100%"}), width=9)
         ]), html.Hr(className="my-4"),
-        dbc.Card([dbc.CardHeader([dbc.Row([dbc.Col("Gantt Físico-Financeiro", width=8, className="fw-bold"), dbc.Col(dbc.Button([html.I(className="bi bi-arrows-fullscreen me-2"), "Tela Cheia"], id="btn-gantt-fullscreen", color="secondary", size="sm", outline=True, className="float-end"), width=4)])]), dbc.CardBody([dcc.Loading(html.Div(dcc.Graph(id="grafico-gantt"), style={"overflowX": "auto", "width": "100%"}))])], style={"border": "none", "borderRadius": "12px"}),
+        dbc.Card([dbc.CardHeader([dbc.Row([dbc.Col("Gantt Físico-Financeiro", width=8, className="fw-bold"), dbc.Col(dbc.Button([html.I(className="bi bi-arrows-fullscreen me-2"), "Tela Cheia"], id="btn-gantt-fullscreen", color="secondary", size="sm", outline=True, className="float-end"), width=4)])]), dbc.CardBody([dcc.Loading(html.Div(dcc.Graph(id="grafico-gantt"), style={"overflowX": "auto", "width": "100%"})), dbc.Pagination(id="gantt-pagina", max_value=1, active_page=1, fully_expanded=False, size="sm", className="justify-content-center mt-2", style={"display": "none"})])], style={"border": "none", "borderRadius": "12px"}),
         dbc.Modal([dbc.ModalHeader("Visão Geral do Cronograma"), dbc.ModalBody(dcc.Graph(id="grafico-gantt-modal", style={"height": "85vh"})), dbc.ModalFooter(dbc.Button("Fechar", id="btn-close-fullscreen", className="ms-auto"))], id="modal-gantt-fullscreen", fullscreen=True),
         dbc.Modal([dbc.ModalHeader("Cadastrar Permuta"), dbc.ModalBody([dbc.Row([dbc.Col([dbc.Label("Projeto"), dbc.Select(id="modal-permuta-projeto", options=opcoes_obras)], width=12)], className="mb-3"), dbc.Row([dbc.Col([dbc.Label("Descrição"), dbc.Input(id="modal-permuta-desc")], width=12)], className="mb-3"), dbc.Row([dbc.Col([dbc.Label("Valor"), dbc.Input(id="modal-permuta-valor", type="number")], width=6), dbc.Col([dbc.Label("Data"), dbc.Input(id="modal-permuta-data", type="date")], width=6)], className="mb-3"), html.Div(id="msg-permuta-save")]), dbc.ModalFooter([dbc.Button("Fechar", id="btn-close-permuta", className="ms-auto"), dbc.Button("Salvar", id="btn-save-permuta", color="success")])], id="modal-permuta", is_open=False, size="lg")
     ])
@@ -434,38 +1662,42 @@ def serve_financeiro():
     df_proj = get_projetos()
     opcoes_proj = [{'label': r['nome'], 'value': r['id']} for i, r in df_proj.iterrows()]
     opcoes_filtro = [{'label': 'Todos os Projetos', 'value': 'todos'}] + [{'label': r['nome'], 'value': r['nome']} for i, r in df_proj.iterrows()]
-    cats = ["Mat/ Água", "Diesel", "Imprimação", "Emulsão", "Pedra 01", "Frete Emulsão", "Obra Baixa Tensão", "MÃO DE OBRA", "IPITHERM", "Outros"]
+    cats = CATEGORIAS_DESPESA
     return html.Div([
         dbc.Row([dbc.Col([html.H3("Fluxo de Caixa & Custos", style={"fontWeight": "bold"}), html.P("Orçado vs Realizado", style={"color": "#6b7280"})], width=8), dbc.Col([dbc.Button("➕ Nova Despesa", id="btn-open-modal", color="danger", className="w-100")], width=4)]), html.Hr(),
         dbc.Row([dbc.Col([dbc.Label("Filtrar Projeto:"), dbc.Select(id="filtro-fin", options=opcoes_filtro, value="todos")], width=4)], className="mb-4"),
-        dbc.Card([dbc.CardHeader("🔮 Projeção de Caixa Futuro", style={"backgroundColor": "white", "fontWeight": "bold"}), dbc.CardBody([dcc.Loading(dcc.Graph(id="grafico-projecao"))])], style={"border": "none", "borderRadius": "12px", "marginBottom": "20px"}),
-        dbc.Card(dbc.CardBody([dcc.Loading(dcc.Graph(id="grafico-financeiro"))]), style={"border": "none", "borderRadius": "12px", "marginBottom": "20px"}),
-        dbc.Card([dbc.CardHeader([dbc.Row([dbc.Col(html.H5("📉 Curva ABC"), width=6), dbc.Col(dbc.RadioItems(id="switch-pareto", options=[{"label": "Orçado", "value": "orcado"}, {"label": "Realizado", "value": "realizado"}], value="orcado", inline=True), width=6, className="d-flex justify-content-end")])]), dbc.CardBody([dcc.Loading(dcc.Graph(id="grafico-pareto"))])], style={"border": "none", "borderRadius": "12px"}),
+        dbc.Card([dbc.CardHeader("🔮 Projeção de Caixa Futuro", style={"backgroundColor": "white", "fontWeight": "bold"}), dbc.CardBody([html.Small(id="status-projecao", className="text-muted"), dcc.Loading(dcc.Graph(id="grafico-projecao"))])], style={"border": "none", "borderRadius": "12px", "marginBottom": "20px"}),
+        dbc.Card(dbc.CardBody([html.Small(id="status-financeiro", className="text-muted"), dcc.Loading(dcc.Graph(id="grafico-financeiro"))]), style={"border": "none", "borderRadius": "12px", "marginBottom": "20px"}),
+        dbc.Card([dbc.CardHeader([dbc.Row([dbc.Col(html.H5("📉 Curva ABC"), width=6), dbc.Col(dbc.RadioItems(id="switch-pareto", options=[{"label": "Orçado", "value": "orcado"}, {"label": "Realizado", "value": "realizado"}], value="orcado", inline=True), width=6, className="d-flex justify-content-end")])]), dbc.CardBody([html.Small(id="status-pareto", className="text-muted"), dcc.Loading(dcc.Graph(id="grafico-pareto"))])], style={"border": "none", "borderRadius": "12px"}),
         dbc.Modal([dbc.ModalHeader("Lançar Despesa"), dbc.ModalBody([dbc.Row([dbc.Col([dbc.Label("Projeto"), dbc.Select(id="modal-projeto", options=opcoes_proj)], width=12)], className="mb-3"), dbc.Row([dbc.Col([dbc.Label("Categoria"), dbc.Select(id="modal-categoria", options=[{'label': c, 'value': c} for c in cats])], width=12)], className="mb-3"), dbc.Row([dbc.Col([dbc.Label("Descrição"), dbc.Input(id="modal-desc")], width=12)], className="mb-3"), dbc.Row([dbc.Col([dbc.Label("Valor"), dbc.Input(id="modal-valor", type="number")], width=6), dbc.Col([dbc.Label("Data"), dbc.Input(id="modal-data", type="date")], width=6)], className="mb-3"), html.Div(id="msg-modal-save")]), dbc.ModalFooter([dbc.Button("Cancelar", id="btn-close-modal", className="ms-auto"), dbc.Button("Salvar", id="btn-save-despesa", color="success")])], id="modal-despesa", is_open=False, size="lg")
     ])
 
 def serve_tabelas():
     df_proj = get_projetos()
     opcoes_proj = [{'label': r['nome'], 'value': r['id']} for i, r in df_proj.iterrows()]
-    cats = ["Mat/ Água", "Diesel", "Imprimação", "Emulsão", "Pedra 01", "Frete Emulsão", "Obra Baixa Tensão", "MÃO DE OBRA", "IPITHERM", "Outros"]
+    cats = CATEGORIAS_DESPESA
     return html.Div([
-        dcc.Store(id="stored-despesa-id", data=None), dcc.Store(id="stored-permuta-id", data=None),
+        dcc.Store(id="stored-despesa-id", data=None), dcc.Store(id="stored-permuta-id", data=None), dcc.Store(id="despesa-alterada", data=None), dcc.Store(id="permuta-alterada", data=None),
         html.H2("Gerenciamento Detalhado", style={"color": "#111827", "fontWeight": "bold", "marginBottom": "20px"}),
+        dbc.Card([dbc.CardHeader("📤 Filtros de Exportação", style={"fontWeight": "bold"}), dbc.CardBody(dbc.Row([dbc.Col([dbc.Label("Projeto"), dbc.Select(id="export-projeto", options=[{'label': 'Todos', 'value': 'todos'}] + opcoes_proj, value='todos')], width=4), dbc.Col([dbc.Label("De"), dbc.Input(id="export-inicio", type="date")], width=3), dbc.Col([dbc.Label("Até"), dbc.Input(id="export-fim", type="date")], width=3), dbc.Col([dbc.Label("Formato"), dbc.Select(id="export-formato", options=[{'label': f, 'value': v} for f, v in [("Excel", "xlsx"), ("CSV", "csv"), ("Parquet", "parquet")]], value="xlsx")], width=2)]))], className="mb-4"),
         dbc.Card([dbc.CardHeader("📋 Gerenciar Despesas", style={"fontWeight": "bold"}), dbc.CardBody([
                 dbc.Row([dbc.Col([dbc.Label("Projeto"), dbc.Select(id="input-desp-projeto", options=opcoes_proj)], width=3), dbc.Col([dbc.Label("Categoria"), dbc.Select(id="input-desp-cat", options=[{'label': c, 'value': c} for c in cats])], width=3), dbc.Col([dbc.Label("Descrição"), dbc.Input(id="input-desp-desc")], width=4), dbc.Col([dbc.Label("Status"), dbc.Select(id="input-desp-status", options=[{'label': 'Pago', 'value': 'Pago'}, {'label': 'Pendente', 'value': 'Pendente'}], value='Pago')], width=2)], className="mb-2"),
                 dbc.Row([dbc.Col([dbc.Label("Valor"), dbc.Input(id="input-desp-valor", type="number")], width=3), dbc.Col([dbc.Label("Data"), dbc.Input(id="input-desp-data", type="date")], width=3), dbc.Col([dbc.Label("Ações"), html.Div([dbc.Button("Salvar", id="btn-save-desp-crud", color="success", className="me-2"), dbc.Button("Del", id="btn-del-desp-crud", color="danger", className="me-2", disabled=True), dbc.Button("Limpar", id="btn-clean-desp-crud", color="secondary", outline=True)], className="d-flex")], width=6)], className="mb-3"),
-                html.Div(id="msg-desp-crud"), html.Hr(), dash_table.DataTable(id='tabela-despesas-crud', columns=[{'name': i, 'id': j} for i,j in [('Projeto','projeto'),('Categoria','categoria'),('Descrição','descricao'),('Valor','valor'),('Data','data_pagamento'),('Status','status')]], data=[], row_selectable='single', page_size=10, style_table={'overflowX': 'auto'}), html.Div(dbc.Button("📥 Exportar Excel", id="btn-xls-despesas", color="success", size="sm", className="mt-2"))
+                html.Div(id="msg-desp-crud"), html.Hr(), dash_table.DataTable(id='tabela-despesas-crud', columns=[{'name': i, 'id': j, 'type': t} for i,j,t in [('Projeto','projeto','text'),('Categoria','categoria','text'),('Descrição','descricao','text'),('Valor','valor','numeric'),('Data','data_pagamento','datetime'),('Status','status','text')]], data=[], row_selectable='single', page_action='custom', page_current=0, page_size=10, page_count=1, sort_action='custom', sort_mode='single', sort_by=[], filter_action='custom', filter_query='', style_table={'overflowX': 'auto'}), dcc.Store(id="cursor-despesas", data={}), html.Div(dbc.Button("📥 Exportar", id="btn-xls-despesas", href="/exportar/despesas.xlsx", external_link=True, color="success", size="sm", className="mt-2")),
+                html.Hr(), dcc.Upload(id="upload-despesas", accept=".csv,.xlsx", children=html.Div(["📤 Importar despesas em lote: arraste ou ", html.A("selecione", style={"color": "#2563eb", "cursor": "pointer"}), " uma planilha CSV/XLSX ", html.Small("(colunas: projeto ou projeto_id, categoria, descricao, valor, data_pagamento, status)", style={"color": "#6b7280"})]), style={"border": "1px dashed #9ca3af", "borderRadius": "8px", "padding": "14px", "textAlign": "center", "backgroundColor": "#f9fafb"}),
+                dcc.Loading(html.Div(id="msg-import-despesas", className="mt-2"))
         ])], className="mb-5"),
         dbc.Card([dbc.CardHeader("🤝 Gerenciar Permutas", style={"fontWeight": "bold"}), dbc.CardBody([
                 dbc.Row([dbc.Col([dbc.Label("Projeto"), dbc.Select(id="input-perm-projeto", options=opcoes_proj)], width=4), dbc.Col([dbc.Label("Descrição"), dbc.Input(id="input-perm-desc")], width=8)], className="mb-2"),
                 dbc.Row([dbc.Col([dbc.Label("Valor"), dbc.Input(id="input-perm-valor", type="number")], width=4), dbc.Col([dbc.Label("Data"), dbc.Input(id="input-perm-data", type="date")], width=4), dbc.Col([dbc.Label("Ações"), html.Div([dbc.Button("Salvar", id="btn-save-perm-crud", color="success", className="me-2"), dbc.Button("Del", id="btn-del-perm-crud", color="danger", className="me-2", disabled=True), dbc.Button("Limpar", id="btn-clean-perm-crud", color="secondary", outline=True)], className="d-flex")], width=4)], className="mb-3"),
-                html.Div(id="msg-perm-crud"), html.Hr(), dash_table.DataTable(id='tabela-permutas-crud', columns=[{'name': i, 'id': j} for i,j in [('Projeto','projeto'),('Descrição','descricao'),('Valor','valor'),('Data','data_permuta')]], data=[], row_selectable='single', page_size=10, style_table={'overflowX': 'auto'}), html.Div(dbc.Button("📥 Exportar Excel", id="btn-xls-permutas", color="success", size="sm", className="mt-2"))
-        ])]), dcc.Download(id="download-despesas"), dcc.Download(id="download-permutas")
+                html.Div(id="msg-perm-crud"), html.Hr(), dash_table.DataTable(id='tabela-permutas-crud', columns=[{'name': i, 'id': j, 'type': t} for i,j,t in [('Projeto','projeto','text'),('Descrição','descricao','text'),('Valor','valor','numeric'),('Data','data_permuta','datetime')]], data=[], row_selectable='single', page_action='custom', page_current=0, page_size=10, page_count=1, sort_action='custom', sort_mode='single', sort_by=[], filter_action='custom', filter_query='', style_table={'overflowX': 'auto'}), dcc.Store(id="cursor-permutas", data={}), html.Div(dbc.Button("📥 Exportar", id="btn-xls-permutas", href="/exportar/permutas.xlsx", external_link=True, color="success", size="sm", className="mt-2"))
+        ])])
     ])
 
 # --- 5. CALLBACKS ---
 
 @app.callback(Output("page-content", "children"), [Input("url", "pathname")])
+@com_snapshot
 def render_page(path):
     if path == "/financeiro": return serve_financeiro()
     elif path == "/projetos": return serve_projetos()
@@ -475,17 +1707,24 @@ def render_page(path):
 # --- ATUALIZAÇÃO DO PAINEL GLOBAL ---
 @app.callback(
     Output('conteudo-resumo-global', 'children'),
-    Input('filtro-global-obra', 'value')
+    Input('filtro-global-obra', 'value'),
+    background=True,
+    progress=Output('progresso-resumo', 'value'),
+    running=[(Output('progresso-resumo', 'style'), {"height": "6px"}, {"display": "none"})],
+    cancel=[Input('url', 'pathname')]
 )
-def update_resumo_global_content(filtro_id):
+@com_snapshot
+def update_resumo_global_content(set_progress, filtro_id):
+    # Totais, histórico e Pareto não dependem um do outro: busca os três de uma vez
+    set_progress(5)
+    carregar_em_paralelo((get_totais_projetos, filtro_id), (get_dados_historico_tendencia, filtro_id), (get_dados_pareto_resumo, filtro_id))
     # 1. KPIs
+    set_progress(10)
     tot_contratado, tot_permuta, tot_pago_em_dinheiro, saldo, atraso, perc_fisico, perc_financeiro = get_kpis_globais(filtro_id)
     fmt = lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
     
     # 2. Tabela Resumo
-    df_resumo = get_tabela_resumo_financeiro()
-    if filtro_id and filtro_id != 'todos':
-        df_resumo = df_resumo[df_resumo['id'] == int(filtro_id)]
+    df_resumo = get_tabela_resumo_financeiro(filtro_id)
 
     table_rows = []
     for index, row in df_resumo.iterrows():
@@ -502,18 +1741,21 @@ def update_resumo_global_content(filtro_id):
         table_rows.append(html.Tr([html.Td("TOTAIS", colSpan=2, style={"textAlign": "right", "fontWeight": "bold"}), html.Td(html.B(fmt(df_resumo['vl_contrato'].sum()))), html.Td(html.B(fmt(df_resumo['vl_pago'].sum() + df_resumo['vl_permuta'].sum())), style={"color": "#10b981"}), html.Td(html.B(fmt(df_resumo['saldo'].sum())), style={"color": "#ef4444"}), html.Td("")], style={"backgroundColor": "#f9fafb"}))
 
     # 3. Gráficos
+    set_progress(40)
     # A) Gráfico Descompasso
     fig_descompasso = gerar_grafico_descompasso(perc_fisico, perc_financeiro)
     
     # B) Gráfico Tendência (Histórico)
     df_hist = get_dados_historico_tendencia(filtro_id)
     if not df_hist.empty:
-        fig_trend = px.line(df_hist, x='data_registro', y='percentual_novo', color='projeto', title="Evolução Física Registrada (Tendência)", template="plotly_white", markers=True)
+        fig_trend = px.line(df_hist, x='data_registro', y='percentual', color='projeto', title="Curva S Física (Avanço Ponderado por Valor)", template="plotly_white", markers=True, line_shape='hv', labels={'percentual': 'Avanço físico (%)', 'data_registro': 'Data'})
+        fig_trend.update_yaxes(range=[0, 100])
         graph_trend = dcc.Graph(figure=fig_trend, config={'displayModeBar': False}, style={"height": "300px"})
     else:
         graph_trend = html.Div("Sem histórico de evolução registrado.", className="text-center text-muted p-4")
 
     # C) Gráfico Pareto (Custos)
+    set_progress(75)
     df_pareto = get_dados_pareto_resumo(filtro_id)
     if not df_pareto.empty:
         fig_pareto = go.Figure()
@@ -553,77 +1795,103 @@ def update_resumo_global_content(filtro_id):
 @app.callback(Output("msg-obra", "children"), Input("btn-criar-obra", "n_clicks"), State("input-nova-obra", "value"), prevent_initial_call=True)
 def criar_obra(n, nome):
     if not nome: return dbc.Alert("Erro", color="danger")
-    with engine.connect() as conn: conn.execute(text("INSERT INTO projetos (nome) VALUES (:n)"), {"n": nome}); conn.commit()
+    with engine.connect() as conn:
+        conn.execute(text("INSERT INTO projetos (nome) VALUES (:n)"), {"n": nome})
+        registrar_escrita(conn, "projetos")
+        conn.commit()
     return dbc.Alert("Obra Criada!", color="success")
 
-@app.callback(Output("confirm-delete-obra", "displayed"), Input("btn-ask-delete-obra", "n_clicks"), prevent_initial_call=True)
-def show_delete_confirm(n): return True
+app.clientside_callback(ClientsideFunction("ui", "confirmar_exclusao"), Output("confirm-delete-obra", "displayed"), Input("btn-ask-delete-obra", "n_clicks"), prevent_initial_call=True)
 
 @app.callback([Output("url", "pathname", allow_duplicate=True), Output("msg-obra", "children", allow_duplicate=True)], Input("confirm-delete-obra", "submit_n_clicks"), State("select-obra", "value"), prevent_initial_call=True)
 def excluir_obra_completa(submit_n_clicks, obra_id):
     if not obra_id: return dash.no_update, dbc.Alert("Selecione!", color="warning")
     try:
         with engine.connect() as conn:
-            for t in ["historico_fisico", "cronograma_etapas", "despesas", "permutas", "projetos"]:
+            for t in ["historico_fisico", "cronograma_etapas", "despesas", "permutas", "fluxo_mensal", "curva_fisica", "projetos"]:
                 id_col = 'id' if t == 'projetos' else 'projeto_id'
                 if t == 'historico_fisico': # Historico não tem projeto_id direto, apaga via cascade ou subquery, mas aqui garantimos limpeza
                     pass # O DB cascade cuida, ou limpamos via etapa
                 else:
                     conn.execute(text(f"DELETE FROM {t} WHERE {id_col} = :id"), {"id": obra_id})
+            registrar_escrita(conn, "historico_fisico", "cronograma_etapas", "despesas", "permutas", "projetos")
             conn.commit()
         return "/projetos", dbc.Alert("Excluído!", color="success")
     except Exception as e: return dash.no_update, dbc.Alert(f"Erro: {e}", color="danger")
 
 # --- CALLBACK DE SALVAMENTO DE ETAPA COM HISTÓRICO ---
+# Limpar, seleção na tabela e clique no Gantt só copiam valores para o formulário: rodam no navegador (assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction("ui", "preencher_form_etapa"),
+    [Output("msg-etapa", "children", allow_duplicate=True), Output("input-valor", "value", allow_duplicate=True), Output("input-percent", "value", allow_duplicate=True), Output("input-inicio", "value", allow_duplicate=True), Output("input-fim", "value", allow_duplicate=True), Output("select-etapa", "value", allow_duplicate=True), Output("stored-etapa-id", "data", allow_duplicate=True), Output("btn-excluir-etapa", "disabled", allow_duplicate=True), Output("tabela-etapas-crud", "selected_rows", allow_duplicate=True), Output("select-obra", "value", allow_duplicate=True)],
+    [Input("btn-limpar-form", "n_clicks"), Input("tabela-etapas-crud", "selected_rows"), Input("grafico-gantt", "clickData")],
+    State("tabela-etapas-crud", "data"), prevent_initial_call=True
+)
+
 @app.callback(
-    [Output("msg-etapa", "children"), Output("input-valor", "value"), Output("input-percent", "value"), Output("input-inicio", "value"), Output("input-fim", "value"), Output("select-etapa", "value"), Output("stored-etapa-id", "data"), Output("btn-excluir-etapa", "disabled"), Output("tabela-etapas-crud", "selected_rows"), Output("select-obra", "value")],
-    [Input("btn-salvar-etapa", "n_clicks"), Input("btn-excluir-etapa", "n_clicks"), Input("btn-limpar-form", "n_clicks"), Input("tabela-etapas-crud", "selected_rows"), Input("grafico-gantt", "clickData")], 
-    [State("select-obra", "value"), State("select-etapa", "value"), State("input-valor", "value"), State("input-percent", "value"), State("input-inicio", "value"), State("input-fim", "value"), State("stored-etapa-id", "data"), State("tabela-etapas-crud", "data")]
+    [Output("msg-etapa", "children"), Output("input-valor", "value"), Output("input-percent", "value"), Output("input-inicio", "value"), Output("input-fim", "value"), Output("select-etapa", "value"), Output("stored-etapa-id", "data"), Output("btn-excluir-etapa", "disabled"), Output("tabela-etapas-crud", "selected_rows"), Output("select-obra", "value"), Output("etapa-alterada", "data")],
+    [Input("btn-salvar-etapa", "n_clicks"), Input("btn-excluir-etapa", "n_clicks")],
+    [State("select-obra", "value"), State("select-etapa", "value"), State("input-valor", "value"), State("input-percent", "value"), State("input-inicio", "value"), State("input-fim", "value"), State("stored-etapa-id", "data")],
+    prevent_initial_call=True
 )
-def manage_stage_crud(n_save, n_del, n_clean, selected_rows, clickData, obra_id, etapa, val, perc, ini, fim, current_id, table_data):
-    ctx = callback_context
-    trig = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else ""
-    
-    if trig == "grafico-gantt" and clickData:
-        try:
-            cdata = clickData['points'][0]['customdata']
-            return "", cdata[1], cdata[2], cdata[3], cdata[4], cdata[5], cdata[0], False, dash.no_update, cdata[6]
-        except: pass
-        
-    if trig == "tabela-etapas-crud" and selected_rows:
-        if table_data and selected_rows[0] < len(table_data):
-            row = table_data[selected_rows[0]]
-            return "", row['valor_estimado'], row['percentual'], row['data_inicio'], row['data_fim'], row['etapa'], row['id_etapa'], False, dash.no_update, row['projeto_id']
-            
-    if trig == "btn-limpar-form": return "", "", "", "", "", None, None, True, [], None
-    
+def manage_stage_crud(n_save, n_del, obra_id, etapa, val, perc, ini, fim, current_id):
+    trig = callback_context.triggered_id
+
     if trig == "btn-excluir-etapa" and current_id:
-        with engine.connect() as conn: conn.execute(text("DELETE FROM cronograma_etapas WHERE id = :id"), {"id": current_id}); conn.commit()
-        return dbc.Alert("Excluído!", color="warning"), "", "", "", "", None, None, True, [], dash.no_update
+        with engine.connect() as conn:
+            pid_antigo = conn.execute(text("SELECT projeto_id FROM cronograma_etapas WHERE id = :id"), {"id": current_id}).scalar()
+            conn.execute(text("DELETE FROM cronograma_etapas WHERE id = :id"), {"id": current_id})
+            atualizar_fluxo_mensal(conn, pid_antigo)
+            atualizar_curva_fisica(conn, pid_antigo)
+            registrar_escrita(conn, "cronograma_etapas", "historico_fisico")
+            conn.commit()
+        return dbc.Alert("Excluído!", color="warning"), "", "", "", "", None, None, True, [], dash.no_update, {"acao": "excluir", "id": current_id}
         
     if trig == "btn-salvar-etapa":
-        if not all([obra_id, etapa, ini, fim]): return dbc.Alert("Preencha!", color="warning"), dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, current_id, (current_id is None), dash.no_update, dash.no_update
+        if not all([obra_id, etapa, ini, fim]): return dbc.Alert("Preencha!", color="warning"), dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, current_id, (current_id is None), dash.no_update, dash.no_update, dash.no_update
         
         val, perc = val or 0, perc or 0
         with engine.connect() as conn:
             if current_id: 
+                pid_antigo, val_antigo, perc_antigo = conn.execute(text("SELECT projeto_id, valor_estimado, percentual FROM cronograma_etapas WHERE id = :id"), {"id": current_id}).one()
                 conn.execute(text("UPDATE cronograma_etapas SET etapa=:e, data_inicio=:i, data_fim=:f, valor_estimado=:v, percentual=:p, projeto_id=:pid WHERE id=:id"), {"e": etapa, "i": ini, "f": fim, "v": val, "p": perc, "id": current_id, "pid": obra_id})
-                # REGISTRA HISTÓRICO (UPDATE)
-                conn.execute(text("INSERT INTO historico_fisico (etapa_id, data_registro, percentual_novo) VALUES (:eid, CURRENT_DATE, :p)"), {"eid": current_id, "p": perc})
+                # REGISTRA HISTÓRICO (UPDATE) - só quando o avanço mudou
+                mudou_avanco = registrar_avanco(conn, current_id, perc, perc_antigo)
+                etapa_id = current_id
             else: 
                 # REGISTRA NOVO E HISTÓRICO
                 res = conn.execute(text("INSERT INTO cronograma_etapas (projeto_id, etapa, data_inicio, data_fim, valor_estimado, percentual) VALUES (:pid, :e, :i, :f, :v, :p) RETURNING id"), {"pid": obra_id, "e": etapa, "i": ini, "f": fim, "v": val, "p": perc})
-                new_id = res.fetchone()[0]
-                conn.execute(text("INSERT INTO historico_fisico (etapa_id, data_registro, percentual_novo) VALUES (:eid, CURRENT_DATE, :p)"), {"eid": new_id, "p": perc})
+                etapa_id = res.fetchone()[0]
+                mudou_avanco = registrar_avanco(conn, etapa_id, perc)
+                pid_antigo, val_antigo = None, None
+            # Orçado/projetado da obra (e da obra anterior, se a etapa mudou de obra)
+            for pid in {pid_antigo, int(obra_id)}: atualizar_fluxo_mensal(conn, pid)
+            # Curva física: só o avanço mudou -> estende a partir de hoje; peso/obra mudou -> refaz as obras envolvidas
+            if pid_antigo == int(obra_id) and float(val_antigo or 0) == float(val):
+                if mudou_avanco: atualizar_curva_fisica(conn, obra_id, desde=date.today())
+            else:
+                for pid in {pid_antigo, int(obra_id)}: atualizar_curva_fisica(conn, pid)
+            registrar_escrita(conn, "cronograma_etapas", "historico_fisico")
             conn.commit()
-        return dbc.Alert("Salvo e Registrado!", color="success"), "", "", "", "", None, None, True, [], dash.no_update
+        return dbc.Alert("Salvo e Registrado!", color="success"), "", "", "", "", None, None, True, [], dash.no_update, {"acao": "salvar", "id": etapa_id}
         
-    return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, True, dash.no_update, dash.no_update
-
-@app.callback([Output("grafico-gantt", "figure"), Output("tabela-etapas-crud", "data"), Output("select-obra", "options")], [Input("url", "pathname"), Input("msg-etapa", "children"), Input("msg-obra", "children"), Input("select-obra", "value")])
-def update_view_projetos(path, msg_etapa, msg_obra, obra_id):
-    df_proj = get_projetos()
-    opts = [{'label': r['nome'], 'value': r['id']} for i, r in df_proj.iterrows()]
+    return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, True, dash.no_update, dash.no_update, dash.no_update
+
+@app.callback([Output("grafico-gantt", "figure"), Output("tabela-etapas-crud", "data"), Output("select-obra", "options"), Output("gantt-pagina", "active_page"), Output("gantt-pagina", "max_value"), Output("gantt-pagina", "style"), Output("etapas-visiveis", "data")], [Input("url", "pathname"), Input("etapa-alterada", "data"), Input("msg-obra", "children"), Input("select-obra", "value"), Input("gantt-pagina", "active_page")], State("etapas-visiveis", "data"))
+@com_snapshot
+def update_view_projetos(path, alteracao, msg_obra, obra_id, pagina, visiveis):
+    # Etapa salva/excluída: Patch da barra e da linha quando ordem e paginação não mudam; senão redesenha abaixo
+    if callback_context.triggered_id == "etapa-alterada":
+        if not alteracao: return (dash.no_update,) * 7
+        patch = _patch_view_etapa(alteracao, obra_id, visiveis, pagina) if obra_id and visiveis and visiveis.get('gantt') else None
+        if patch is not None:
+            fig, tabela, visiveis = patch
+            return fig, tabela, dash.no_update, dash.no_update, dash.no_update, dash.no_update, visiveis
+    # A lista de obras só muda ao abrir a tela ou criar/excluir obra
+    if callback_context.triggered_id in (None, "url", "msg-obra"):
+        carregar_em_paralelo((get_projetos,), (get_cronograma,))
+        opts = [{'label': r['nome'], 'value': r['id']} for i, r in get_projetos().iterrows()]
+    else: opts = dash.no_update
     tabela_data = []
     if obra_id:
         df_crono = get_cronograma()
@@ -632,50 +1900,60 @@ def update_view_projetos(path, msg_etapa, msg_obra, obra_id):
             df_filtered['data_inicio'] = pd.to_datetime(df_filtered['data_inicio']).dt.strftime('%Y-%m-%d')
             df_filtered['data_fim'] = pd.to_datetime(df_filtered['data_fim']).dt.strftime('%Y-%m-%d')
             tabela_data = df_filtered.to_dict('records')
-    return gerar_figura_gantt(obra_id), tabela_data, opts
-
-@app.callback([Output("modal-gantt-fullscreen", "is_open"), Output("grafico-gantt-modal", "figure")], [Input("btn-gantt-fullscreen", "n_clicks"), Input("btn-close-fullscreen", "n_clicks")], [State("modal-gantt-fullscreen", "is_open"), State("select-obra", "value")])
-def toggle_fullscreen_gantt(n_open, n_close, is_open, obra_id):
-    ctx = callback_context
-    if not ctx.triggered: return is_open, dash.no_update
-    btn = ctx.triggered[0]['prop_id'].split('.')[0]
-    if btn == "btn-gantt-fullscreen": return True, gerar_figura_gantt(obra_id)
-    return False, dash.no_update
+    # Trocar de obra (ou de tela) volta para a primeira janela do Gantt; salvar uma etapa mantém a página
+    if callback_context.triggered_id in ("url", "select-obra"): pagina = 1
+    fig, total_paginas = gerar_figura_gantt(obra_id, pagina)
+    pagina = min(max(1, pagina or 1), total_paginas)
+    # Ids na ordem em que estão na tela (só no Gantt detalhado; a visão geral tem uma barra por obra)
+    ids_gantt = [int(c[0]) for c in fig['data'][0]['customdata']] if obra_id and fig['data'] else []
+    visiveis = {'gantt': ids_gantt, 'tabela': [int(r['id_etapa']) for r in tabela_data], 'paginas': total_paginas}
+    return fig, tabela_data, opts, pagina, total_paginas, ({"display": "none"} if total_paginas == 1 else {}), visiveis
+
+# Tela cheia reaproveita a figura já desenhada no card, direto no navegador (sem recalcular nem trafegar de novo)
+app.clientside_callback(
+    ClientsideFunction("ui", "gantt_tela_cheia"),
+    [Output("modal-gantt-fullscreen", "is_open"), Output("grafico-gantt-modal", "figure")], [Input("btn-gantt-fullscreen", "n_clicks"), Input("btn-close-fullscreen", "n_clicks")], [State("modal-gantt-fullscreen", "is_open"), State("grafico-gantt", "figure")]
+)
 
-@app.callback(Output("modal-permuta", "is_open"), [Input("btn-open-permuta", "n_clicks"), Input("btn-close-permuta", "n_clicks"), Input("btn-save-permuta", "n_clicks")], [State("modal-permuta", "is_open"), State("msg-permuta-save", "children")])
-def toggle_permuta(n1, n2, n3, is_open, msg):
-    ctx = callback_context
-    if not ctx.triggered: return is_open
-    if ctx.triggered[0]['prop_id'].split('.')[0] == "btn-save-permuta" and msg and "success" in str(msg): return False
-    return not is_open
+app.clientside_callback(ClientsideFunction("ui", "alternar_modal"), Output("modal-permuta", "is_open"), [Input("btn-open-permuta", "n_clicks"), Input("btn-close-permuta", "n_clicks"), Input("msg-permuta-save", "children")], State("modal-permuta", "is_open"), prevent_initial_call=True)
 
 @app.callback(Output("msg-permuta-save", "children"), Input("btn-save-permuta", "n_clicks"), [State("modal-permuta-projeto", "value"), State("modal-permuta-desc", "value"), State("modal-permuta-valor", "value"), State("modal-permuta-data", "value")], prevent_initial_call=True)
 def salvar_permuta(n, proj, desc, val, dt):
     if not all([proj, val, dt]): return dbc.Alert("Preencha!", color="warning")
-    with engine.connect() as conn: conn.execute(text("INSERT INTO permutas (projeto_id, descricao, valor, data_permuta) VALUES (:p, :d, :v, :dt)"), {"p": proj, "d": desc or "", "v": val, "dt": dt}); conn.commit()
+    with engine.connect() as conn:
+        conn.execute(text("INSERT INTO permutas (projeto_id, descricao, valor, data_permuta) VALUES (:p, :d, :v, :dt)"), {"p": proj, "d": desc or "", "v": val, "dt": dt})
+        atualizar_fluxo_mensal(conn, proj, [dt])
+        registrar_escrita(conn, "permutas")
+        conn.commit()
     return dbc.Alert("Sucesso!", color="success")
 
-@app.callback(Output("modal-despesa", "is_open"), [Input("btn-open-modal", "n_clicks"), Input("btn-close-modal", "n_clicks"), Input("btn-save-despesa", "n_clicks")], [State("modal-despesa", "is_open"), State("msg-modal-save", "children")])
-def toggle_despesa(n1, n2, n3, is_open, msg):
-    ctx = callback_context
-    if not ctx.triggered: return is_open
-    if ctx.triggered[0]['prop_id'].split('.')[0] == "btn-save-despesa" and msg and "success" in str(msg): return False
-    return not is_open
+app.clientside_callback(ClientsideFunction("ui", "alternar_modal"), Output("modal-despesa", "is_open"), [Input("btn-open-modal", "n_clicks"), Input("btn-close-modal", "n_clicks"), Input("msg-modal-save", "children")], State("modal-despesa", "is_open"), prevent_initial_call=True)
 
 @app.callback(Output("msg-modal-save", "children"), Input("btn-save-despesa", "n_clicks"), [State("modal-projeto", "value"), State("modal-categoria", "value"), State("modal-desc", "value"), State("modal-valor", "value"), State("modal-data", "value")], prevent_initial_call=True)
 def salvar_despesa(n, proj, cat, desc, val, dt):
     if not all([proj, cat, val, dt]): return dbc.Alert("Preencha!", color="warning")
-    with engine.connect() as conn: conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento) VALUES (:p, :c, :d, :v, :t)"), {"p": proj, "c": cat, "d": desc or "", "v": val, "dt": dt}); conn.commit()
+    with engine.connect() as conn:
+        conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento) VALUES (:p, :c, :d, :v, :dt)"), {"p": proj, "c": cat, "d": desc or "", "v": val, "dt": dt})
+        atualizar_fluxo_mensal(conn, proj, [dt])
+        registrar_escrita(conn, "despesas")
+        conn.commit()
     return dbc.Alert("Sucesso!", color="success")
 
-@app.callback(Output("grafico-financeiro", "figure"), [Input("filtro-fin", "value"), Input("btn-save-despesa", "n_clicks")])
-def update_graph(filtro, n):
+@app.callback(Output("grafico-financeiro", "figure"), [Input("filtro-fin", "value"), Input("btn-save-despesa", "n_clicks")], background=True, progress=Output("status-financeiro", "children"), running=[(Output("status-financeiro", "style"), {}, {"display": "none"})], cancel=[Input("url", "pathname")])
+@com_snapshot
+def update_graph(set_progress, filtro, n):
+    set_progress("Carregando fluxo mensal...")
+    return gerar_figura_curva_s(filtro, progresso=set_progress)
+
+@figura_em_cache("curva_s", *TABELAS_API)
+def gerar_figura_curva_s(filtro, progresso=None):
     df = calcular_orcado_vs_realizado()
     if df.empty: return px.bar(title="Sem dados suficientes", template="plotly_white")
     if filtro and filtro != 'todos': df = df[df['projeto'] == filtro]
     df_tot = df.groupby('data_ref')[['valor_orcado', 'valor_realizado']].sum().reset_index().sort_values('data_ref')
     df_tot['acum_orcado'] = df_tot['valor_orcado'].cumsum()
     df_tot['acum_realizado'] = df_tot['valor_realizado'].cumsum()
+    if progresso: progresso("Montando Curva S...")
     fig = go.Figure()
     fig.add_trace(go.Bar(x=df_tot['data_ref'], y=df_tot['valor_realizado'], name='Desembolso', marker_color='rgba(16, 185, 129, 0.3)'))
     fig.add_trace(go.Scatter(x=df_tot['data_ref'], y=df_tot['acum_orcado'], name='Planejado', mode='lines+markers', line=dict(color='#3b82f6', width=3, dash='dot')))
@@ -683,29 +1961,42 @@ def update_graph(filtro, n):
     fig.update_layout(title="Curva S & Fluxo de Caixa", template="plotly_white", hovermode="x unified", legend=dict(orientation="h", y=1.02), yaxis=dict(title="R$"))
     return fig
 
-@app.callback(Output("grafico-pareto", "figure"), [Input("filtro-fin", "value"), Input("btn-save-despesa", "n_clicks"), Input("switch-pareto", "value")])
-def update_pareto(filtro, n, modo_visao):
+@app.callback(Output("grafico-pareto", "figure"), [Input("filtro-fin", "value"), Input("btn-save-despesa", "n_clicks"), Input("switch-pareto", "value")], background=True, progress=Output("status-pareto", "children"), running=[(Output("status-pareto", "style"), {}, {"display": "none"})], cancel=[Input("url", "pathname")])
+@com_snapshot
+def update_pareto(set_progress, filtro, n, modo_visao):
+    set_progress("Carregando lançamentos...")
+    return gerar_figura_pareto(filtro, modo_visao, progresso=set_progress)
+
+@figura_em_cache("pareto", 'cronograma_etapas', 'despesas', 'projetos')
+def gerar_figura_pareto(filtro, modo_visao, progresso=None):
     if modo_visao == "orcado": df, col_v, col_c, tit, color = get_cronograma(), "valor_estimado", "etapa", "Valor Orçado", "#94a3b8"
     else: df, col_v, col_c, tit, color = get_despesas_realizadas(), "valor", "categoria", "Valor Pago", "#3b82f6"
     if df.empty: return px.bar(title="Sem dados", template="plotly_white")
     if filtro and filtro != 'todos': df = df[df['projeto'] == filtro]
     if df.empty: return px.bar(title="Sem dados para este filtro", template="plotly_white")
-    df_cat = df.groupby(col_c)[col_v].sum().reset_index().sort_values(by=col_v, ascending=False)
+    df_cat = df.groupby(col_c, observed=True)[col_v].sum().reset_index().sort_values(by=col_v, ascending=False)
     df_cat['perc_acumulado'] = (df_cat[col_v].cumsum() / df_cat[col_v].sum()) * 100
+    if progresso: progresso("Montando Curva ABC...")
     fig = go.Figure()
     fig.add_trace(go.Bar(x=df_cat[col_c], y=df_cat[col_v], name=tit, marker_color=color))
     fig.add_trace(go.Scatter(x=df_cat[col_c], y=df_cat['perc_acumulado'], name='% Acumulada', yaxis='y2', mode='lines+markers', line=dict(color='#ef4444')))
     fig.update_layout(template="plotly_white", title=f"Curva ABC ({'Orçamento' if modo_visao == 'orcado' else 'Realizado'})", yaxis=dict(title="R$"), yaxis2=dict(title="%", overlaying='y', side='right', range=[0, 110], showgrid=False), legend=dict(orientation='h', y=1.1))
     return fig
 
-@app.callback(Output("download-despesas", "data"), Input("btn-xls-despesas", "n_clicks"), prevent_initial_call=True)
-def export_despesas(n): return dcc.send_data_frame(get_despesas_realizadas().to_excel, "relatorio_despesas.xlsx", index=False)
+@app.callback([Output("btn-xls-despesas", "href"), Output("btn-xls-permutas", "href")], [Input("export-projeto", "value"), Input("export-inicio", "value"), Input("export-fim", "value"), Input("export-formato", "value")])
+def update_links_exportacao(projeto, inicio, fim, formato):
+    params = {k: v for k, v in [("projeto", projeto if projeto != 'todos' else None), ("inicio", inicio), ("fim", fim)] if v}
+    query = ("?" + urlencode(params)) if params else ""
+    return f"/exportar/despesas.{formato or 'xlsx'}{query}", f"/exportar/permutas.{formato or 'xlsx'}{query}"
 
-@app.callback(Output("download-permutas", "data"), Input("btn-xls-permutas", "n_clicks"), prevent_initial_call=True)
-def export_permutas(n): return dcc.send_data_frame(get_permutas().to_excel, "relatorio_permutas.xlsx", index=False)
+@app.callback(Output("grafico-projecao", "figure"), [Input("filtro-fin", "value")], background=True, progress=Output("status-projecao", "children"), running=[(Output("status-projecao", "style"), {}, {"display": "none"})], cancel=[Input("url", "pathname")])
+@com_snapshot
+def update_projecao_chart(set_progress, filtro):
+    set_progress("Calculando projeção...")
+    return gerar_figura_projecao(filtro)
 
-@app.callback(Output("grafico-projecao", "figure"), [Input("filtro-fin", "value")])
-def update_projecao_chart(filtro):
+@figura_em_cache("projecao", *TABELAS_API)
+def gerar_figura_projecao(filtro):
     df_fut = calcular_projecao_futura()
     if df_fut.empty: return px.bar(title="Sem projeção futura", template="plotly_white")
     if filtro and filtro != 'todos': df_fut = df_fut[df_fut['Projeto'] == filtro]
@@ -714,62 +2005,124 @@ def update_projecao_chart(filtro):
     fig.update_traces(marker_line_width=0)
     return fig
 
-@app.callback([Output("msg-desp-crud", "children"), Output("input-desp-projeto", "value"), Output("input-desp-cat", "value"), Output("input-desp-desc", "value"), Output("input-desp-status", "value"), Output("input-desp-valor", "value"), Output("input-desp-data", "value"), Output("stored-despesa-id", "data"), Output("btn-del-desp-crud", "disabled"), Output("tabela-despesas-crud", "data"), Output("tabela-despesas-crud", "selected_rows")], [Input("btn-save-desp-crud", "n_clicks"), Input("btn-del-desp-crud", "n_clicks"), Input("btn-clean-desp-crud", "n_clicks"), Input("tabela-despesas-crud", "selected_rows"), Input("url", "pathname")], [State("input-desp-projeto", "value"), State("input-desp-cat", "value"), State("input-desp-desc", "value"), State("input-desp-status", "value"), State("input-desp-valor", "value"), State("input-desp-data", "value"), State("stored-despesa-id", "data"), State("tabela-despesas-crud", "data")])
+@app.callback([Output("msg-desp-crud", "children"), Output("input-desp-projeto", "value"), Output("input-desp-cat", "value"), Output("input-desp-desc", "value"), Output("input-desp-status", "value"), Output("input-desp-valor", "value"), Output("input-desp-data", "value"), Output("stored-despesa-id", "data"), Output("btn-del-desp-crud", "disabled"), Output("tabela-despesas-crud", "selected_rows"), Output("despesa-alterada", "data")], [Input("btn-save-desp-crud", "n_clicks"), Input("btn-del-desp-crud", "n_clicks"), Input("btn-clean-desp-crud", "n_clicks"), Input("tabela-despesas-crud", "selected_rows"), Input("url", "pathname")], [State("input-desp-projeto", "value"), State("input-desp-cat", "value"), State("input-desp-desc", "value"), State("input-desp-status", "value"), State("input-desp-valor", "value"), State("input-desp-data", "value"), State("stored-despesa-id", "data"), State("tabela-despesas-crud", "data")])
 def manage_despesas_crud(n_save, n_del, n_clean, selected, path, proj, cat, desc, status, val, dt, curr_id, table_data):
     ctx = callback_context
     trig = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else "url"
-    reload_data = lambda: get_despesas_realizadas().to_dict('records')
-    if trig == "url" or trig == "btn-clean-desp-crud": return "", "", "", "", "Pago", "", "", None, True, reload_data(), []
+    if trig == "url" or trig == "btn-clean-desp-crud": return "", "", "", "", "Pago", "", "", None, True, [], dash.no_update
     if trig == "tabela-despesas-crud" and selected:
         row = table_data[selected[0]]
         return "", row['projeto_id'], row['categoria'], row['descricao'], row['status'], row['valor'], row['data_pagamento'], row['id'], False, dash.no_update, dash.no_update
     if trig == "btn-del-desp-crud" and curr_id:
-        with engine.connect() as conn: conn.execute(text("DELETE FROM despesas WHERE id = :id"), {"id": curr_id}); conn.commit()
-        return dbc.Alert("Excluído!", color="warning"), "", "", "", "Pago", "", "", None, True, reload_data(), []
+        with engine.connect() as conn:
+            antigo = conn.execute(text("SELECT projeto_id, data_pagamento FROM despesas WHERE id = :id"), {"id": curr_id}).first()
+            conn.execute(text("DELETE FROM despesas WHERE id = :id"), {"id": curr_id})
+            if antigo: atualizar_fluxo_mensal(conn, antigo[0], [antigo[1]])
+            registrar_escrita(conn, "despesas")
+            conn.commit()
+        return dbc.Alert("Excluído!", color="warning"), "", "", "", "Pago", "", "", None, True, [], {"acao": "excluir", "id": curr_id}
     if trig == "btn-save-desp-crud":
         if not all([proj, cat, val, dt]): return dbc.Alert("Preencha!", color="warning"), dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, curr_id, (curr_id is None), dash.no_update, dash.no_update
         with engine.connect() as conn:
+            antigo = conn.execute(text("SELECT projeto_id, data_pagamento FROM despesas WHERE id = :id"), {"id": curr_id}).first() if curr_id else None
             if curr_id: conn.execute(text("UPDATE despesas SET projeto_id=:p, categoria=:c, descricao=:d, valor=:v, data_pagamento=:dt, status=:s WHERE id=:id"), {"p": proj, "c": cat, "d": desc or "", "v": val, "dt": dt, "s": status, "id": curr_id})
-            else: conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:p, :c, :d, :v, :dt, :s)"), {"p": proj, "c": cat, "d": desc or "", "v": val, "dt": dt, "s": status})
+            else: curr_id = conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:p, :c, :d, :v, :dt, :s) RETURNING id"), {"p": proj, "c": cat, "d": desc or "", "v": val, "dt": dt, "s": status}).scalar()
+            if antigo: atualizar_fluxo_mensal(conn, antigo[0], [antigo[1]])
+            atualizar_fluxo_mensal(conn, proj, [dt])
+            registrar_escrita(conn, "despesas")
             conn.commit()
-        return dbc.Alert("Salvo!", color="success"), "", "", "", "Pago", "", "", None, True, reload_data(), []
+        return dbc.Alert("Salvo!", color="success"), "", "", "", "Pago", "", "", None, True, [], {"acao": "salvar", "id": curr_id}
     return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, True, dash.no_update, dash.no_update
 
-@app.callback([Output("msg-perm-crud", "children"), Output("input-perm-projeto", "value"), Output("input-perm-desc", "value"), Output("input-perm-valor", "value"), Output("input-perm-data", "value"), Output("stored-permuta-id", "data"), Output("btn-del-perm-crud", "disabled"), Output("tabela-permutas-crud", "data"), Output("tabela-permutas-crud", "selected_rows")], [Input("btn-save-perm-crud", "n_clicks"), Input("btn-del-perm-crud", "n_clicks"), Input("btn-clean-perm-crud", "n_clicks"), Input("tabela-permutas-crud", "selected_rows"), Input("url", "pathname")], [State("input-perm-projeto", "value"), State("input-perm-desc", "value"), State("input-perm-valor", "value"), State("input-perm-data", "value"), State("stored-permuta-id", "data"), State("tabela-permutas-crud", "data")])
+@app.callback([Output("msg-perm-crud", "children"), Output("input-perm-projeto", "value"), Output("input-perm-desc", "value"), Output("input-perm-valor", "value"), Output("input-perm-data", "value"), Output("stored-permuta-id", "data"), Output("btn-del-perm-crud", "disabled"), Output("tabela-permutas-crud", "selected_rows"), Output("permuta-alterada", "data")], [Input("btn-save-perm-crud", "n_clicks"), Input("btn-del-perm-crud", "n_clicks"), Input("btn-clean-perm-crud", "n_clicks"), Input("tabela-permutas-crud", "selected_rows"), Input("url", "pathname")], [State("input-perm-projeto", "value"), State("input-perm-desc", "value"), State("input-perm-valor", "value"), State("input-perm-data", "value"), State("stored-permuta-id", "data"), State("tabela-permutas-crud", "data")])
 def manage_permutas_crud(n_save, n_del, n_clean, selected, path, proj, desc, val, dt, curr_id, table_data):
     ctx = callback_context
     trig = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else "url"
-    reload_data = lambda: get_permutas().to_dict('records')
-    if trig == "url" or trig == "btn-clean-perm-crud": return "", "", "", "", "", None, True, reload_data(), []
+    if trig == "url" or trig == "btn-clean-perm-crud": return "", "", "", "", "", None, True, [], dash.no_update
     if trig == "tabela-permutas-crud" and selected:
         row = table_data[selected[0]]
         return "", row['projeto_id'], row['descricao'], row['valor'], row['data_permuta'], row['id'], False, dash.no_update, dash.no_update
     if trig == "btn-del-perm-crud" and curr_id:
-        with engine.connect() as conn: conn.execute(text("DELETE FROM permutas WHERE id = :id"), {"id": curr_id}); conn.commit()
-        return dbc.Alert("Excluído!", color="warning"), "", "", "", "", None, True, reload_data(), []
+        with engine.connect() as conn:
+            antigo = conn.execute(text("SELECT projeto_id, data_permuta FROM permutas WHERE id = :id"), {"id": curr_id}).first()
+            conn.execute(text("DELETE FROM permutas WHERE id = :id"), {"id": curr_id})
+            if antigo: atualizar_fluxo_mensal(conn, antigo[0], [antigo[1]])
+            registrar_escrita(conn, "permutas")
+            conn.commit()
+        return dbc.Alert("Excluído!", color="warning"), "", "", "", "", None, True, [], {"acao": "excluir", "id": curr_id}
     if trig == "btn-save-perm-crud":
         if not all([proj, val, dt]): return dbc.Alert("Preencha!", color="warning"), dash.no_update, dash.no_update, dash.no_update, dash.no_update, curr_id, (curr_id is None), dash.no_update, dash.no_update
         with engine.connect() as conn:
+            antigo = conn.execute(text("SELECT projeto_id, data_permuta FROM permutas WHERE id = :id"), {"id": curr_id}).first() if curr_id else None
             if curr_id: conn.execute(text("UPDATE permutas SET projeto_id=:p, descricao=:d, valor=:v, data_permuta=:dt WHERE id=:id"), {"p": proj, "d": desc or "", "v": val, "dt": dt, "id": curr_id})
-            else: conn.execute(text("INSERT INTO permutas (projeto_id, descricao, valor, data_permuta) VALUES (:p, :d, :v, :dt)"), {"p": proj, "d": desc or "", "v": val, "dt": dt})
+            else: curr_id = conn.execute(text("INSERT INTO permutas (projeto_id, descricao, valor, data_permuta) VALUES (:p, :d, :v, :dt) RETURNING id"), {"p": proj, "d": desc or "", "v": val, "dt": dt}).scalar()
+            if antigo: atualizar_fluxo_mensal(conn, antigo[0], [antigo[1]])
+            atualizar_fluxo_mensal(conn, proj, [dt])
+            registrar_escrita(conn, "permutas")
             conn.commit()
-        return dbc.Alert("Salvo!", color="success"), "", "", "", "", None, True, reload_data(), []
+        return dbc.Alert("Salvo!", color="success"), "", "", "", "", None, True, [], {"acao": "salvar", "id": curr_id}
     return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, True, dash.no_update, dash.no_update
 
+@app.callback([Output("msg-import-despesas", "children"), Output("despesa-alterada", "data", allow_duplicate=True)], Input("upload-despesas", "contents"), State("upload-despesas", "filename"), prevent_initial_call=True)
+def importar_planilha_despesas(conteudo, nome_arquivo):
+    if not conteudo: return dash.no_update, dash.no_update
+    try: rel = importar_despesas(base64.b64decode(conteudo.split(",", 1)[1]), nome_arquivo or "")
+    except ValueError as e: return dbc.Alert(str(e), color="danger"), dash.no_update
+    except Exception as e: return dbc.Alert(f"Erro ao importar: {e}", color="danger"), dash.no_update
+    resumo = f"{rel['importadas']} de {rel['linhas']} linhas importadas em {rel['segundos']:.2f}s ({rel['linhas_por_segundo']:,.0f} linhas/s).".replace(",", ".")
+    cor = "success" if not rel['erros'] else ("warning" if rel['importadas'] else "danger")
+    filhos = [html.B(resumo)]
+    if rel['erros']:
+        filhos += [html.Div(f"{len(rel['erros'])} linha(s) com erro não foram importadas" + (f" (mostrando as {IMPORT_MAX_ERROS_EXIBIDOS} primeiras)" if len(rel['erros']) > IMPORT_MAX_ERROS_EXIBIDOS else "") + ":", className="mt-2"),
+                   dash_table.DataTable(data=rel['erros'][:IMPORT_MAX_ERROS_EXIBIDOS], columns=[{'name': 'Linha', 'id': 'linha'}, {'name': 'Erro', 'id': 'erro'}], page_size=10, style_cell={'textAlign': 'left', 'fontSize': '12px'}, style_table={'overflowX': 'auto'})]
+    return dbc.Alert(filhos, color=cor), ({"acao": "importar", "id": None} if rel['importadas'] else dash.no_update)
+
+# --- TABELAS PAGINADAS NO SERVIDOR ---
+def _carregar_pagina(tabela, page_current, page_size, sort_by, filter_query, alteracao, estado):
+    # O estado guarda, para a ordenação/filtro atuais, a última chave de cada página já visitada e os ids da página na tela
+    assinatura = repr((sort_by, filter_query, page_size))
+    if not estado or estado.get('assinatura') != assinatura: estado = {'assinatura': assinatura, 'cursores': {}, 'ids': []}
+    trig = callback_context.triggered_id
+    # Importação em lote: recarrega a partir da primeira página
+    if trig in ("despesa-alterada", "permuta-alterada") and alteracao and alteracao['acao'] == 'importar': trig = "url"
+    # Salvar/excluir: Patch só da linha tocada (a página, a ordenação e os cursores continuam valendo)
+    if trig in ("despesa-alterada", "permuta-alterada"):
+        if not alteracao: return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        dados, ids, rid = dash.Patch(), list(estado.get('ids', [])), alteracao['id']
+        registro = get_registro(tabela, rid) if alteracao['acao'] == 'salvar' else None
+        if rid in ids:
+            i = ids.index(rid)
+            if registro: dados[i] = registro
+            else: del dados[i]; ids.pop(i)
+        elif registro: dados.prepend(registro); ids.insert(0, rid)  # novo: aparece no topo da página atual
+        else: return dash.no_update, dash.no_update, dash.no_update, dash.no_update
+        return dados, dash.no_update, dash.no_update, {**estado, 'ids': ids}
+    if trig == "url": page_current, estado['cursores'] = 0, {}
+    page_current = page_current or 0
+    cursor = estado['cursores'].get(str(page_current - 1)) if page_current > 0 else None
+    registros, total, ultimo = get_pagina(tabela, page_current, page_size, sort_by, filter_query, cursor)
+    if ultimo: estado['cursores'][str(page_current)] = ultimo
+    estado['ids'] = [r['id'] for r in registros]
+    return registros, max(1, -(-total // page_size)), page_current, estado
+
+@app.callback([Output("tabela-despesas-crud", "data"), Output("tabela-despesas-crud", "page_count"), Output("tabela-despesas-crud", "page_current"), Output("cursor-despesas", "data")], [Input("tabela-despesas-crud", "page_current"), Input("tabela-despesas-crud", "page_size"), Input("tabela-despesas-crud", "sort_by"), Input("tabela-despesas-crud", "filter_query"), Input("despesa-alterada", "data"), Input("url", "pathname")], State("cursor-despesas", "data"))
+def carregar_pagina_despesas(page_current, page_size, sort_by, filter_query, alteracao, path, estado):
+    return _carregar_pagina('despesas', page_current, page_size, sort_by, filter_query, alteracao, estado)
+
+@app.callback([Output("tabela-permutas-crud", "data"), Output("tabela-permutas-crud", "page_count"), Output("tabela-permutas-crud", "page_current"), Output("cursor-permutas", "data")], [Input("tabela-permutas-crud", "page_current"), Input("tabela-permutas-crud", "page_size"), Input("tabela-permutas-crud", "sort_by"), Input("tabela-permutas-crud", "filter_query"), Input("permuta-alterada", "data"), Input("url", "pathname")], State("cursor-permutas", "data"))
+def carregar_pagina_permutas(page_current, page_size, sort_by, filter_query, alteracao, path, estado):
+    return _carregar_pagina('permutas', page_current, page_size, sort_by, filter_query, alteracao, estado)
+
 # --- CALLBACK DE RISCO (CORRIGIDO COM PATTERN MATCHING) ---
+# Fechar é só no navegador; abrir consulta as etapas em atraso no servidor
+app.clientside_callback(ClientsideFunction("ui", "fechar_modal"), Output("modal-risk", "is_open", allow_duplicate=True), Input("btn-close-risk", "n_clicks"), prevent_initial_call=True)
+
 @app.callback(
     [Output("modal-risk", "is_open"), Output("body-modal-risk", "children")],
-    [Input({'type': 'btn-open-risk', 'index': ALL}, "n_clicks"), Input("btn-close-risk", "n_clicks")],
+    [Input({'type': 'btn-open-risk', 'index': ALL}, "n_clicks")],
     [State("modal-risk", "is_open")]
 )
-def toggle_risk_modal(n_open_list, n_close, is_open):
-    ctx = callback_context
-    if not ctx.triggered: return is_open, dash.no_update
-    
-    trig_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    
-    if trig_id == "btn-close-risk": return False, dash.no_update
-    
+def toggle_risk_modal(n_open_list, is_open):
     # Se clicou no botão de abrir (que pode ser dinâmico)
     if n_open_list and any(n_open_list):
         df = get_detalhes_atraso()
@@ -779,4 +2132,17 @@ def toggle_risk_modal(n_open_list, n_close, is_open):
     return is_open, dash.no_update
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # python app.py migrar -> aplica as migrações pendentes do esquema
+    # python app.py reconstruir-fluxo -> recalcula fluxo_mensal do zero
+    # python app.py reconstruir-curva -> recalcula curva_fisica do zero
+    # python app.py compactar-historico [dias] -> enxuga historico_fisico (padrão: HISTORICO_RETENCAO_DIAS)
+    if sys.argv[1:2] == ["migrar"]: migrar()
+    elif sys.argv[1:2] == ["reconstruir-fluxo"]: print(f"fluxo_mensal reconstruído: {reconstruir_fluxo_mensal()} linhas")
+    elif sys.argv[1:2] == ["reconstruir-curva"]: print(f"curva_fisica reconstruída: {reconstruir_curva_fisica()} linhas")
+    elif sys.argv[1:2] == ["compactar-historico"]:
+        r = compactar_historico(dias=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(f"historico_fisico: {r['linhas_antes']} -> {r['linhas_depois']} linhas ({r['linhas_antes'] - r['linhas_depois']} recuperadas: "
+              f"{r['orfas']} órfãs, {r['semanais']} consolidadas por semana, {r['sem_mudanca']} sem mudança de percentual)")
+    else:
+        migrar()  # servidor de desenvolvimento: garante o esquema local antes de subir
+        app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,50 @@
+/* --- assets/clientside.js --- */
+/* Callbacks que só movem valores entre componentes que já estão no navegador: rodam aqui, sem ida ao servidor. */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ui: {
+        /* Id do componente que disparou o callback ("" na chamada inicial) */
+        _gatilho: function () {
+            const t = dash_clientside.callback_context.triggered;
+            return ((t && t.length && t[0].prop_id) || "").split(".")[0];
+        },
+
+        /* Modais "Nova Despesa" / "Gerenciar Permutas": abrir/fechar alterna; fecha sozinho quando o salvar devolve Alert de sucesso */
+        alternar_modal: function (n_abrir, n_fechar, msg, is_open) {
+            const trig = dash_clientside.ui._gatilho();
+            if (trig.startsWith("msg-")) return (msg && msg.props && msg.props.color === "success") ? false : dash_clientside.no_update;
+            return trig ? !is_open : is_open;
+        },
+
+        confirmar_exclusao: function (n) { return true; },
+
+        fechar_modal: function (n) { return false; },
+
+        /* Formulário de etapas: limpar, linha da tabela e clique no Gantt preenchem os campos no próprio navegador.
+           Saídas: msg, valor, percentual, início, fim, etapa, id da etapa, excluir desabilitado, linhas selecionadas, obra */
+        preencher_form_etapa: function (n_limpar, selecionadas, clique, dados_tabela) {
+            const nu = dash_clientside.no_update;
+            const trig = dash_clientside.ui._gatilho();
+            if (trig === "grafico-gantt" && clique && clique.points && clique.points.length) {
+                const c = clique.points[0].customdata;
+                // Visão geral: clique na barra da obra abre o cronograma dela
+                if (c && c[0] === "obra") return ["", "", "", "", "", null, null, true, [], c[1]];
+                if (c) return ["", c[1], c[2], c[3], c[4], c[5], c[0], false, nu, c[6]];
+            }
+            if (trig === "tabela-etapas-crud" && selecionadas && selecionadas.length && dados_tabela && selecionadas[0] < dados_tabela.length) {
+                const r = dados_tabela[selecionadas[0]];
+                return ["", r.valor_estimado, r.percentual, r.data_inicio, r.data_fim, r.etapa, r.id_etapa, false, nu, r.projeto_id];
+            }
+            if (trig === "btn-limpar-form") return ["", "", "", "", "", null, null, true, [], null];
+            return Array(10).fill(nu);
+        },
+
+        /* Gantt em tela cheia: reaproveita a figura já renderizada, só libera a altura */
+        gantt_tela_cheia: function (n_abrir, n_fechar, is_open, figura) {
+            const trig = dash_clientside.ui._gatilho();
+            if (trig === "btn-gantt-fullscreen" && figura) return [true, {...figura, layout: {...figura.layout, height: null, autosize: true}}];
+            if (trig === "btn-close-fullscreen") return [false, dash_clientside.no_update];
+            return [is_open, dash_clientside.no_update];
+        }
+    }
+});
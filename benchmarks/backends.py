@@ -0,0 +1,90 @@
+"""Backend de agregação: confere o caminho Polars contra o pandas e compara os tempos.
+
+Sem --banco, gera totais por obra e fluxo mensal sintéticos (resumo financeiro, orçado x realizado, projeção):
+    python benchmarks/backends.py --obras 5000 --meses 120
+Com --banco, roda as quatro agregações (inclui o Pareto) sobre o banco de DATABASE_URL, geral e por obra:
+    DATABASE_URL=postgresql://... python benchmarks/backends.py --banco
+Sai com código 1 se algum resultado divergir.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import pandas as pd
+import app
+
+def gerar(obras, meses, semente=42):
+    rnd = random.Random(semente)
+    nomes = [f"Obra {i:05d}" for i in range(obras)]
+    totais = pd.DataFrame({
+        'id': range(1, obras + 1), 'nome': nomes,
+        'empresa': pd.Categorical([rnd.choice(["Própria", "Consórcio"]) for _ in range(obras)]),
+        'vl_contrato': [rnd.choice([0.0, rnd.uniform(1e5, 5e7)]) for _ in range(obras)],
+        'vl_fisico': [rnd.uniform(0, 1e7) for _ in range(obras)],
+        'vl_atraso': [rnd.uniform(0, 1e6) for _ in range(obras)],
+        'vl_pago': [rnd.choice([0.0, rnd.uniform(0, 2e7)]) for _ in range(obras)],
+        'vl_permuta': [rnd.choice([0.0, 0.0, rnd.uniform(0, 1e6)]) for _ in range(obras)],
+    })
+    fluxo = pd.DataFrame([
+        {'projeto_id': i + 1, 'projeto': nomes[i], 'mes': pd.Timestamp(2022, 1, 1) + pd.DateOffset(months=m),
+         'orcado': rnd.choice([0.0, rnd.uniform(0, 1e6)]), 'realizado': rnd.choice([0.0, rnd.uniform(0, 1e6)]),
+         'projetado': rnd.choice([0.0, rnd.uniform(0, 1e6)])}
+        for i in range(obras) for m in range(meses)
+    ])
+    return totais, fluxo
+
+def rodar(backend, func, repeticoes):
+    app.BACKEND_AGREGACAO = backend
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter(); resultado = func(); tempos.append(time.perf_counter() - t)
+    return resultado, min(tempos) * 1000
+
+def conferir(nome, func, repeticoes):
+    df_pd, t_pd = rodar("pandas", func, repeticoes)
+    df_pl, t_pl = rodar("polars", func, repeticoes)
+    try:
+        pd.testing.assert_frame_equal(df_pd.reset_index(drop=True), df_pl.reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False, check_exact=False, rtol=1e-9)
+        status = "ok"
+    except AssertionError as e:
+        status = f"DIVERGE: {str(e).splitlines()[0]}"
+    print(f"{nome:32s} {len(df_pd):>9d} {t_pd:10.1f} {t_pl:10.1f} {t_pd / t_pl if t_pl else 0:7.1f}x  {status}")
+    return status == "ok"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--obras", type=int, default=2000)
+    parser.add_argument("--meses", type=int, default=60)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--banco", action="store_true")
+    args = parser.parse_args()
+
+    casos = []
+    if args.banco:
+        obras = app.get_projetos()
+        filtros = [None] + (obras['id'].head(3).tolist() if not obras.empty else [])
+        for fid in filtros:
+            casos += [(f"resumo financeiro ({fid or 'geral'})", lambda fid=fid: app.get_tabela_resumo_financeiro(fid)),
+                      (f"pareto ({fid or 'geral'})", lambda fid=fid: app.get_dados_pareto_resumo(fid))]
+        casos += [("orçado x realizado", app.calcular_orcado_vs_realizado), ("projeção futura", app.calcular_projecao_futura)]
+    else:
+        totais, fluxo = gerar(args.obras, args.meses)
+        app.get_totais_projetos = lambda filtro_id=None: totais.copy()
+        app.get_fluxo_mensal = lambda: fluxo
+        print(f"{args.obras} obras, {len(fluxo)} linhas de fluxo mensal")
+        casos += [("resumo financeiro", app.get_tabela_resumo_financeiro),
+                  ("orçado x realizado", app.calcular_orcado_vs_realizado), ("projeção futura", app.calcular_projecao_futura)]
+
+    print(f"{'':32s} {'linhas':>9s} {'pandas ms':>10s} {'polars ms':>10s} {'ganho':>8s}")
+    resultados = [conferir(nome, func, args.repeticoes) for nome, func in casos]
+    sys.exit(0 if all(resultados) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Vazão da importação em lote de despesas (linhas/s) x lançamento uma a uma, como no CRUD.
+
+Rode sobre um banco populado por benchmarks/semear.py (mesmo DATABASE_URL):
+    python benchmarks/importacao.py --linhas 50000 --formato csv
+    python benchmarks/importacao.py --linhas 10000 --formato xlsx --invalidas 0.05
+As despesas geradas (descrição "bench-import ...") são apagadas no fim e o fluxo_mensal é refeito.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from sqlalchemy import text
+import app
+
+MARCA = "bench-import"
+
+def gerar_linhas(n, obras, invalidas, semente=42):
+    rnd = random.Random(semente)
+    inicio = date.today() - timedelta(days=365)
+    for i in range(n):
+        linha = [rnd.choice(obras), rnd.choice(app.CATEGORIAS_DESPESA), f"{MARCA} {i}", f"{rnd.uniform(10, 50000):.2f}".replace(".", ","),
+                 (inicio + timedelta(days=rnd.randrange(365))).strftime("%d/%m/%Y"), rnd.choice(["Pago", "Pago", "Pendente"])]
+        if rnd.random() < invalidas: linha[rnd.choice([1, 3, 4])] = "???"
+        yield linha
+
+def montar_arquivo(linhas, formato):
+    cabecalho = ["projeto_id", "categoria", "descricao", "valor", "data_pagamento", "status"]
+    if formato == "csv":
+        return ("\n".join(";".join(map(str, l)) for l in [cabecalho] + linhas) + "\n").encode("utf-8")
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(cabecalho)
+    for l in linhas: ws.append(l)
+    buffer = io.BytesIO(); wb.save(buffer)
+    return buffer.getvalue()
+
+def uma_a_uma(linhas):
+    # O caminho do formulário: uma conexão, um INSERT, a atualização do fluxo e um commit por despesa
+    for pid, cat, desc, valor, data, status in linhas:
+        dt = date(int(data[6:]), int(data[3:5]), int(data[:2]))
+        with app.engine.connect() as conn:
+            conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:p, :c, :d, :v, :dt, :s)"),
+                         {"p": pid, "c": cat, "d": desc, "v": float(valor.replace(",", ".")), "dt": dt, "s": status})
+            app.atualizar_fluxo_mensal(conn, pid, [dt])
+            app.registrar_escrita(conn, "despesas")
+            conn.commit()
+
+def limpar():
+    with app.engine.connect() as conn:
+        n = conn.execute(text("DELETE FROM despesas WHERE descricao LIKE :m"), {"m": f"{MARCA} %"}).rowcount
+        app.reconstruir_fluxo_mensal(conn)
+        app.registrar_escrita(conn, "despesas")
+        conn.commit()
+    return n
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, default=20_000)
+    parser.add_argument("--formato", choices=["csv", "xlsx"], default="csv")
+    parser.add_argument("--invalidas", type=float, default=0.01, help="fração de linhas com erro proposital")
+    parser.add_argument("--amostra-individual", type=int, default=200, help="linhas lançadas uma a uma para comparação")
+    args = parser.parse_args()
+
+    with app.engine.connect() as conn: obras = conn.execute(text("SELECT id FROM projetos")).scalars().all()
+    if not obras: sys.exit("Banco vazio: rode benchmarks/semear.py antes (com o mesmo DATABASE_URL).")
+    linhas = list(gerar_linhas(args.linhas, obras, args.invalidas))
+    conteudo = montar_arquivo(linhas, args.formato)
+    print(f"{app.engine.dialect.name}, {len(obras)} obras, arquivo {args.formato} com {args.linhas} linhas ({len(conteudo) / 1024 ** 2:.1f} MB)")
+
+    try:
+        rel = app.importar_despesas(conteudo, f"bench.{args.formato}")
+        print(f"{'lote':14s} {rel['importadas']:>7d} importadas {len(rel['erros']):>6d} erros {rel['segundos']:8.2f} s {rel['linhas_por_segundo']:10.0f} linhas/s")
+        amostra = [l for l in linhas if "???" not in l][:args.amostra_individual]
+        t = time.perf_counter(); uma_a_uma(amostra); s = time.perf_counter() - t
+        print(f"{'uma a uma':14s} {len(amostra):>7d} importadas {0:>6d} erros {s:8.2f} s {len(amostra) / s:10.0f} linhas/s")
+        print(f"ganho: {rel['linhas_por_segundo'] / (len(amostra) / s):.0f}x")
+    finally:
+        print(f"{limpar()} despesas de teste removidas")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Tabela resumo financeiro: caminho antigo (tabelas inteiras no pandas, merge por nome, perc_pago com apply)
+x atual (totais por projeto_id somados no banco + perc_pago vetorizado).
+
+Cria um banco SQLite temporário com obras, etapas, despesas e permutas sintéticas:
+    python benchmarks/resumo_financeiro.py --obras 1000 --despesas 1000000
+Parte das obras recebe nomes repetidos: o caminho antigo soma as despesas das homônimas juntas, o atual não.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+BANCO = os.path.join(tempfile.mkdtemp(prefix="resumo_"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{BANCO}"
+
+import pandas as pd
+import app
+
+CATEGORIAS = ["Diesel", "Emulsão", "Pedra 01", "MÃO DE OBRA", "Outros", "IPITHERM", "Mat/ Água"]
+
+def popular(obras, despesas, homonimas, semente=42):
+    rnd = random.Random(semente)
+    inicio = date(2023, 1, 1)
+    dia = lambda: (inicio + timedelta(days=rnd.randrange(900))).isoformat()
+    conn = sqlite3.connect(BANCO)
+    conn.executemany("INSERT INTO projetos (id, nome, empresa) VALUES (?, ?, ?)",
+                     [(i, f"Obra {i % (obras - homonimas) if i > obras - homonimas else i:04d}", rnd.choice(["Própria", "Parceira"])) for i in range(1, obras + 1)])
+    conn.executemany("INSERT INTO cronograma_etapas (projeto_id, etapa, data_inicio, data_fim, valor_estimado, status, percentual) VALUES (?, ?, ?, ?, ?, 'A Fazer', ?)",
+                     [(p, f"ETAPA {e}", dia(), dia(), round(rnd.uniform(1e4, 5e5), 2), rnd.choice([0, 10, 50, 100])) for p in range(1, obras + 1) for e in range(8)])
+    conn.executemany("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (?, ?, 'x', ?, ?, ?)",
+                     ((rnd.randint(1, obras), rnd.choice(CATEGORIAS), round(rnd.uniform(100, 5e4), 2), dia(), rnd.choice(["Pago", "Pago", "Pendente"])) for _ in range(despesas)))
+    conn.executemany("INSERT INTO permutas (projeto_id, descricao, data_permuta, valor) VALUES (?, 'perm', ?, ?)",
+                     [(rnd.randint(1, obras), dia(), round(rnd.uniform(1e3, 5e4), 2)) for _ in range(obras * 3)])
+    conn.commit(); conn.close()
+
+def resumo_antigo():
+    # Como era: tabelas inteiras no pandas, pago/permuta agrupados pelo nome da obra e juntados por nome
+    with app.engine.connect() as conn:
+        df_crono = pd.read_sql_query("SELECT c.projeto_id, p.nome as projeto, c.valor_estimado FROM cronograma_etapas c JOIN projetos p ON c.projeto_id = p.id", conn)
+        df_desp = pd.read_sql_query("SELECT p.nome as projeto, d.valor FROM despesas d JOIN projetos p ON d.projeto_id = p.id", conn)
+        df_perm = pd.read_sql_query("SELECT p.nome as projeto, m.valor FROM permutas m JOIN projetos p ON m.projeto_id = p.id", conn)
+        df_proj = pd.read_sql_query("SELECT id, nome, empresa FROM projetos ORDER BY id DESC", conn)
+    df_orcado = df_crono.groupby(['projeto', 'projeto_id'])['valor_estimado'].sum().reset_index().rename(columns={'valor_estimado': 'vl_contrato'})
+    df_pago = df_desp.groupby('projeto')['valor'].sum().reset_index().rename(columns={'valor': 'vl_pago'})
+    df_perm_g = df_perm.groupby('projeto')['valor'].sum().reset_index().rename(columns={'valor': 'vl_permuta'})
+    df_final = pd.merge(df_proj, df_orcado, left_on='id', right_on='projeto_id', how='left')
+    df_final = pd.merge(df_final, df_pago, left_on='nome', right_on='projeto', how='left')
+    df_final = pd.merge(df_final, df_perm_g, left_on='nome', right_on='projeto', how='left')
+    for c in ['vl_contrato', 'vl_pago', 'vl_permuta']: df_final[c] = df_final[c].fillna(0).astype(float)
+    df_final['saldo'] = df_final['vl_contrato'] - df_final['vl_pago'] - df_final['vl_permuta']
+    df_final['perc_pago'] = df_final.apply(lambda x: ((x['vl_pago'] + x['vl_permuta']) / x['vl_contrato'] * 100) if x['vl_contrato'] > 0 else 0, axis=1)
+    return df_final[(df_final['vl_contrato'] > 0) | (df_final['vl_pago'] > 0) | (df_final['vl_permuta'] > 0)]
+
+def cronometrar(func, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter(); resultado = func(); tempos.append(time.perf_counter() - t)
+    return resultado, min(tempos) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--obras", type=int, default=1000)
+    parser.add_argument("--despesas", type=int, default=1_000_000)
+    parser.add_argument("--homonimas", type=int, default=10)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    app.migrar()
+    t = time.perf_counter()
+    popular(args.obras, args.despesas, args.homonimas)
+    print(f"{args.obras} obras, {args.despesas} despesas ({args.homonimas} obras homônimas) geradas em {time.perf_counter() - t:.1f} s")
+
+    antigo, t_antigo = cronometrar(resumo_antigo, args.repeticoes)
+    atual, t_atual = cronometrar(app.get_tabela_resumo_financeiro, args.repeticoes)
+    _, t_apply = cronometrar(lambda: antigo.apply(lambda x: ((x['vl_pago'] + x['vl_permuta']) / x['vl_contrato'] * 100) if x['vl_contrato'] > 0 else 0, axis=1), args.repeticoes)
+    _, t_vetor = cronometrar(lambda: ((atual['vl_pago'] + atual['vl_permuta']) / atual['vl_contrato'].where(atual['vl_contrato'] > 0) * 100).fillna(0.0), args.repeticoes)
+    print(f"{'':24s} {'antigo':>10s} {'atual':>10s} {'ganho':>8s}")
+    print(f"{'resumo completo (ms)':24s} {t_antigo:10.1f} {t_atual:10.1f} {t_antigo / t_atual:7.1f}x")
+    print(f"{'só perc_pago (ms)':24s} {t_apply:10.1f} {t_vetor:10.1f} {t_apply / t_vetor:7.1f}x")
+
+    # Conferência por id: obras de nome único batem; homônimas divergem no caminho antigo
+    cols = ['vl_contrato', 'vl_pago', 'vl_permuta', 'saldo', 'perc_pago']
+    a, b = antigo.set_index('id')[cols].sort_index(), atual.set_index('id')[cols].sort_index()
+    unicos = atual.loc[~atual['nome'].duplicated(keep=False), 'id'].sort_values()
+    pd.testing.assert_frame_equal(a.loc[unicos], b.loc[unicos], check_exact=False, rtol=1e-9)
+    print(f"obras de nome único: {len(unicos)} iguais; homônimas com pago divergente no antigo: {int((a['vl_pago'] - b['vl_pago']).abs().gt(0.01).sum())}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Popula o banco com obras sintéticas (Faker pt_BR) para medir o app em escala.
+
+Usa o mesmo banco do app: DATABASE_URL (Postgres local) ou, sem ela, o SQLite de fallback (local_test.db).
+    python benchmarks/semear.py --obras 100
+    python benchmarks/semear.py --obras 1000 --limpar --despesas-por-obra 500
+Aplica as migrações antes e, no fim, refaz fluxo_mensal e curva_fisica e incrementa versao_dados.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from faker import Faker
+from sqlalchemy import text
+import app
+
+ETAPAS = ["MOBILIZAÇÃO", "TERRAPLENAGEM", "DRENAGEM", "SUB-BASE", "BASE", "IMPRIMAÇÃO", "CBUQ", "MEIO-FIO",
+          "CALÇADAS", "SINALIZAÇÃO", "PAISAGISMO", "DESMOBILIZAÇÃO"]
+TABELAS = ["historico_fisico", "curva_fisica", "fluxo_mensal", "despesas", "permutas", "cronograma_etapas", "projetos"]
+
+def limpar(conn):
+    for t in TABELAS: conn.execute(text(f"DELETE FROM {t}"))
+
+def semear(conn, obras, etapas_por_obra, despesas_por_obra, permutas_por_obra, semente):
+    fake = Faker("pt_BR"); fake.seed_instance(semente)
+    rnd = random.Random(semente)
+    hoje = date.today()
+    contagem = dict.fromkeys(["projetos", "cronograma_etapas", "despesas", "permutas", "historico_fisico"], 0)
+
+    for _ in range(obras):
+        nome = f"Pavimentação {fake.street_name()} - {fake.city()}"
+        pid = conn.execute(text("INSERT INTO projetos (nome, empresa) VALUES (:n, :e) RETURNING id"),
+                           {"n": nome, "e": rnd.choice(["Própria", "Própria", "Consórcio", "Parceira"])}).scalar()
+        contagem["projetos"] += 1
+        inicio_obra = hoje - timedelta(days=rnd.randrange(30, 720))
+
+        # Etapas em sequência com sobreposição; as já vencidas tendem a estar concluídas
+        etapas, cursor = [], inicio_obra
+        for nome_etapa in rnd.sample(ETAPAS, min(etapas_por_obra, len(ETAPAS))) + [f"ETAPA {i}" for i in range(max(0, etapas_por_obra - len(ETAPAS)))]:
+            ini = cursor + timedelta(days=rnd.randrange(0, 20))
+            fim = ini + timedelta(days=rnd.randrange(10, 120))
+            cursor = ini + (fim - ini) // 2
+            perc = 100 if fim < hoje and rnd.random() < 0.8 else (0 if ini > hoje else rnd.choice([0, 10, 25, 50, 75, 90]))
+            etapas.append({"pid": pid, "e": nome_etapa, "i": ini, "f": fim, "v": round(rnd.uniform(2e4, 8e5), 2), "p": perc,
+                           "s": "Concluído" if perc == 100 else ("Em Andamento" if perc else "A Fazer")})
+        for et in etapas:
+            eid = conn.execute(text("INSERT INTO cronograma_etapas (projeto_id, etapa, data_inicio, data_fim, valor_estimado, status, percentual) "
+                                    "VALUES (:pid, :e, :i, :f, :v, :s, :p) RETURNING id"), et).scalar()
+            # Histórico: avanços crescentes em dias distintos (um registro por etapa e dia) até o percentual atual
+            if et["p"]:
+                passos = sorted(rnd.sample(range(5, 100, 5), k=min(rnd.randint(1, 5), 19)))
+                passos = [x for x in passos if x < et["p"]] + [et["p"]]
+                ultimo = min(hoje, et["f"])
+                dias = sorted(rnd.sample(range(max(1, (ultimo - et["i"]).days + 1)), k=min(len(passos), max(1, (ultimo - et["i"]).days + 1))))
+                registros = [{"eid": eid, "d": et["i"] + timedelta(days=d), "p": p} for d, p in zip(dias, passos[-len(dias):])]
+                conn.execute(text("INSERT INTO historico_fisico (etapa_id, data_registro, percentual_novo) VALUES (:eid, :d, :p)"), registros)
+                contagem["historico_fisico"] += len(registros)
+        contagem["cronograma_etapas"] += len(etapas)
+
+        dias_obra = max(1, (hoje - inicio_obra).days)
+        despesas = [{"pid": pid, "c": rnd.choice(app.CATEGORIAS_DESPESA), "d": fake.sentence(nb_words=4)[:255], "v": round(rnd.lognormvariate(8, 1.2), 2),
+                     "dt": inicio_obra + timedelta(days=rnd.randrange(dias_obra)), "s": rnd.choice(["Pago", "Pago", "Pago", "Pendente"])}
+                    for _ in range(despesas_por_obra)]
+        if despesas:
+            conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:pid, :c, :d, :v, :dt, :s)"), despesas)
+        permutas = [{"pid": pid, "d": f"Permuta {fake.company()}"[:255], "v": round(rnd.uniform(5e3, 2e5), 2), "dt": inicio_obra + timedelta(days=rnd.randrange(dias_obra))}
+                    for _ in range(permutas_por_obra)]
+        if permutas:
+            conn.execute(text("INSERT INTO permutas (projeto_id, descricao, valor, data_permuta) VALUES (:pid, :d, :v, :dt)"), permutas)
+        contagem["despesas"] += len(despesas); contagem["permutas"] += len(permutas)
+    return contagem
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--obras", type=int, default=10, help="escala: 10 / 100 / 1000")
+    parser.add_argument("--etapas-por-obra", type=int, default=12)
+    parser.add_argument("--despesas-por-obra", type=int, default=200)
+    parser.add_argument("--permutas-por-obra", type=int, default=3)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--limpar", action="store_true", help="apaga obras, etapas, despesas, permutas e histórico antes")
+    args = parser.parse_args()
+
+    app.migrar()
+    t = time.perf_counter()
+    with app.engine.connect() as conn:
+        if args.limpar: limpar(conn)
+        contagem = semear(conn, args.obras, args.etapas_por_obra, args.despesas_por_obra, args.permutas_por_obra, args.semente)
+        conn.commit()
+    print(", ".join(f"{n} {t}" for t, n in contagem.items()) + f" inseridos em {time.perf_counter() - t:.1f} s")
+
+    t = time.perf_counter()
+    with app.engine.connect() as conn:
+        fluxo, curva = app.reconstruir_fluxo_mensal(conn), app.reconstruir_curva_fisica(conn)
+        app.registrar_escrita(conn, *TABELAS)
+        conn.commit()
+    print(f"fluxo_mensal: {fluxo} linhas, curva_fisica: {curva} linhas ({time.perf_counter() - t:.1f} s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Tempo de boot de um worker: import do app.py e latência da primeira requisição.
+
+Cada rodada é um processo novo (como um worker do gunicorn sem --preload):
+    python benchmarks/startup.py --rodadas 5
+    python benchmarks/startup.py --max-import-ms 1500 --max-primeira-ms 3000   # falha (exit 1) se regredir
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executado no processo filho: mede o import e a primeira carga da página inicial (layout + render_page)
+MEDICAO = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter() - t0
+c = app.server.test_client()
+t1 = time.perf_counter()
+c.get("/"); c.get("/_dash-layout"); c.get("/_dash-dependencies")
+r = c.post("/_dash-update-component", json={
+    "output": "page-content.children", "outputs": {"id": "page-content", "property": "children"},
+    "inputs": [{"id": "url", "property": "pathname", "value": "/"}], "changedPropIds": ["url.pathname"], "state": []})
+t_primeira = time.perf_counter() - t1
+print(json.dumps({"import_ms": t_import * 1000, "primeira_ms": t_primeira * 1000, "status": r.status_code}))
+"""
+
+def medir(rodadas):
+    resultados = []
+    for _ in range(rodadas):
+        saida = subprocess.run([sys.executable, "-c", MEDICAO], cwd=RAIZ, capture_output=True, text=True, check=True)
+        resultados.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rodadas", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float)
+    parser.add_argument("--max-primeira-ms", type=float)
+    args = parser.parse_args()
+
+    resultados = medir(args.rodadas)
+    if any(r["status"] != 200 for r in resultados): sys.exit(f"primeira requisição falhou: {resultados}")
+    mediana_import = statistics.median(r["import_ms"] for r in resultados)
+    mediana_primeira = statistics.median(r["primeira_ms"] for r in resultados)
+    print(f"import do app:        mediana {mediana_import:8.1f} ms  (min {min(r['import_ms'] for r in resultados):.1f})")
+    print(f"primeira requisição:  mediana {mediana_primeira:8.1f} ms  (min {min(r['primeira_ms'] for r in resultados):.1f})")
+
+    falhas = []
+    if args.max_import_ms and mediana_import > args.max_import_ms: falhas.append(f"import {mediana_import:.0f} ms > {args.max_import_ms:.0f} ms")
+    if args.max_primeira_ms and mediana_primeira > args.max_primeira_ms: falhas.append(f"primeira requisição {mediana_primeira:.0f} ms > {args.max_primeira_ms:.0f} ms")
+    if falhas: sys.exit("REGRESSÃO: " + "; ".join(falhas))
+
+if __name__ == "__main__":
+    main()
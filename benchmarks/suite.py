@@ -0,0 +1,147 @@
+"""Latência (p50/p95) e pico de memória das funções de dados e dos callbacks, com baseline para pegar regressões.
+
+Rode sobre um banco populado por benchmarks/semear.py (mesmo DATABASE_URL):
+    python benchmarks/semear.py --obras 100 --limpar
+    python benchmarks/suite.py --salvar              # grava benchmarks/baselines/<banco>-<obras>.json
+    python benchmarks/suite.py                       # compara com o baseline; sai com 1 se algo ficou mais lento
+Por padrão os caches das tabelas base e das figuras são esvaziados antes de cada execução (mede a consulta, não o
+acerto de cache); --cache mede com os caches quentes. Os CRUDs passam pelo endpoint do Dash (serialização incluída) e desfazem o que gravam.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault("CALLBACK_CACHE_DIR", os.path.join(RAIZ, ".cache_callbacks"))
+
+from sqlalchemy import text
+import app
+
+cliente = app.server.test_client()
+
+def disparar(saida, valores, gatilho):
+    # Chama o callback que tem `saida` entre as saídas, como o navegador faria (POST /_dash-update-component)
+    chave = next(k for k in app.app.callback_map if saida in k.strip(".").split("..."))
+    spec = app.app.callback_map[chave]
+    saidas = [dict(zip(("id", "property"), s.rsplit(".", 1))) for s in chave.strip(".").split("...")]
+    corpo = {"output": chave, "outputs": saidas if chave.startswith("..") else saidas[0],
+             "inputs": [{**i, "value": valores.get(f"{i['id']}.{i['property']}")} for i in spec["inputs"]],
+             "state": [{**s, "value": valores.get(f"{s['id']}.{s['property']}")} for s in spec["state"]],
+             "changedPropIds": [gatilho]}
+    r = cliente.post("/_dash-update-component", json=corpo)
+    if r.status_code not in (200, 204): raise RuntimeError(f"{saida}: HTTP {r.status_code}")
+    return r.get_json() if r.status_code == 200 else {}
+
+def _id_gravado(resposta, store):
+    return resposta["response"][store]["data"]["id"]
+
+def cenarios():
+    with app.engine.connect() as conn:
+        obra = conn.execute(text("SELECT projeto_id FROM cronograma_etapas GROUP BY projeto_id ORDER BY COUNT(*) DESC, projeto_id LIMIT 1")).scalar()
+        etapa = conn.execute(text("SELECT id, etapa, data_inicio, data_fim, valor_estimado, percentual FROM cronograma_etapas WHERE projeto_id = :p ORDER BY id LIMIT 1"), {"p": obra}).one()
+    hoje = date.today().isoformat()
+    sem_progresso = lambda *a: None
+
+    def etapa_inserir_excluir():
+        base = {"select-obra.value": obra, "select-etapa.value": "BENCH", "input-valor.value": 1000, "input-percent.value": 10, "input-inicio.value": hoje, "input-fim.value": hoje}
+        eid = _id_gravado(disparar("msg-etapa.children", base, "btn-salvar-etapa.n_clicks"), "etapa-alterada")
+        disparar("msg-etapa.children", {**base, "stored-etapa-id.data": eid}, "btn-excluir-etapa.n_clicks")
+
+    def etapa_avancar():
+        # Atualiza só o percentual (caminho incremental da curva física) e volta ao valor original
+        base = {"select-obra.value": obra, "select-etapa.value": etapa.etapa, "input-valor.value": float(etapa.valor_estimado),
+                "input-inicio.value": str(etapa.data_inicio), "input-fim.value": str(etapa.data_fim), "stored-etapa-id.data": etapa.id}
+        disparar("msg-etapa.children", {**base, "input-percent.value": (etapa.percentual + 7) % 100}, "btn-salvar-etapa.n_clicks")
+        disparar("msg-etapa.children", {**base, "input-percent.value": etapa.percentual}, "btn-salvar-etapa.n_clicks")
+
+    def despesa_inserir_excluir():
+        base = {"input-desp-projeto.value": obra, "input-desp-cat.value": "Outros", "input-desp-desc.value": "bench", "input-desp-status.value": "Pago", "input-desp-valor.value": 123.45, "input-desp-data.value": hoje}
+        did = _id_gravado(disparar("msg-desp-crud.children", base, "btn-save-desp-crud.n_clicks"), "despesa-alterada")
+        disparar("msg-desp-crud.children", {**base, "stored-despesa-id.data": did}, "btn-del-desp-crud.n_clicks")
+
+    def permuta_inserir_excluir():
+        base = {"input-perm-projeto.value": obra, "input-perm-desc.value": "bench", "input-perm-valor.value": 500, "input-perm-data.value": hoje}
+        mid = _id_gravado(disparar("msg-perm-crud.children", base, "btn-save-perm-crud.n_clicks"), "permuta-alterada")
+        disparar("msg-perm-crud.children", {**base, "stored-permuta-id.data": mid}, "btn-del-perm-crud.n_clicks")
+
+    return {
+        "get_kpis_globais": lambda: app.get_kpis_globais(None),
+        "get_kpis_globais (obra)": lambda: app.get_kpis_globais(obra),
+        "calcular_orcado_vs_realizado": app.calcular_orcado_vs_realizado,
+        "gerar_figura_gantt (visão geral)": lambda: app.gerar_figura_gantt(None),
+        "gerar_figura_gantt (obra)": lambda: app.gerar_figura_gantt(obra),
+        "update_resumo_global_content": lambda: app.update_resumo_global_content(sem_progresso, None),
+        "update_resumo_global_content (obra)": lambda: app.update_resumo_global_content(sem_progresso, obra),
+        "crud etapa: inserir + excluir": etapa_inserir_excluir,
+        "crud etapa: avanço + desfazer": etapa_avancar,
+        "crud despesa: inserir + excluir": despesa_inserir_excluir,
+        "crud permuta: inserir + excluir": permuta_inserir_excluir,
+    }
+
+def esvaziar_caches():
+    app._cache_tabelas.clear(); app._cache_figuras.clear()
+
+def medir(func, repeticoes, aquecimento, manter_cache):
+    for _ in range(aquecimento): func()
+    tempos = []
+    for _ in range(repeticoes):
+        if not manter_cache: esvaziar_caches()
+        t = time.perf_counter(); func(); tempos.append((time.perf_counter() - t) * 1000)
+    # Pico de memória numa execução à parte (o tracemalloc deixa o código mais lento)
+    if not manter_cache: esvaziar_caches()
+    tracemalloc.start(); func(); _, pico = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    tempos.sort()
+    return {"min_ms": tempos[0], "p50_ms": statistics.median(tempos), "p95_ms": tempos[min(len(tempos) - 1, round(0.95 * (len(tempos) - 1)))], "pico_mb": pico / 1024 ** 2}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    parser.add_argument("--aquecimento", type=int, default=2)
+    parser.add_argument("--cache", action="store_true", help="mantém os caches das tabelas base e das figuras entre execuções")
+    parser.add_argument("--filtro", default="", help="só os cenários cujo nome contém o texto")
+    parser.add_argument("--baseline", help="arquivo JSON do baseline (padrão: benchmarks/baselines/<banco>-<obras>.json)")
+    parser.add_argument("--salvar", action="store_true", help="grava os resultados como novo baseline")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="melhor tempo acima do baseline x (1 + tolerância) é regressão")
+    parser.add_argument("--folga-ms", type=float, default=5.0, help="diferenças absolutas menores que isto são ruído")
+    args = parser.parse_args()
+
+    try:
+        with app.engine.connect() as conn: obras = conn.execute(text("SELECT COUNT(*) FROM projetos")).scalar()
+    except Exception: obras = 0
+    if not obras: sys.exit("Banco vazio: rode benchmarks/semear.py antes (com o mesmo DATABASE_URL).")
+    arquivo = args.baseline or os.path.join(RAIZ, "benchmarks", "baselines", f"{app.engine.dialect.name}-{obras}{'-cache' if args.cache else ''}.json")
+    baseline = json.load(open(arquivo, encoding="utf-8"))["resultados"] if os.path.exists(arquivo) and not args.salvar else {}
+
+    print(f"{app.engine.dialect.name}, {obras} obras, {args.repeticoes} repetições, cache {'quente' if args.cache else 'frio'}")
+    print(f"{'':38s} {'p50 ms':>9s} {'p95 ms':>9s} {'pico MB':>9s} {'baseline p50':>13s} {'Δ melhor':>9s}")
+    resultados, regressoes = {}, []
+    for nome, func in cenarios().items():
+        if args.filtro not in nome: continue
+        r = resultados[nome] = medir(func, args.repeticoes, args.aquecimento, args.cache)
+        base = baseline.get(nome)
+        marca = ""
+        if base:
+            # A regressão é decidida pelo melhor tempo (menos sujeito a ruído da máquina que o p50)
+            limite = max(base["min_ms"] * (1 + args.tolerancia), base["min_ms"] + args.folga_ms)
+            marca = f"{base['p50_ms']:13.1f} {r['min_ms'] / base['min_ms'] - 1:+9.0%}"
+            if r["min_ms"] > limite: regressoes.append(nome); marca += "  REGRESSÃO"
+        print(f"{nome:38s} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['pico_mb']:9.1f} {marca}")
+
+    if args.salvar:
+        os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+        with open(arquivo, "w", encoding="utf-8") as f:
+            json.dump({"banco": app.engine.dialect.name, "obras": obras, "repeticoes": args.repeticoes, "cache": args.cache,
+                       "gravado_em": date.today().isoformat(), "resultados": resultados}, f, ensure_ascii=False, indent=2)
+        print(f"baseline gravado em {arquivo}")
+    if regressoes:
+        print(f"{len(regressoes)} regressão(ões): {', '.join(regressoes)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
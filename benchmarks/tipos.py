@@ -0,0 +1,73 @@
+"""Memória e tempo de agregação: colunas como o driver entrega (Decimal/date/str em object) x tipadas (_tipar).
+
+Gera despesas sintéticas no formato de get_despesas_realizadas, sem precisar de banco:
+    python benchmarks/tipos.py --linhas 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+import pandas as pd
+from app import _tipar
+
+CATEGORIAS = ["Diesel", "Emulsão", "Pedra 01", "MÃO DE OBRA", "Outros", "IPITHERM", "Mat/ Água", "Frete", "Aluguel", "Combustível"]
+
+def gerar_bruto(linhas, obras=200, semente=42):
+    # Mesmos tipos Python que o psycopg2 devolve para NUMERIC(15,2), DATE e VARCHAR
+    rnd = random.Random(semente)
+    inicio = date(2022, 1, 1)
+    return pd.DataFrame({
+        'id': range(1, linhas + 1),
+        'projeto': [f"Obra {rnd.randrange(obras):03d}" for _ in range(linhas)],
+        'categoria': [rnd.choice(CATEGORIAS) for _ in range(linhas)],
+        'valor': [Decimal(rnd.randrange(100, 5_000_000)) / 100 for _ in range(linhas)],
+        'data_pagamento': [inicio + timedelta(days=rnd.randrange(1500)) for _ in range(linhas)],
+        'status': [rnd.choice(["Pago", "Pago", "Pago", "Pendente"]) for _ in range(linhas)],
+    })
+
+def cronometrar(func, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter(); func(); tempos.append(time.perf_counter() - t)
+    return min(tempos) * 1000
+
+def operacoes(df):
+    # Agregações típicas do dashboard (Pareto por categoria, totais por obra, desembolso mensal, total pago)
+    return {
+        'groupby categoria': lambda: df.groupby('categoria', observed=True)['valor'].sum(),
+        'groupby obra': lambda: df.groupby('projeto', observed=True)['valor'].sum(),
+        'mensal': lambda: df.groupby(pd.to_datetime(df['data_pagamento']).dt.to_period('M'))['valor'].sum(),
+        'total pago': lambda: df.loc[df['status'] == 'Pago', 'valor'].sum(),
+        'astype(float)': lambda: df['valor'].astype(float),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, default=200_000)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    bruto = gerar_bruto(args.linhas)
+    t = time.perf_counter()
+    tipado = _tipar(bruto.copy(), dinheiro=['valor'], datas=['data_pagamento'], categorias=['projeto', 'categoria', 'status'])
+    t_conversao = (time.perf_counter() - t) * 1000
+
+    mb = lambda df: df.memory_usage(deep=True).sum() / 1024 ** 2
+    print(f"{args.linhas} linhas (conversão _tipar: {t_conversao:.0f} ms)")
+    print(f"{'':20s} {'object':>12s} {'tipado':>12s} {'ganho':>8s}")
+    print(f"{'memória (MB)':20s} {mb(bruto):12.1f} {mb(tipado):12.1f} {mb(bruto) / mb(tipado):7.1f}x")
+    ops_bruto, ops_tipado = operacoes(bruto), operacoes(tipado)
+    for nome in ops_bruto:
+        a, b = cronometrar(ops_bruto[nome], args.repeticoes), cronometrar(ops_tipado[nome], args.repeticoes)
+        print(f"{nome + ' (ms)':20s} {a:12.1f} {b:12.1f} {a / b:7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# Configuração do gunicorn (lida automaticamente: gunicorn app:server)
+# As migrações rodam uma única vez no processo master, antes de criar os workers;
+# os workers só importam o app e não tocam no banco durante o boot.
+import os
+
+def on_starting(server):
+    if os.getenv("MIGRAR_AO_INICIAR", "1") != "1": return
+    from alembic import command
+    from alembic.config import Config
+    command.upgrade(Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")), "head")
+
+def post_worker_init(worker):
+    # O worker já aceita conexões; pandas/plotly.express (imports tardios do app) aquecem em segundo plano
+    import importlib, threading
+    threading.Thread(target=lambda: [importlib.import_module(m) for m in ("pandas", "plotly.express")], daemon=True).start()
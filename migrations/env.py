@@ -0,0 +1,32 @@
+import os
+from alembic import context
+from sqlalchemy import create_engine, pool
+from dotenv import load_dotenv
+
+# Mesma resolução de URL do app.py (sem importar o app, que carrega Dash e o pool de conexões)
+load_dotenv()
+
+def _url_banco():
+    db_url = os.getenv("DATABASE_URL") or "sqlite:///local_test.db"
+    if db_url.startswith("postgres://"): db_url = db_url.replace("postgres://", "postgresql://", 1)
+    return db_url
+
+def run_migrations_offline():
+    # alembic upgrade head --sql -> gera o script SQL sem conectar no banco
+    context.configure(url=_url_banco(), literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction(): context.run_migrations()
+
+def run_migrations_online():
+    # Quando chamado pelo app (python app.py migrar) reaproveita a conexão recebida em config.attributes
+    conn = context.config.attributes.get("connection")
+    if conn is not None:
+        context.configure(connection=conn)
+        with context.begin_transaction(): context.run_migrations()
+        return
+    engine = create_engine(_url_banco(), poolclass=pool.NullPool)
+    with engine.connect() as conn:
+        context.configure(connection=conn)
+        with context.begin_transaction(): context.run_migrations()
+
+if context.is_offline_mode(): run_migrations_offline()
+else: run_migrations_online()
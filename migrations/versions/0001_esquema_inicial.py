@@ -0,0 +1,88 @@
+"""esquema inicial (antes criado por init_db/update_db_schema no import do app)
+
+Idempotente: bancos que já existiam recebem só as tabelas e colunas que faltam.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _existentes():
+    # Em modo --sql não há conexão para inspecionar: gera o esquema completo
+    if op.get_context().as_sql: return set(), {}
+    insp = sa.inspect(op.get_bind())
+    tabelas = set(insp.get_table_names())
+    return tabelas, {t: {c['name'] for c in insp.get_columns(t)} for t in tabelas}
+
+
+def upgrade():
+    tabelas, colunas = _existentes()
+
+    if 'projetos' not in tabelas:
+        op.create_table('projetos',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('nome', sa.String(255)),
+            sa.Column('empresa', sa.String(100), server_default='Própria'))
+    elif 'empresa' not in colunas['projetos']:
+        op.add_column('projetos', sa.Column('empresa', sa.String(100), server_default='Própria'))
+
+    if 'cronograma_etapas' not in tabelas:
+        op.create_table('cronograma_etapas',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('projeto_id', sa.Integer, sa.ForeignKey('projetos.id')),
+            sa.Column('etapa', sa.String(100)),
+            sa.Column('data_inicio', sa.Date), sa.Column('data_fim', sa.Date),
+            sa.Column('valor_estimado', sa.Numeric(15, 2), server_default='0'),
+            sa.Column('status', sa.String(50), server_default='A Fazer'),
+            sa.Column('percentual', sa.Integer, server_default='0'))
+    elif 'percentual' not in colunas['cronograma_etapas']:
+        op.add_column('cronograma_etapas', sa.Column('percentual', sa.Integer, server_default='0'))
+
+    if 'despesas' not in tabelas:
+        op.create_table('despesas',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('projeto_id', sa.Integer, sa.ForeignKey('projetos.id')),
+            sa.Column('categoria', sa.String(100)), sa.Column('descricao', sa.String(255)),
+            sa.Column('valor', sa.Numeric(15, 2)), sa.Column('data_pagamento', sa.Date),
+            sa.Column('status', sa.String(50), server_default='Pago'))
+
+    if 'permutas' not in tabelas:
+        op.create_table('permutas',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('projeto_id', sa.Integer, sa.ForeignKey('projetos.id')),
+            sa.Column('descricao', sa.String(255)), sa.Column('data_permuta', sa.Date),
+            sa.Column('valor', sa.Numeric(15, 2), server_default='0'))
+
+    if 'historico_fisico' not in tabelas:
+        op.create_table('historico_fisico',
+            sa.Column('id', sa.Integer, primary_key=True),
+            sa.Column('etapa_id', sa.Integer, sa.ForeignKey('cronograma_etapas.id', ondelete='CASCADE')),
+            sa.Column('data_registro', sa.Date, server_default=sa.text('CURRENT_DATE')),
+            sa.Column('percentual_novo', sa.Integer))
+
+    if 'versao_dados' not in tabelas:
+        op.create_table('versao_dados',
+            sa.Column('tabela', sa.String(100), primary_key=True),
+            sa.Column('versao', sa.Integer, server_default='0'))
+
+    if 'fluxo_mensal' not in tabelas:
+        op.create_table('fluxo_mensal',
+            sa.Column('projeto_id', sa.Integer, sa.ForeignKey('projetos.id'), primary_key=True),
+            sa.Column('mes', sa.Date, primary_key=True),
+            sa.Column('orcado', sa.Float, server_default='0'),
+            sa.Column('realizado', sa.Float, server_default='0'),
+            sa.Column('projetado', sa.Float, server_default='0'),
+            sa.Column('calculado_em', sa.Date))
+
+
+def downgrade():
+    for tabela in ['fluxo_mensal', 'versao_dados', 'historico_fisico', 'permutas', 'despesas', 'cronograma_etapas', 'projetos']:
+        op.drop_table(tabela)
@@ -0,0 +1,38 @@
+"""índices das consultas filtradas por obra/data
+
+Sem eles todo filtro do dashboard vira varredura sequencial. No Postgres os índices são
+criados com CONCURRENTLY (fora de transação) para não bloquear escritas durante o deploy.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDICES = [
+    ('ix_despesas_projeto_id', 'despesas', ['projeto_id']),
+    ('ix_despesas_data_pagamento', 'despesas', ['data_pagamento']),
+    ('ix_permutas_projeto_id', 'permutas', ['projeto_id']),
+    ('ix_cronograma_projeto_inicio', 'cronograma_etapas', ['projeto_id', 'data_inicio']),
+    ('ix_cronograma_fim_percentual', 'cronograma_etapas', ['data_fim', 'percentual']),  # get_detalhes_atraso
+    ('ix_historico_etapa_data', 'historico_fisico', ['etapa_id', 'data_registro']),
+]
+
+
+def upgrade():
+    postgres = op.get_context().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for nome, tabela, colunas in INDICES:
+            op.create_index(nome, tabela, colunas, if_not_exists=True, postgresql_concurrently=postgres)
+
+
+def downgrade():
+    postgres = op.get_context().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for nome, tabela, _ in reversed(INDICES):
+            op.drop_index(nome, table_name=tabela, if_exists=True, postgresql_concurrently=postgres)
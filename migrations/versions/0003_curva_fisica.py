@@ -0,0 +1,27 @@
+"""curva_fisica: avanço físico ponderado por valor, por obra e dia
+
+Guarda só os dias em que o avanço da obra mudou (a curva é uma escada); é mantida pelo app
+a cada registro em historico_fisico e pode ser refeita com "python app.py reconstruir-curva".
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('curva_fisica',
+        sa.Column('projeto_id', sa.Integer, sa.ForeignKey('projetos.id'), primary_key=True),
+        sa.Column('data', sa.Date, primary_key=True),
+        sa.Column('percentual', sa.Float, server_default='0'))
+
+
+def downgrade():
+    op.drop_table('curva_fisica')
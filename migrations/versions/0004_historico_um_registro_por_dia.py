@@ -0,0 +1,30 @@
+"""historico_fisico: um registro por etapa por dia
+
+Colapsa os registros repetidos do mesmo dia (fica o último salvo) e troca o índice
+(etapa_id, data_registro) da 0002 por um índice único, alvo do upsert feito pelo app.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    postgres = op.get_context().dialect.name == 'postgresql'
+    op.execute("DELETE FROM historico_fisico WHERE id NOT IN (SELECT MAX(id) FROM historico_fisico GROUP BY etapa_id, data_registro)")
+    with op.get_context().autocommit_block():
+        op.create_index('ux_historico_etapa_dia', 'historico_fisico', ['etapa_id', 'data_registro'], unique=True, if_not_exists=True, postgresql_concurrently=postgres)
+        op.drop_index('ix_historico_etapa_data', table_name='historico_fisico', if_exists=True, postgresql_concurrently=postgres)
+
+
+def downgrade():
+    postgres = op.get_context().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index('ix_historico_etapa_data', 'historico_fisico', ['etapa_id', 'data_registro'], if_not_exists=True, postgresql_concurrently=postgres)
+        op.drop_index('ux_historico_etapa_dia', table_name='historico_fisico', if_exists=True, postgresql_concurrently=postgres)
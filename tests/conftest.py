@@ -0,0 +1,22 @@
+"""Testes rodam contra um SQLite temporário (migrado) e um diretório de cache próprio, nunca contra o DATABASE_URL do ambiente."""
+import os
+import sys
+import tempfile
+
+PASTA = tempfile.mkdtemp(prefix="obras_testes_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(PASTA, 'testes.db')}"
+os.environ["CALLBACK_CACHE_DIR"] = os.path.join(PASTA, "callbacks")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import app
+
+@pytest.fixture(scope="session", autouse=True)
+def banco():
+    app.migrar()
+    yield app.engine
+
+@pytest.fixture(autouse=True)
+def caches_limpos():
+    app._cache_tabelas.clear(); app._cache_figuras.clear()
+    yield
@@ -0,0 +1,27 @@
+import pytest
+
+import app
+
+@pytest.fixture
+def cliente():
+    return app.server.test_client()
+
+@pytest.mark.parametrize("recurso", ["kpis", "resumo-financeiro"])
+@pytest.mark.parametrize("periodo", ["inicio=2025-01", "fim=2025-12", "inicio=2025-01&fim=2025-12"])
+def test_totais_recusam_periodo(cliente, recurso, periodo):
+    assert cliente.get(f"/api/v1/{recurso}?projeto=3&{periodo}").status_code == 400
+
+@pytest.mark.parametrize("recurso", ["orcado-realizado", "projecao"])
+def test_series_aceitam_periodo(cliente, recurso):
+    assert cliente.get(f"/api/v1/{recurso}?inicio=2025-01&fim=2025-12").status_code == 200
+
+def test_etag_devolve_304_sem_agregar(cliente, monkeypatch):
+    etag = cliente.get("/api/v1/kpis?projeto=3").headers["ETag"]
+    monkeypatch.setattr(app, "get_totais_projetos", lambda *a: pytest.fail("agregou no 304"))
+    r = cliente.get("/api/v1/kpis?projeto=3", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.headers["ETag"] == etag
+
+def test_etag_muda_com_escrita(cliente):
+    etag = cliente.get("/api/v1/kpis").headers["ETag"]
+    with app.engine.connect() as conn: app.registrar_escrita(conn, "despesas"); conn.commit()
+    assert cliente.get("/api/v1/kpis", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,24 @@
+import pandas as pd
+import pytest
+import app
+
+def _fallback_vazio():
+    return pd.DataFrame(columns=['id', 'nome', 'empresa', 'vl_contrato', 'vl_fisico', 'vl_atraso', 'vl_pago', 'vl_permuta'])
+
+@pytest.mark.parametrize("backend", ["pandas", "polars"])
+def test_resumo_financeiro_com_fallback_vazio(monkeypatch, backend):
+    # Sem banco, get_totais_projetos devolve um frame vazio de colunas object: os dois backends devolvem vazio
+    monkeypatch.setattr(app, "BACKEND_AGREGACAO", backend)
+    monkeypatch.setattr(app, "get_totais_projetos", lambda filtro_id=None: _fallback_vazio())
+    df = app.get_tabela_resumo_financeiro()
+    assert df.empty and {'saldo', 'perc_pago'} <= set(df.columns)
+
+def test_resumo_financeiro_polars_igual_ao_pandas(monkeypatch):
+    totais = pd.DataFrame({'id': [2, 1, 3], 'nome': ['B', 'A', 'C'], 'empresa': ['Própria'] * 3, 'vl_contrato': [100.0, 0.0, 0.0],
+                           'vl_fisico': [50.0, 0.0, 0.0], 'vl_atraso': [0.0] * 3, 'vl_pago': [30.0, 10.0, 0.0], 'vl_permuta': [20.0, 0.0, 0.0]})
+    monkeypatch.setattr(app, "get_totais_projetos", lambda filtro_id=None: totais.copy())
+    resultados = {}
+    for backend in ("pandas", "polars"):
+        monkeypatch.setattr(app, "BACKEND_AGREGACAO", backend)
+        resultados[backend] = app.get_tabela_resumo_financeiro().reset_index(drop=True)
+    pd.testing.assert_frame_equal(resultados["pandas"], resultados["polars"], check_dtype=False)
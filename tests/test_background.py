@@ -0,0 +1,62 @@
+"""Callbacks em segundo plano rodam em processos filhos: o que eles contam e carregam tem de chegar ao worker."""
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+import app
+
+def disparar_background(cliente, saida, valores, gatilho, limite_s=60):
+    # Como o navegador: POST inicial devolve cacheKey/job; o resultado vem nos POSTs seguintes com esses parâmetros
+    chave = next(k for k in app.app.callback_map if saida in k.strip(".").split("..."))
+    spec = app.app.callback_map[chave]
+    corpo = {"output": chave, "outputs": dict(zip(("id", "property"), saida.rsplit(".", 1))),
+             "inputs": [{**i, "value": valores.get(f"{i['id']}.{i['property']}")} for i in spec["inputs"]],
+             "state": [{**s, "value": valores.get(f"{s['id']}.{s['property']}")} for s in spec["state"]],
+             "changedPropIds": [gatilho]}
+    job = cliente.post("/_dash-update-component", json=corpo).get_json()
+    fim = time.time() + limite_s
+    while time.time() < fim:
+        r = cliente.post(f"/_dash-update-component?cacheKey={job['cacheKey']}&job={job['job']}", json=corpo)
+        if r.status_code == 200 and "response" in r.get_json(): return r.get_json()["response"]
+        time.sleep(0.1)
+    raise TimeoutError(saida)
+
+@pytest.fixture
+def obra(banco):
+    with banco.connect() as conn:
+        pid = conn.execute(text("INSERT INTO projetos (nome, empresa) VALUES ('Obra background', 'Própria') RETURNING id")).scalar()
+        conn.execute(text("INSERT INTO cronograma_etapas (projeto_id, etapa, data_inicio, data_fim, valor_estimado, status, percentual) "
+                          "VALUES (:p, 'BASE', :d, :d, 1000, 'A Fazer', 0)"), {"p": pid, "d": date.today()})
+        conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:p, 'Diesel', 'x', 10, :d, 'Pago')"), {"p": pid, "d": date.today()})
+        app.registrar_escrita(conn, "projetos", "cronograma_etapas", "despesas")
+        conn.commit()
+    yield pid
+    with banco.connect() as conn:
+        for t in ("despesas", "cronograma_etapas", "fluxo_mensal"): conn.execute(text(f"DELETE FROM {t} WHERE projeto_id = :p"), {"p": pid})
+        conn.execute(text("DELETE FROM projetos WHERE id = :p"), {"p": pid})
+        app.registrar_escrita(conn, "projetos", "cronograma_etapas", "despesas")
+        conn.commit()
+
+def test_contadores_do_job_chegam_ao_worker(obra):
+    cliente = app.server.test_client()
+    app.queries_por_callback.clear()
+    antes = dict(app.cache_stats)
+    disparar_background(cliente, "conteudo-resumo-global.children", {"filtro-global-obra.value": obra}, "filtro-global-obra.value")
+    disparar_background(cliente, "grafico-pareto.figure", {"filtro-fin.value": "todos", "switch-pareto.value": "realizado"}, "filtro-fin.value")
+    status = cliente.get("/_interno/cache").get_json()
+    assert status["queries_por_callback"]["update_resumo_global_content"]["chamadas"] == 1
+    assert status["queries_por_callback"]["update_resumo_global_content"]["queries"] > 0
+    assert status["queries_por_callback"]["update_pareto"]["chamadas"] == 1
+    assert status["misses"] > antes["misses"]
+    assert 'dash_callback_duracao_segundos_count{callback="update_pareto"}' in cliente.get("/metrics").get_data(as_text=True)
+
+def test_tabela_carregada_no_job_fica_no_cache_do_worker(obra):
+    cliente = app.server.test_client()
+    disparar_background(cliente, "grafico-pareto.figure", {"filtro-fin.value": "Obra background", "switch-pareto.value": "realizado"}, "filtro-fin.value")
+    cliente.get("/_interno/cache")
+    assert ("get_despesas_realizadas",) in app._cache_tabelas
+    # O próximo acesso no worker é acerto de cache, sem consultar o banco
+    hits = app.cache_stats["hits"]
+    assert not app.get_despesas_realizadas().empty and app.cache_stats["hits"] == hits + 1
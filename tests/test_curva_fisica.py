@@ -0,0 +1,52 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import app
+
+def _curva(conn, pid):
+    return [(str(d), round(float(p), 9)) for d, p in conn.execute(text("SELECT data, percentual FROM curva_fisica WHERE projeto_id = :p ORDER BY data"), {"p": pid})]
+
+@pytest.fixture
+def obra(banco):
+    # Duas etapas com histórico em dias anteriores; curva materializada pela reconstrução completa
+    hoje = date.today()
+    with banco.connect() as conn:
+        pid = conn.execute(text("INSERT INTO projetos (nome, empresa) VALUES ('Obra curva', 'Própria') RETURNING id")).scalar()
+        etapas = [conn.execute(text("INSERT INTO cronograma_etapas (projeto_id, etapa, data_inicio, data_fim, valor_estimado, status, percentual) "
+                                    "VALUES (:p, :e, :i, :f, :v, 'Em Andamento', :perc) RETURNING id"),
+                               {"p": pid, "e": e, "i": hoje - timedelta(days=30), "f": hoje + timedelta(days=30), "v": v, "perc": perc}).scalar()
+                  for e, v, perc in (("BASE", 1000.0, 50), ("CBUQ", 3000.0, 20))]
+        for eid, dias, perc in ((etapas[0], 10, 30), (etapas[0], 5, 50), (etapas[1], 3, 20)):
+            conn.execute(text("INSERT INTO historico_fisico (etapa_id, data_registro, percentual_novo) VALUES (:e, :d, :p)"), {"e": eid, "d": hoje - timedelta(days=dias), "p": perc})
+        app.reconstruir_curva_fisica(conn)
+        conn.commit()
+    yield pid, etapas
+    with banco.connect() as conn:
+        for t, col in (("historico_fisico", "etapa_id IN (SELECT id FROM cronograma_etapas WHERE projeto_id = :p)"), ("curva_fisica", "projeto_id = :p"),
+                       ("cronograma_etapas", "projeto_id = :p"), ("projetos", "id = :p")):
+            conn.execute(text(f"DELETE FROM {t} WHERE {col}"), {"p": pid})
+        conn.commit()
+
+def test_avanco_desfeito_no_mesmo_dia_igual_a_reconstrucao(banco, obra):
+    pid, etapas = obra
+    with banco.connect() as conn:
+        # Avanço e desfazer no mesmo dia, como no formulário de etapas
+        for perc, anterior in ((80, 20), (20, 80)):
+            app.registrar_avanco(conn, etapas[1], perc, anterior)
+            app.atualizar_curva_fisica(conn, pid, desde=date.today())
+        incremental = _curva(conn, pid)
+        app.reconstruir_curva_fisica(conn)
+        assert incremental == _curva(conn, pid)
+        conn.rollback()
+
+def test_avanco_incremental_igual_a_reconstrucao(banco, obra):
+    pid, etapas = obra
+    with banco.connect() as conn:
+        app.registrar_avanco(conn, etapas[0], 90, 50)
+        app.atualizar_curva_fisica(conn, pid, desde=date.today())
+        incremental = _curva(conn, pid)
+        app.reconstruir_curva_fisica(conn)
+        assert incremental == _curva(conn, pid) and len(incremental) == 4
+        conn.rollback()
@@ -0,0 +1,74 @@
+from sqlalchemy import text
+
+import app
+
+COLUNAS = app.PAGINACAO['despesas']['colunas']
+NUMERICAS = app.PAGINACAO['despesas']['numericas']
+
+def interpretar(q):
+    return app._interpretar_filtro(q, COLUNAS, NUMERICAS)
+
+def test_comparacao_numerica():
+    clausulas, params = interpretar("{valor} >= 100")
+    assert clausulas == [f"{COLUNAS['valor']} >= :f0"] and params == {"f0": 100.0}
+
+def test_operador_por_extenso_e_colado():
+    assert interpretar("{valor} ge 10")[1] == {"f0": 10.0}
+    assert interpretar("{valor} <=5")[0] == [f"{COLUNAS['valor']} <= :f0"]
+
+def test_valor_com_espaco_e_operador_por_extenso():
+    clausulas, params = interpretar('{descricao} contains "bridge ge x"')
+    assert clausulas[0].startswith("LOWER(") and params == {"f0": "%bridge ge x%"}
+
+def test_valor_com_caracteres_de_operador():
+    for valor in ("a=b", "<3", "x >= y", "!= z"):
+        clausulas, params = interpretar(f'{{descricao}} contains "{valor}"')
+        assert "LIKE" in clausulas[0] and params == {"f0": f"%{valor.lower()}%"}
+
+def test_valor_sem_aspas_com_operador():
+    assert interpretar("{descricao} contains a=b")[1] == {"f0": "%a=b%"}
+
+def test_e_comercial_duplo_dentro_de_aspas():
+    clausulas, params = interpretar('{descricao} contains "a && b" && {valor} > 5')
+    assert len(clausulas) == 2 and params == {"f0": "%a && b%", "f1": 5.0}
+
+def test_aspas_escapadas():
+    assert interpretar(r'{descricao} contains "diz \"oi\" && sai"')[1] == {"f0": '%diz "oi" && sai%'}
+
+def test_prefixo_s_faz_contains_sensivel():
+    clausulas, params = interpretar('{categoria} scontains "Diesel"')
+    assert "LOWER" not in clausulas[0] and params == {"f0": "Diesel"}
+    assert interpretar('{categoria} icontains "Diesel"')[1] == {"f0": "%diesel%"}
+
+def test_datestartswith_com_ano_sem_aspas():
+    assert interpretar("{data_pagamento} datestartswith 2025")[1] == {"f0": "2025%"}
+
+def test_contains_com_numero_fica_texto():
+    assert interpretar("{descricao} contains 2024")[1] == {"f0": "%2024%"}
+    assert interpretar("{categoria} contains 01")[1] == {"f0": "%01%"}
+
+def test_comparacao_so_converte_coluna_numerica():
+    assert interpretar("{valor} = 01")[1] == {"f0": 1.0}
+    assert interpretar("{status} = 01")[1] == {"f0": "01"}
+    assert interpretar("{data_pagamento} >= 2025-01-01")[1] == {"f0": "2025-01-01"}
+    assert interpretar("{valor} > abc") == ([], {})
+
+def test_coluna_desconhecida_e_clausula_invalida_sao_ignoradas():
+    assert interpretar("{senha} = 1 && lixo && {valor} > 2") == ([f"{COLUNAS['valor']} > :f2"], {"f2": 2.0})
+
+def test_filtros_comuns_encontram_linhas_no_banco(banco):
+    # Os filtros digitados na tabela paginada (número sem aspas, ano na coluna de data, s/i) chegam ao banco certos
+    with banco.connect() as conn:
+        pid = conn.execute(text("INSERT INTO projetos (nome, empresa) VALUES ('Obra filtro', 'Própria') RETURNING id")).scalar()
+        conn.execute(text("INSERT INTO despesas (projeto_id, categoria, descricao, valor, data_pagamento, status) VALUES (:p, 'Pedra 01', 'Nota 2024 Diesel', 50, '2025-03-10', 'Pago')"), {"p": pid})
+        app.registrar_escrita(conn, "despesas"); conn.commit()
+    try:
+        casos = {"{data_pagamento} datestartswith 2025": 1, "{descricao} contains 2024": 1, "{categoria} contains 01": 1,
+                 "{descricao} scontains Diesel": 1, "{descricao} scontains diesel": 0, "{descricao} icontains diesel": 1, "{valor} >= 50": 1}
+        for filtro, esperado in casos.items():
+            _, total, _ = app.get_pagina('despesas', 0, 10, filter_query=f"{{projeto}} contains \"Obra filtro\" && {filtro}")
+            assert total == esperado, filtro
+    finally:
+        with banco.connect() as conn:
+            conn.execute(text("DELETE FROM despesas WHERE projeto_id = :p"), {"p": pid}); conn.execute(text("DELETE FROM projetos WHERE id = :p"), {"p": pid})
+            app.registrar_escrita(conn, "despesas"); conn.commit()
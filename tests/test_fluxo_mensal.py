@@ -0,0 +1,71 @@
+"""_calcular_fluxo (espalhamento vetorizado por mês) x a implementação linha a linha que ele substituiu."""
+import pandas as pd
+import pytest
+from dateutil.relativedelta import relativedelta
+
+import app
+
+HOJE = pd.Timestamp("2025-06-15")
+
+def _orcado_realizado_linha_a_linha(df_crono, df_desp, df_perm):
+    # Como era calcular_orcado_vs_realizado antes da vetorização (agrupando por projeto_id em vez do nome)
+    lista_orcado = []
+    for _, row in df_crono.iterrows():
+        inicio, fim = pd.Timestamp(row['data_inicio']).replace(day=1), pd.Timestamp(row['data_fim']).replace(day=1)
+        meses = max((fim.year - inicio.year) * 12 + (fim.month - inicio.month) + 1, 1)
+        curr = inicio
+        for _ in range(meses):
+            lista_orcado.append({'projeto_id': row['projeto_id'], 'mes': curr, 'orcado': float(row['valor_estimado']) / meses, 'realizado': 0.0})
+            curr += relativedelta(months=1)
+    lista_realizado = []
+    for df, col_data in [(df_desp, 'data_pagamento'), (df_perm, 'data_permuta')]:
+        for _, row in df.iterrows():
+            lista_realizado.append({'projeto_id': row['projeto_id'], 'mes': pd.Timestamp(row[col_data]).replace(day=1), 'orcado': 0.0, 'realizado': float(row['valor'])})
+    df_final = pd.concat([pd.DataFrame(lista_orcado), pd.DataFrame(lista_realizado)])
+    return df_final.groupby(['projeto_id', 'mes'])[['orcado', 'realizado']].sum().reset_index()
+
+def _projecao_linha_a_linha(df_crono, today):
+    # Como era calcular_projecao_futura antes da vetorização
+    df = df_crono.copy()
+    df['percentual'] = pd.to_numeric(df['percentual'], errors='coerce').fillna(0)
+    df_aberto = df[(df['status'] != 'Concluído') & (df['percentual'] < 100)].copy()
+    df_aberto['data_inicio'] = pd.to_datetime(df_aberto['data_inicio'])
+    df_aberto['data_fim'] = pd.to_datetime(df_aberto['data_fim'])
+    lista = []
+    for _, row in df_aberto.iterrows():
+        start_date, end_date = max(today, row['data_inicio']), row['data_fim']
+        valor_restante = float(row['valor_estimado']) * (1 - (float(row['percentual']) / 100))
+        if valor_restante <= 0: continue
+        if end_date <= start_date:
+            lista.append({'projeto_id': row['projeto_id'], 'mes': today.replace(day=1), 'projetado': valor_restante})
+        else:
+            meses = max((end_date.year - start_date.year) * 12 + (end_date.month - start_date.month) + 1, 1)
+            curr = start_date.replace(day=1)
+            for _ in range(meses):
+                lista.append({'projeto_id': row['projeto_id'], 'mes': curr, 'projetado': valor_restante / meses})
+                curr += relativedelta(months=1)
+    return pd.DataFrame(lista).groupby(['projeto_id', 'mes'])['projetado'].sum().reset_index()
+
+def _etapa(pid, inicio, fim, valor, percentual, status):
+    return {'projeto_id': pid, 'data_inicio': inicio, 'data_fim': fim, 'valor_estimado': valor, 'status': status, 'percentual': percentual}
+
+CASOS = {
+    "mesmo mês": [_etapa(1, "2025-03-05", "2025-03-25", 1000.0, 50, "Em Andamento"), _etapa(1, "2025-07-02", "2025-07-30", 300.0, 0, "A Fazer")],
+    "fim antes do início": [_etapa(1, "2025-08-10", "2025-07-01", 1200.0, 0, "A Fazer"), _etapa(2, "2025-02-20", "2024-12-01", 900.0, 40, "Em Andamento")],
+    "percentual nulo": [_etapa(1, "2025-05-01", "2025-09-30", 5000.0, None, "A Fazer"), _etapa(2, "2025-07-01", "2026-02-10", 700.0, None, "A Fazer")],
+    "etapa vencida": [_etapa(1, "2025-01-01", "2025-04-30", 800.0, 25, "Em Andamento"), _etapa(2, "2024-10-10", "2025-06-15", 650.0, 90, "Em Andamento"),
+                      _etapa(2, "2024-01-01", "2024-03-01", 400.0, 100, "Concluído")],
+}
+
+@pytest.mark.parametrize("caso", list(CASOS))
+def test_fluxo_vetorizado_igual_ao_linha_a_linha(caso):
+    df_crono = pd.DataFrame(CASOS[caso])
+    df_desp = pd.DataFrame({'projeto_id': [1, 2, 1], 'valor': [120.0, 45.5, 30.0], 'data_pagamento': ["2025-03-31", "2025-01-01", "2025-06-15"]})
+    df_perm = pd.DataFrame({'projeto_id': [2], 'valor': [500.0], 'data_permuta': ["2025-02-14"]})
+    novo = app._calcular_fluxo(df_crono, df_desp, df_perm, hoje=HOJE)
+
+    orc = novo[(novo['orcado'] != 0) | (novo['realizado'] != 0)][['projeto_id', 'mes', 'orcado', 'realizado']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(orc, _orcado_realizado_linha_a_linha(df_crono, df_desp, df_perm), check_dtype=False)
+
+    proj = novo[novo['projetado'] > 0][['projeto_id', 'mes', 'projetado']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(proj, _projecao_linha_a_linha(df_crono, HOJE), check_dtype=False)
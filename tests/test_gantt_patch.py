@@ -0,0 +1,66 @@
+"""Patch do Gantt após salvar/excluir etapa: só quando reproduz a tela redesenhada; senão None (redesenho completo)."""
+from datetime import date
+
+import dash
+import pytest
+from sqlalchemy import text
+
+import app
+
+@pytest.fixture
+def obra(banco, monkeypatch):
+    monkeypatch.setattr(app, "GANTT_LINHAS_POR_PAGINA", 2)
+    with banco.connect() as conn:
+        pid = conn.execute(text("INSERT INTO projetos (nome, empresa) VALUES ('Obra gantt', 'Própria') RETURNING id")).scalar()
+        app.registrar_escrita(conn, "projetos"); conn.commit()
+    yield pid
+    with banco.connect() as conn:
+        conn.execute(text("DELETE FROM cronograma_etapas WHERE projeto_id = :p"), {"p": pid}); conn.execute(text("DELETE FROM projetos WHERE id = :p"), {"p": pid})
+        app.registrar_escrita(conn, "projetos", "cronograma_etapas"); conn.commit()
+
+def inserir(pid, etapa, inicio):
+    with app.engine.connect() as conn:
+        eid = conn.execute(text("INSERT INTO cronograma_etapas (projeto_id, etapa, data_inicio, data_fim, valor_estimado, status, percentual) "
+                                "VALUES (:p, :e, :i, '2026-12-31', 100, 'A Fazer', 0) RETURNING id"), {"p": pid, "e": etapa, "i": inicio}).scalar()
+        app.registrar_escrita(conn, "cronograma_etapas"); conn.commit()
+    return eid
+
+def tela(pid, pagina=1):
+    # O que update_view_projetos guarda em etapas-visiveis depois de desenhar a página
+    fig, paginas = app.gerar_figura_gantt(pid, pagina)
+    tabela = app.get_cronograma().query("projeto_id == @pid")['id_etapa'].astype(int).tolist()
+    return {'gantt': [int(c[0]) for c in fig['data'][0]['customdata']], 'tabela': tabela, 'paginas': paginas}
+
+def test_alteracao_sem_mudar_ordem_vira_patch(obra):
+    a = inserir(obra, "A", date(2025, 1, 1)); inserir(obra, "B", date(2025, 2, 1))
+    visiveis = tela(obra)
+    with app.engine.connect() as conn:
+        conn.execute(text("UPDATE cronograma_etapas SET percentual = 50 WHERE id = :id"), {"id": a}); app.registrar_escrita(conn, "cronograma_etapas"); conn.commit()
+    fig, _, novos = app._patch_view_etapa({'acao': 'salvar', 'id': a}, obra, visiveis, 1)
+    assert isinstance(fig, dash.Patch) and novos['gantt'] == visiveis['gantt']
+
+def test_insercao_no_fim_da_pagina_com_espaco_vira_patch(obra):
+    inserir(obra, "A", date(2025, 1, 1))
+    visiveis = tela(obra)
+    b = inserir(obra, "B", date(2025, 2, 1))
+    _, _, novos = app._patch_view_etapa({'acao': 'salvar', 'id': b}, obra, visiveis, 1)
+    assert novos['gantt'] == tela(obra)['gantt']
+
+def test_insercao_antes_das_visiveis_redesenha(obra):
+    inserir(obra, "B", date(2025, 2, 1))
+    visiveis = tela(obra)
+    a = inserir(obra, "A", date(2025, 1, 1))  # ordena antes de B
+    assert app._patch_view_etapa({'acao': 'salvar', 'id': a}, obra, visiveis, 1) is None
+
+def test_insercao_que_cria_pagina_redesenha(obra):
+    inserir(obra, "A", date(2025, 1, 1)); inserir(obra, "B", date(2025, 2, 1))
+    visiveis = tela(obra)
+    c = inserir(obra, "C", date(2025, 3, 1))  # terceira etapa: vai para a página 2
+    assert app._patch_view_etapa({'acao': 'salvar', 'id': c}, obra, visiveis, 1) is None
+
+def test_exclusao_com_proxima_pagina_redesenha(obra):
+    a = inserir(obra, "A", date(2025, 1, 1)); inserir(obra, "B", date(2025, 2, 1)); inserir(obra, "C", date(2025, 3, 1)); inserir(obra, "D", date(2025, 4, 1))
+    visiveis = tela(obra)
+    with app.engine.connect() as conn:
+        conn.execute(text("DELETE FROM cronograma_etapas WHERE id = :id"), {"id": a}); app.registrar_escrita(conn, "cronograma_etapas"); conn.commit()
+    assert app._patch_view_etapa({'acao': 'excluir', 'id': a}, obra, visiveis, 1) is None  # C sobe para a página 1